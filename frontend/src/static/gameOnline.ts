@@ -1,6 +1,6 @@
 import { Ball } from './ball'
 import { playerOne, playerTwo, ball, clientTick, drawPlayerScores,
-    heartbeatFrequencyMS, resetState, textColor } from './lib'
+    resetState, textColor } from './lib'
 
 interface MoveTS {
     type: string,
@@ -13,7 +13,7 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
         ownName: string, oppName: string) {
     const serverTick = 1000 / 66
     let firstStateReceived = false
-    let lastHearbeatSent = 0
+    let lastStateTick: number | undefined
 
     let p1Score = 0
     let p2Score = 0
@@ -120,13 +120,6 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
             then = now - (deltaTimeMS % clientTick)
             moveBall(ball)
         }
-        const dateNow = Date.now()
-        if (lastHearbeatSent === 0 || dateNow - lastHearbeatSent > heartbeatFrequencyMS) {
-            websocket.send(JSON.stringify(
-                {'type': 'HEARTBEAT', 'timestamp': dateNow}
-            ))
-            lastHearbeatSent = dateNow
-        }
     }
 
     function draw() {
@@ -182,6 +175,11 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
     let scoreReceived = false
     let scoreCounter = 0
 
+    // the game continues on the connection that replaced a restarted one
+    function handleReconnect(event: Event) {
+        websocket = (event as CustomEvent).detail.websocket as WebSocket
+    }
+
     function cleanup() {
         resetState()
         interpVelocityBall.x = 0
@@ -193,7 +191,7 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
         gameRunning = false
         pendingMoves = new Array<MoveTS>()
         firstStateReceived = false
-        lastHearbeatSent = 0
+        lastStateTick = undefined
         p1Score = 0
         p2Score = 0
         deltaTimeMS = 0
@@ -203,6 +201,7 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
 
         canvas.removeEventListener("keydown", handleKeyDown)
         canvas.removeEventListener("keyup", handleKeyUp)
+        window.removeEventListener("game-reconnect", handleReconnect)
     }
 
     async function gameSockOnMessage(event: MessageEvent) {
@@ -220,9 +219,13 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
                 const ballX = playerID === 2
                     ? mirrorX(ballServer.x, ball.radius * 2)
                     : ballServer.x
+                // the server may skip ticks when it lowers the state rate
+                const stateInterval = serverTick * (lastStateTick === undefined
+                    ? 1 : Math.max(JSONObject.tick - lastStateTick, 1))
+                lastStateTick = JSONObject.tick
                 interpVelocityBall = pointSubtract(new Point(ballX, ballServer.y), new Point(ball.x, ball.y))
-                interpVelocityBall.x /= serverTick
-                interpVelocityBall.y /= serverTick
+                interpVelocityBall.x /= stateInterval
+                interpVelocityBall.y /= stateInterval
                 if (scoreReceived) {
                     scoreCounter++
                 }
@@ -252,7 +255,7 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
                     playerOne.paddle.y = p2Server.y
                     updatePendingMoves(p2Server.last_ts)
                 }
-                interpVelocityEnemy.y /= serverTick
+                interpVelocityEnemy.y /= stateInterval
                 break
             case "LOBBY_WAIT":
                 console.log("Waiting for other players to connect...")
@@ -272,6 +275,11 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
                         break
                 }
                 break
+            case "RESUME":
+                // joined a match that was already under way
+                p1Score = JSONObject.score_player1 as number
+                p2Score = JSONObject.score_player2 as number
+                break
             case "GAME_END":
                 cleanup()
                 window.dispatchEvent(new CustomEvent('game-over', {
@@ -300,6 +308,7 @@ export async function gameOnlineLobby(canvas: HTMLCanvasElement,
     removeEventListener("keydown", handleKeyDown)
     removeEventListener("keyup", handleKeyUp)
     websocket.onmessage = gameSockOnMessage
+    window.addEventListener("game-reconnect", handleReconnect)
     const buffered = (websocket as any).__bufferedMessages as MessageEvent[] | undefined
     if (buffered && buffered.length > 0) {
         for (const msg of buffered) {
@@ -12,7 +12,12 @@ export const ballRadius = 15
 export const ballSize = ballRadius * 2
 // physics, the speeds need to be equal to the server
 const targetFPS = 60
-export const heartbeatFrequencyMS = 3000
+// the server closes a connection that sent no heartbeat for 3100ms
+export const heartbeatFrequencyMS = 1000
+// close code of a server restart, the client reconnects and rejoins its game
+export const closeServiceRestart = 1012
+export const reconnectAttempts = 10
+export const reconnectDelayMS = 1000
 export const clientTick = 1000 / targetFPS
 const ballSpeedPerTick = 0.4
 const paddleSpeedPerTick = 0.5
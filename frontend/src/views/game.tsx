@@ -3,6 +3,8 @@ import GameUI from "../components/game/gameUI.tsx"
 import { fetchWithAuth } from '../config/api'
 import type { GameMode, Screen } from "../components/game/types.ts"
 import { getAvatarUrl } from "../components/util/profileUtils.tsx"
+import { closeServiceRestart, heartbeatFrequencyMS, reconnectAttempts,
+  reconnectDelayMS } from "../static/lib.js"
 
 interface GameResult {
   gameMode: string
@@ -55,21 +57,77 @@ export default function Game() {
     const host = window.location.hostname
     const port = window.location.port
     const wsUrl = `wss://${host}:${port}/ws/${token}`
-    websocket.current = new WebSocket(wsUrl)
-    websocket.current.onopen = () => {
-      setWebsocketState(WebSocket.OPEN)
-    }
-    websocket.current.onerror = () => {
-      setWebsocketState(WebSocket.CLOSED)
-    }
-    websocket.current.onclose = (event: CloseEvent) => {
-      if (event.reason.length > 0) {
+    // the server times out connections without a heartbeat, in a lobby or not
+    let heartbeat: number | undefined
+    let unmounted = false
+    const connect = (previous: WebSocket | null, attempt: number) => {
+      const socket = new WebSocket(wsUrl)
+      websocket.current = socket
+      let opened = false
+      socket.onopen = () => {
+        opened = true
+        setWebsocketState(WebSocket.OPEN)
+        heartbeat = window.setInterval(() => {
+          socket.send(JSON.stringify(
+            {'type': 'HEARTBEAT', 'timestamp': Date.now()}
+          ))
+        }, heartbeatFrequencyMS)
+        if (previous !== null) {
+          rejoin(previous, socket)
+        }
+      }
+      socket.onerror = () => {
+        if (previous === null) {
+          setWebsocketState(WebSocket.CLOSED)
+        }
+      }
+      socket.onclose = (event: CloseEvent) => {
+        window.clearInterval(heartbeat)
+        // the match is handed over to the next server process, see
+        // server-side-pong/restart.py
+        if (event.code === closeServiceRestart && !unmounted) {
+          connect(socket, 0)
+          return
+        }
+        // the next process may not accept connections yet
+        if (previous !== null && !opened && !unmounted &&
+            attempt < reconnectAttempts) {
+          window.setTimeout(
+            () => connect(previous, attempt + 1), reconnectDelayMS)
+          return
+        }
+        if (event.reason.length > 0) {
             window.location.href = '/';
-        setError(event.reason)
+          setError(event.reason)
+        }
+        setWebsocketState(WebSocket.CLOSED)
+      }
+    }
+    // a running online game joins its lobby again on the new connection
+    const rejoin = (previous: WebSocket, socket: WebSocket) => {
+      const data = gameDataRef.current
+      if (gameModeRef.current !== 'online' || !data?.id) {
+        return
       }
-      setWebsocketState(WebSocket.CLOSED)
+      // messages buffered by the countdown or handled by the running game
+      socket.onmessage = previous.onmessage
+      Object.assign(socket, {
+        __bufferedMessages: (previous as any).__bufferedMessages
+      })
+      window.dispatchEvent(new CustomEvent('game-reconnect', {
+        detail: { websocket: socket }
+      }))
+      socket.send(JSON.stringify({
+        type: 'START_GAME',
+        game_id: data.id,
+        player1_id: data.player1_id,
+        player2_id: data.player2_id
+      }))
     }
+    connect(null, 0)
     return () => {
+      unmounted = true
+      window.clearInterval(heartbeat)
       if (!websocket.current) {
         return
       }
@@ -0,0 +1,226 @@
+"""
+Admission control for the opening handshake. Every check runs before the
+upgrade, cheapest first, and a refused client gets a plain HTTP response
+instead of a WebSocket that is closed right after opening:
+
+    503  over MAX_CONNECTIONS or MAX_CONCURRENT_HANDSHAKES
+    429  over the handshake rate of its address or of its user
+    401  missing or invalid token
+
+A handshake counts as in flight from the moment its TCP connection is
+accepted until it is answered, a client that connects and sends its request
+slowly or never holds a slot until the open timeout closes it.
+
+Verified tokens are cached until their `exp`, so a reconnecting client does
+not pay for another signature check.
+"""
+import asyncio
+import jwt
+from http import HTTPStatus
+from os import getenv
+from time import monotonic, time
+from websockets import Request, Response, ServerConnection
+from metrics import METRICS, Counter
+from logger import Logger
+
+MAX_CONNECTIONS = int(getenv('MAX_CONNECTIONS', '10000'))
+MAX_CONCURRENT_HANDSHAKES = int(getenv('MAX_CONCURRENT_HANDSHAKES', '64'))
+# handshakes per second and burst size of one client address
+IP_HANDSHAKE_RATE = float(getenv('IP_HANDSHAKE_RATE', '10'))
+IP_HANDSHAKE_BURST = 20
+# handshakes per second and burst size of one user id
+USER_HANDSHAKE_RATE = float(getenv('USER_HANDSHAKE_RATE', '1'))
+USER_HANDSHAKE_BURST = 5
+# nginx passes the client address in this header, empty uses the peer address
+CLIENT_IP_HEADER = getenv('CLIENT_IP_HEADER', 'X-Real-IP')
+TOKEN_CACHE_MAX = 100000
+# buckets and cached tokens are swept for stale entries this often
+PRUNE_SEC = 60
+RETRY_AFTER_SEC = 1
+
+REQUIRED_CLAIMS = ('userId', 'username', 'iat', 'exp')
+
+HANDSHAKES_ACCEPTED = METRICS.counter(
+    'pong_handshakes_accepted_total', 'Handshakes admitted')
+REJECTED_FULL = METRICS.counter(
+    'pong_handshakes_rejected_full_total',
+    'Handshakes refused over MAX_CONNECTIONS')
+REJECTED_BUSY = METRICS.counter(
+    'pong_handshakes_rejected_busy_total',
+    'Handshakes refused over MAX_CONCURRENT_HANDSHAKES')
+REJECTED_IP_RATE = METRICS.counter(
+    'pong_handshakes_rejected_ip_rate_total',
+    'Handshakes refused over the rate of their address')
+REJECTED_USER_RATE = METRICS.counter(
+    'pong_handshakes_rejected_user_rate_total',
+    'Handshakes refused over the rate of their user')
+REJECTED_TOKEN = METRICS.counter(
+    'pong_handshakes_rejected_token_total',
+    'Handshakes refused for a missing or invalid token')
+TOKEN_CACHE_HITS = METRICS.counter(
+    'pong_handshakes_token_cache_hits_total',
+    'Tokens accepted without checking their signature again')
+
+LOG = Logger('admission')
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+    tokens: float
+    updated: float
+
+    def __init__(self, burst: int, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: int, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + ((now - self.updated) * rate))
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """
+    One token bucket per key, buckets that refilled completely are dropped
+    when pruned since a fresh one behaves the same.
+    """
+    rate: float
+    burst: int
+    buckets: dict[object, TokenBucket]
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = dict()
+
+    def allow(self, key: object, now: float) -> bool:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.burst, now)
+        return bucket.take(self.rate, self.burst, now)
+
+    def prune(self, now: float):
+        refill_sec = self.burst / self.rate
+        self.buckets = {
+            key: bucket for key, bucket in self.buckets.items()
+            if now - bucket.updated < refill_sec
+        }
+
+
+class HandshakeConnection(ServerConnection):
+    """
+    Counts the handshakes in flight, the server creates every connection
+    through it.
+    """
+    # accepted connections whose opening handshake is not answered yet
+    handshakes: int = 0
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        HandshakeConnection.handshakes += 1
+        super().connection_made(transport)
+
+    async def handshake(self, *args, **kwargs):
+        try:
+            await super().handshake(*args, **kwargs)
+        finally:
+            HandshakeConnection.handshakes -= 1
+
+
+class Admission:
+    secret: str
+    ip_limiter: RateLimiter
+    user_limiter: RateLimiter
+    # encoded token to its claims, valid until the `exp` claim
+    tokens: dict[str, dict]
+    last_prune: float
+
+    def __init__(self, secret: str):
+        self.secret = secret
+        self.ip_limiter = RateLimiter(IP_HANDSHAKE_RATE, IP_HANDSHAKE_BURST)
+        self.user_limiter = RateLimiter(
+            USER_HANDSHAKE_RATE, USER_HANDSHAKE_BURST)
+        self.tokens = dict()
+        self.last_prune = monotonic()
+
+    def reject(
+            self, connection: ServerConnection, status: HTTPStatus,
+            reason: str, rejected: Counter) -> Response:
+        rejected.inc()
+        LOG.debug(f"handshake rejected: {reason}", connection=connection.id)
+        response = connection.respond(status, f"{reason}\n")
+        if status != HTTPStatus.UNAUTHORIZED:
+            response.headers['Retry-After'] = str(RETRY_AFTER_SEC)
+        return response
+
+    def client_ip(
+            self, connection: ServerConnection, request: Request) -> str:
+        if CLIENT_IP_HEADER and CLIENT_IP_HEADER in request.headers:
+            return request.headers[CLIENT_IP_HEADER]
+        return connection.remote_address[0]
+
+    def verify(self, token: str) -> dict | None:
+        claims = self.tokens.get(token)
+        if claims is not None and claims['exp'] > time():
+            TOKEN_CACHE_HITS.inc()
+            return claims
+        try:
+            claims = jwt.decode(token, self.secret, algorithms="HS256")
+        except jwt.InvalidTokenError:
+            return None
+        if any(claim not in claims for claim in REQUIRED_CLAIMS):
+            return None
+        if len(self.tokens) >= TOKEN_CACHE_MAX:
+            self.prune_tokens()
+        if len(self.tokens) < TOKEN_CACHE_MAX:
+            self.tokens[token] = claims
+        return claims
+
+    def prune_tokens(self):
+        now = time()
+        self.tokens = {
+            token: claims for token, claims in self.tokens.items()
+            if claims['exp'] > now
+        }
+
+    def admit(
+            self, connection: ServerConnection, request: Request,
+            connected: int) -> Response | dict:
+        """
+        Returns the token claims of an admitted client, otherwise the
+        response that refuses it.
+        """
+        now = monotonic()
+        if now - self.last_prune > PRUNE_SEC:
+            self.last_prune = now
+            self.ip_limiter.prune(now)
+            self.user_limiter.prune(now)
+            self.prune_tokens()
+        # the handshakes in flight include this one
+        handshakes = HandshakeConnection.handshakes
+        if connected + handshakes > MAX_CONNECTIONS:
+            return self.reject(
+                connection, HTTPStatus.SERVICE_UNAVAILABLE,
+                'Server is full', REJECTED_FULL)
+        if handshakes > MAX_CONCURRENT_HANDSHAKES:
+            return self.reject(
+                connection, HTTPStatus.SERVICE_UNAVAILABLE,
+                'Too many concurrent handshakes', REJECTED_BUSY)
+        if not self.ip_limiter.allow(self.client_ip(connection, request), now):
+            return self.reject(
+                connection, HTTPStatus.TOO_MANY_REQUESTS,
+                'Too many handshakes from this address', REJECTED_IP_RATE)
+        token = request.headers.get('Bearer')
+        claims = self.verify(token) if token is not None else None
+        if claims is None:
+            return self.reject(
+                connection, HTTPStatus.UNAUTHORIZED,
+                'Missing or invalid token', REJECTED_TOKEN)
+        if not self.user_limiter.allow(claims['userId'], now):
+            return self.reject(
+                connection, HTTPStatus.TOO_MANY_REQUESTS,
+                'Too many handshakes for this user', REJECTED_USER_RATE)
+        HANDSHAKES_ACCEPTED.inc()
+        return claims
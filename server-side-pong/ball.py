@@ -3,6 +3,10 @@ from math import pow
 
 
 class Ball:
+    __slots__ = (
+        'shape', 'dir_vect', 'movement_speed', 'max_speed', 'speed_incr',
+        'radius_px'
+    )
     shape: Rect
     dir_vect: Vector2
     movement_speed: int
@@ -0,0 +1,257 @@
+from gameinstance import (
+    GameInstance, ARENA_WIDTH, ARENA_HEIGHT, BALL_RADIUS, BALL_SIZE, ROUND_MAX,
+    capture_state, captured_state, handle_score, process_input,
+    record_history
+)
+from collision import HIT_NONE, HIT_X, HIT_Y, MAX_CONTACTS_PER_TICK
+from logger import Logger
+
+# paddle geometry is the same for every lobby, see GameInstance.__init__
+P1_X = 0
+P2_X = ARENA_WIDTH - BALL_SIZE
+PADDLE_WIDTH = BALL_SIZE
+PADDLE_HEIGHT = BALL_SIZE * 4
+
+LOG = Logger('lobby')
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class BatchPhysics:
+    """
+    Struct-of-arrays version of the per tick simulation in gameinstance.py.
+    The ball movement of every running lobby is computed in one vectorized
+    pass, input processing and scoring side effects still go through the
+    per object functions. `sweep_ball` in collision.py stays the reference
+    implementation, both paths produce the same positions.
+    """
+    capacity: int
+    ball_x: 'np.ndarray'
+    ball_y: 'np.ndarray'
+    dir_x: 'np.ndarray'
+    dir_y: 'np.ndarray'
+    speed: 'np.ndarray'
+    p1_y: 'np.ndarray'
+    p2_y: 'np.ndarray'
+    p1_score: 'np.ndarray'
+    p2_score: 'np.ndarray'
+
+    def __init__(self, capacity=64):
+        if np is None:
+            raise RuntimeError('Batch physics requires numpy')
+        self.allocate(capacity)
+
+    def allocate(self, capacity: int):
+        self.capacity = capacity
+        self.ball_x = np.zeros(capacity)
+        self.ball_y = np.zeros(capacity)
+        self.dir_x = np.zeros(capacity)
+        self.dir_y = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.p1_y = np.zeros(capacity)
+        self.p2_y = np.zeros(capacity)
+        self.p1_score = np.zeros(capacity, dtype=np.int64)
+        self.p2_score = np.zeros(capacity, dtype=np.int64)
+
+    def load(self, lobbies: list[GameInstance]):
+        n = len(lobbies)
+        if n > self.capacity:
+            self.allocate(max(n, self.capacity * 2))
+        self.ball_x[:n] = [g.ball.shape.x for g in lobbies]
+        self.ball_y[:n] = [g.ball.shape.y for g in lobbies]
+        self.dir_x[:n] = [g.ball.dir_vect.x for g in lobbies]
+        self.dir_y[:n] = [g.ball.dir_vect.y for g in lobbies]
+        # a ball waiting for its serve does not move
+        self.speed[:n] = [
+            g.ball.movement_speed if g.tick_count >= g.serve_tick else 0
+            for g in lobbies
+        ]
+        self.p1_y[:n] = [g.p1_paddle.shape.y for g in lobbies]
+        self.p2_y[:n] = [g.p2_paddle.shape.y for g in lobbies]
+        self.p1_score[:n] = [g.p1_score for g in lobbies]
+        self.p2_score[:n] = [g.p2_score for g in lobbies]
+
+    def store(self, lobbies: list[GameInstance]):
+        n = len(lobbies)
+        ball_x = self.ball_x[:n].tolist()
+        ball_y = self.ball_y[:n].tolist()
+        dir_x = self.dir_x[:n].tolist()
+        dir_y = self.dir_y[:n].tolist()
+        for i, game in enumerate(lobbies):
+            game.ball.shape.x = ball_x[i]
+            game.ball.shape.y = ball_y[i]
+            game.ball.dir_vect.x = dir_x[i]
+            game.ball.dir_vect.y = dir_y[i]
+
+    def move_balls(self, n: int):
+        """
+        Vectorized `sweep_ball`, see collision.py for the scalar version. A
+        ball without contact has no time left, so further passes leave it
+        untouched, like the early exit of the scalar loop.
+        """
+        r = BALL_RADIUS
+        speed = self.speed[:n]
+        cx = self.ball_x[:n] + r
+        cy = self.ball_y[:n] + r
+        dir_x = self.dir_x[:n].copy()
+        dir_y = self.dir_y[:n].copy()
+        remaining = np.ones(n)
+        for _ in range(MAX_CONTACTS_PER_TICK):
+            vx = dir_x * speed
+            vy = dir_y * speed
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = np.where(
+                    vy < 0, (r - cy) / vy, (ARENA_HEIGHT - r - cy) / vy)
+                t = np.maximum(t, 0.0)
+                take = (vy != 0) & (t < remaining)
+                best = np.where(take, t, remaining)
+                axis = np.where(take, HIT_Y, HIT_NONE)
+                for px, py in ((P1_X, self.p1_y[:n]), (P2_X, self.p2_y[:n])):
+                    best, axis = self.paddle_contacts(
+                        cx, cy, vx, vy, px, py, best, axis)
+            cx = cx + (vx * best)
+            cy = cy + (vy * best)
+            remaining = remaining - best
+            dir_x = np.where(axis == HIT_X, -dir_x, dir_x)
+            dir_y = np.where(axis == HIT_Y, -dir_y, dir_y)
+            if not remaining.any():
+                break
+        self.ball_x[:n] = cx - r
+        self.ball_y[:n] = cy - r
+        self.dir_x[:n] = dir_x
+        self.dir_y[:n] = dir_y
+
+    @staticmethod
+    def paddle_contacts(
+            cx: 'np.ndarray', cy: 'np.ndarray', vx: 'np.ndarray',
+            vy: 'np.ndarray', px: float, py: 'np.ndarray',
+            best: 'np.ndarray', axis: 'np.ndarray'
+            ) -> tuple['np.ndarray', 'np.ndarray']:
+        """
+        Vectorized `paddle_contact`, candidates are taken in the same order.
+        Only the balls whose sweep reaches the paddle are tested.
+        """
+        r = BALL_RADIUS
+        pw = PADDLE_WIDTH
+        ph = PADDLE_HEIGHT
+        end_x = cx + (vx * best)
+        end_y = cy + (vy * best)
+        far = (np.minimum(cx, end_x) - r > px + pw) | \
+            (np.maximum(cx, end_x) + r < px) | \
+            (np.minimum(cy, end_y) - r > py + ph) | \
+            (np.maximum(cy, end_y) + r < py)
+        lanes = np.flatnonzero(~far)
+        if lanes.size == 0:
+            return best, axis
+        all_best = best
+        all_axis = axis
+        cx = cx[lanes]
+        cy = cy[lanes]
+        vx = vx[lanes]
+        vy = vy[lanes]
+        py = py[lanes]
+        best = best[lanes]
+        axis = axis[lanes]
+        face = np.where(vx > 0, px - r, px + pw + r)
+        t = (face - cx) / vx
+        y = cy + (vy * t)
+        take = (vx != 0) & (t >= 0) & (t < best) & (y >= py) & \
+            (y <= py + ph)
+        best = np.where(take, t, best)
+        axis = np.where(take, HIT_X, axis)
+        face = np.where(vy > 0, py - r, py + ph + r)
+        t = (face - cy) / vy
+        x = cx + (vx * t)
+        take = (vy != 0) & (t >= 0) & (t < best) & (x >= px) & \
+            (x <= px + pw)
+        best = np.where(take, t, best)
+        axis = np.where(take, HIT_Y, axis)
+        a = (vx * vx) + (vy * vy)
+        for kx, ky in ((px, py), (px + pw, py), (px, py + ph),
+                       (px + pw, py + ph)):
+            dx = cx - kx
+            dy = cy - ky
+            b = (dx * vx) + (dy * vy)
+            disc = (b * b) - (a * ((dx * dx) + (dy * dy) - (r * r)))
+            t = (-b - np.sqrt(disc)) / a
+            take = (b < 0) & (disc >= 0) & (t >= 0) & (t < best)
+            best = np.where(take, t, best)
+            axis = np.where(
+                take,
+                np.where(
+                    np.abs(dx + (vx * t)) > np.abs(dy + (vy * t)),
+                    HIT_X, HIT_Y),
+                axis)
+        all_best[lanes] = best
+        all_axis[lanes] = axis
+        return all_best, all_axis
+
+    def score_mask(self, n: int) -> 'np.ndarray':
+        r = BALL_RADIUS
+        ball_x = self.ball_x[:n]
+        return ((ball_x + r * 4) < 0) | ((ball_x - r * 4) > ARENA_WIDTH) | \
+            (self.p1_score[:n] == ROUND_MAX) | \
+            (self.p2_score[:n] == ROUND_MAX)
+
+    async def step(self, lobbies: list[GameInstance]):
+        """
+        Batched equivalent of calling `tick` on every lobby. A lobby that
+        raises is killed and left out of the rest of the step, like the
+        scheduler does with `tick`, the other lobbies are not affected.
+        """
+        # published after the step like `tick` does, the messages are only
+        # built then, a thousand of them would outlive young collections
+        states = []
+        running = []
+        for game in lobbies:
+            try:
+                state = capture_state(game) if game.snapshot_due() else None
+                if game.force_kill:
+                    game.force_kill = False
+                    game.kill()
+                record_history(game)
+            except Exception as e:
+                self.fail(game, e)
+                continue
+            states.append(state)
+            running.append(game)
+        lobbies = running
+        n = len(lobbies)
+        self.load(lobbies)
+        self.move_balls(n)
+        self.store(lobbies)
+        failed = set()
+        for i, game in enumerate(lobbies):
+            try:
+                # a late move may have simulated the ball again
+                if process_input(game):
+                    self.ball_x[i] = game.ball.shape.x
+            except Exception as e:
+                self.fail(game, e)
+                failed.add(i)
+        for i in np.flatnonzero(self.score_mask(n)).tolist():
+            if i in failed:
+                continue
+            try:
+                handle_score(lobbies[i])
+            except Exception as e:
+                self.fail(lobbies[i], e)
+                failed.add(i)
+        for i, (game, state) in enumerate(zip(lobbies, states)):
+            if i in failed:
+                continue
+            game.tick_count += 1
+            if state is None:
+                continue
+            try:
+                game.pipeline.publish(captured_state(state))
+            except Exception as e:
+                self.fail(game, e)
+
+    @staticmethod
+    def fail(game: GameInstance, e: Exception):
+        LOG.error(f"tick failed: {e}", lobby=game.db_game_id)
+        game.kill()
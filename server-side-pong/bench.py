@@ -0,0 +1,255 @@
+"""
+Headless benchmark of the game loop, no sockets, JWTs or sleeps:
+
+    python bench.py [--lobbies 1,100,10000] [--ticks 300] [--inputs tracking]
+                    [--batch] [--save baseline.json] [--compare baseline.json]
+
+Every lobby gets two players on fake connections that frame messages like a
+real connection but discard the bytes. Ticks run back to back through
+TickScheduler.step, so the measured time covers input processing, physics,
+scoring and the frame pipeline. Finished lobbies are replaced by fresh ones
+to keep the lobby count constant.
+
+Reported per lobby count: scheduler ticks per second, p50/p99 tick time, and
+the bytes allocated and retained per tick, measured in a separate pass with
+tracemalloc since tracing slows the loop down. `--compare` exits with 1 when
+p50 regressed by more than `--tolerance` against a saved baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random as rand
+import sys
+import tracemalloc
+from time import perf_counter
+
+# the harness never starts the uploader, finished games are only queued
+os.environ.setdefault('HTTP_PASSWD', 'bench')
+os.environ.setdefault('BACKEND_PORT', '0')
+
+from websockets.protocol import OPEN  # noqa: E402
+from websockets.server import ServerProtocol  # noqa: E402
+from gameinstance import GameInstance, TICK  # noqa: E402
+from batch_physics import BatchPhysics, np  # noqa: E402
+from frames import SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA  # noqa: E402
+from input_buffer import MOVE_DOWN, MOVE_UP  # noqa: E402
+from player import Player  # noqa: E402
+from scheduler import TickScheduler  # noqa: E402
+
+SUBPROTOCOLS = {
+    'json': None,
+    'bin': SUBPROTOCOL_BINARY,
+    'delta': SUBPROTOCOL_DELTA
+}
+ALLOCATION_TICKS = 20
+# lets the per tick caches be replaced by traced objects before measuring
+ALLOCATION_WARMUP_TICKS = 5
+
+
+class FakeConnection:
+    """
+    Enough of a ServerConnection for the frame pipeline, messages are framed
+    by a real protocol object and then discarded.
+    """
+    protocol: ServerProtocol
+    subprotocol: str | None
+    fragmented_send_waiter = None
+    remote_address = ('bench', 0)
+    bytes_sent: int
+
+    def __init__(self, subprotocol: str | None):
+        self.protocol = ServerProtocol(state=OPEN)
+        self.subprotocol = subprotocol
+        self.bytes_sent = 0
+
+    def send_data(self):
+        for data in self.protocol.data_to_send():
+            self.bytes_sent += len(data)
+
+
+class Bench:
+    scheduler: TickScheduler
+    lobbies: list[GameInstance]
+    inputs: str
+    subprotocol: str | None
+    rng: rand.Random
+    next_game_id: int
+
+    def __init__(
+            self, lobbies: int, inputs: str, subprotocol: str | None,
+            batch: bool, seed: int):
+        rand.seed(seed)
+        self.rng = rand.Random(seed)
+        self.scheduler = TickScheduler(
+            TICK, engine=BatchPhysics() if batch else None)
+        self.inputs = inputs
+        self.subprotocol = subprotocol
+        self.next_game_id = 0
+        self.lobbies = [self.new_lobby() for _ in range(lobbies)]
+
+    def new_lobby(self) -> GameInstance:
+        self.next_game_id += 1
+        lobby = GameInstance(self.next_game_id, 1, 2)
+        for user_id in (1, 2):
+            player = Player(
+                user_id, f"bench{user_id}", 0, 0,
+                FakeConnection(self.subprotocol))
+            lobby.players.append(player)
+            lobby.connections.append(player.connection)
+            lobby.pipeline.subscribe(player.connection)
+        lobby.game_running = True
+        self.scheduler.add(lobby)
+        return lobby
+
+    def feed_inputs(self, now: int):
+        for lobby in self.lobbies:
+            if self.inputs == 'random':
+                if self.rng.random() < 0.5:
+                    lobby.p1_input.push(
+                        self.rng.choice((MOVE_UP, MOVE_DOWN)), now,
+                        lobby.tick_count)
+                if self.rng.random() < 0.5:
+                    lobby.p2_input.push(
+                        self.rng.choice((MOVE_UP, MOVE_DOWN)), now,
+                        lobby.tick_count)
+            elif self.inputs == 'tracking':
+                # both players follow the ball, which keeps rallies going
+                ball_y = lobby.ball.shape.y + lobby.ball.radius_px
+                for buffer, paddle in ((lobby.p1_input, lobby.p1_paddle),
+                                       (lobby.p2_input, lobby.p2_paddle)):
+                    center = paddle.shape.y + (paddle.shape.height / 2)
+                    if center < ball_y - paddle.y_vector:
+                        buffer.push(MOVE_DOWN, now, lobby.tick_count)
+                    elif center > ball_y + paddle.y_vector:
+                        buffer.push(MOVE_UP, now, lobby.tick_count)
+
+    def acknowledge(self):
+        if self.subprotocol != SUBPROTOCOL_DELTA:
+            return
+        for lobby in self.lobbies:
+            for connection in lobby.connections:
+                lobby.pipeline.delta.ack(connection, lobby.pipeline.tick)
+
+    def refill(self):
+        for i, lobby in enumerate(self.lobbies):
+            if not lobby.game_running:
+                self.lobbies[i] = self.new_lobby()
+
+    async def tick(self, now: int) -> float:
+        self.feed_inputs(now)
+        start = perf_counter()
+        await self.scheduler.step()
+        elapsed = perf_counter() - start
+        self.acknowledge()
+        self.refill()
+        return elapsed
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_bench(lobbies: int, ticks: int, args) -> dict:
+    bench = Bench(
+        lobbies, args.inputs, SUBPROTOCOLS[args.subprotocol], args.batch,
+        args.seed)
+    timings = []
+    for tick in range(ticks):
+        timings.append(await bench.tick(tick))
+    tracemalloc.start()
+    for tick in range(ticks, ticks + ALLOCATION_WARMUP_TICKS):
+        await bench.tick(tick)
+    ticks += ALLOCATION_WARMUP_TICKS
+    allocated = 0
+    retained = 0
+    for tick in range(ticks, ticks + ALLOCATION_TICKS):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        await bench.tick(tick)
+        current, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+        retained += current - before
+    tracemalloc.stop()
+    total = sum(timings)
+    return {
+        'lobbies': lobbies,
+        'ticks': len(timings),
+        'ticks_per_sec': len(timings) / total,
+        'lobby_ticks_per_sec': (len(timings) * lobbies) / total,
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'alloc_bytes_per_tick': allocated / ALLOCATION_TICKS,
+        'retained_bytes_per_tick': retained / ALLOCATION_TICKS
+    }
+
+
+def print_result(result: dict, baseline: dict | None):
+    line = (
+        f"{result['lobbies']:>6} lobbies  "
+        f"{result['ticks_per_sec']:>9.1f} ticks/s  "
+        f"p50 {result['p50_ms']:>8.3f}ms  p99 {result['p99_ms']:>8.3f}ms  "
+        f"alloc {result['alloc_bytes_per_tick'] / 1024:>9.1f}KiB/tick  "
+        f"retained {result['retained_bytes_per_tick']:>8.0f}B/tick"
+    )
+    if baseline is not None:
+        line += (
+            f"  p50 {result['p50_ms'] / baseline['p50_ms']:.2f}x"
+            f"  p99 {result['p99_ms'] / baseline['p99_ms']:.2f}x"
+        )
+    print(line)
+
+
+def regressed(result: dict, baseline: dict, tolerance: float) -> bool:
+    """
+    Only p50 is checked, p99 over a few hundred ticks is too noisy to gate
+    on and is reported for reading.
+    """
+    return result['p50_ms'] > baseline['p50_ms'] * (1 + tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lobbies', default='1,100,10000',
+                        help='comma separated lobby counts')
+    parser.add_argument('--ticks', type=int, default=300)
+    parser.add_argument('--inputs', default='tracking',
+                        choices=('tracking', 'random', 'none'))
+    parser.add_argument('--subprotocol', default='json',
+                        choices=tuple(SUBPROTOCOLS))
+    parser.add_argument('--batch', action='store_true',
+                        help='use the numpy batch physics engine')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the results as a baseline')
+    parser.add_argument('--compare', help='baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    if args.batch and np is None:
+        print('--batch requires numpy', file=sys.stderr)
+        exit(1)
+    baselines = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            baselines = {r['lobbies']: r for r in json.load(f)['results']}
+    results = []
+    failed = False
+    for lobbies in [int(n) for n in args.lobbies.split(',')]:
+        result = asyncio.run(run_bench(lobbies, args.ticks, args))
+        baseline = baselines.get(lobbies)
+        print_result(result, baseline)
+        if baseline is not None and \
+                regressed(result, baseline, args.tolerance):
+            failed = True
+        results.append(result)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    if failed:
+        print(f"regression above {args.tolerance:.0%} against "
+              f"{args.compare}", file=sys.stderr)
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Continuous collision detection for the ball.
+
+During a tick the ball center moves along a straight line. Against a paddle
+it is tested as a ray against the paddle rectangle grown by the ball radius,
+that is the four faces moved out by the radius and a circle around every
+corner. Walls are the horizontal lines one radius inside the court. The
+earliest contact is resolved by moving the ball onto it and reversing one
+direction component, then the rest of the tick is swept again, up to
+MAX_CONTACTS_PER_TICK times. Contacts only count while the ball moves towards
+the surface, so a reflected ball can not stick or bounce twice.
+
+`BatchPhysics.move_balls` is the vectorized version of `sweep_ball`, both
+use the same expressions in the same order so their results are identical.
+"""
+from math import sqrt
+from ball import Ball
+from lib import Rect
+
+MAX_CONTACTS_PER_TICK = 4
+
+# which direction component a contact reverses
+HIT_NONE = 0
+HIT_X = 1
+HIT_Y = 2
+
+
+def paddle_contact(
+        cx: float, cy: float, vx: float, vy: float, r: float,
+        paddle: Rect, best: float) -> tuple[float, int]:
+    """
+    Returns the earliest contact before `best` and the direction component
+    it reverses, or `best` and HIT_NONE.
+    """
+    px = paddle.x
+    py = paddle.y
+    pw = paddle.width
+    ph = paddle.height
+    end_x = cx + (vx * best)
+    end_y = cy + (vy * best)
+    # the swept ball does not reach the paddle this tick
+    if min(cx, end_x) - r > px + pw or max(cx, end_x) + r < px or \
+            min(cy, end_y) - r > py + ph or max(cy, end_y) + r < py:
+        return best, HIT_NONE
+    axis = HIT_NONE
+    if vx != 0:
+        face = px - r if vx > 0 else px + pw + r
+        t = (face - cx) / vx
+        y = cy + (vy * t)
+        if t >= 0 and t < best and y >= py and y <= py + ph:
+            best = t
+            axis = HIT_X
+    if vy != 0:
+        face = py - r if vy > 0 else py + ph + r
+        t = (face - cy) / vy
+        x = cx + (vx * t)
+        if t >= 0 and t < best and x >= px and x <= px + pw:
+            best = t
+            axis = HIT_Y
+    a = (vx * vx) + (vy * vy)
+    # corners top left, top right, bottom left, bottom right
+    for corner in range(4):
+        dx = cx - (px + pw if corner & 1 else px)
+        dy = cy - (py + ph if corner & 2 else py)
+        b = (dx * vx) + (dy * vy)
+        disc = (b * b) - (a * ((dx * dx) + (dy * dy) - (r * r)))
+        if b >= 0 or disc < 0:
+            continue
+        t = (-b - sqrt(disc)) / a
+        if t >= 0 and t < best:
+            best = t
+            # like is_colliding_ball_paddle, the dominant axis of the contact
+            # normal decides which direction is reversed
+            if abs(dx + (vx * t)) > abs(dy + (vy * t)):
+                axis = HIT_X
+            else:
+                axis = HIT_Y
+    return best, axis
+
+
+def sweep_ball(
+        ball: Ball, left_paddle: Rect, right_paddle: Rect,
+        arena_height: float):
+    r = ball.radius_px
+    cx = ball.shape.x + r
+    cy = ball.shape.y + r
+    dir_x = ball.dir_vect.x
+    dir_y = ball.dir_vect.y
+    remaining = 1.0
+    for _ in range(MAX_CONTACTS_PER_TICK):
+        vx = dir_x * ball.movement_speed
+        vy = dir_y * ball.movement_speed
+        best = remaining
+        axis = HIT_NONE
+        if vy != 0:
+            t = (r - cy) / vy if vy < 0 else (arena_height - r - cy) / vy
+            # a ball that is already past the wall turns around right away
+            if t < 0:
+                t = 0.0
+            if t < best:
+                best = t
+                axis = HIT_Y
+        contact, hit = paddle_contact(cx, cy, vx, vy, r, left_paddle, best)
+        if hit != HIT_NONE:
+            best = contact
+            axis = hit
+        contact, hit = paddle_contact(cx, cy, vx, vy, r, right_paddle, best)
+        if hit != HIT_NONE:
+            best = contact
+            axis = hit
+        cx = cx + (vx * best)
+        cy = cy + (vy * best)
+        remaining = remaining - best
+        if axis == HIT_NONE:
+            break
+        if axis == HIT_X:
+            dir_x = -dir_x
+        else:
+            dir_y = -dir_y
+    ball.shape.x = cx - r
+    ball.shape.y = cy - r
+    ball.dir_vect.x = dir_x
+    ball.dir_vect.y = dir_y
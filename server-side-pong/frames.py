@@ -0,0 +1,303 @@
+"""
+Binary encoding of the high frequency server to client messages.
+
+Clients that offer the `pong.bin.v1` WebSocket subprotocol receive STATE,
+SCORE and GAME_END as binary frames, every other message and every client
+without the subprotocol keeps receiving JSON text frames. All frames are
+little endian and start with the format version, the message opcode and the
+lobby tick the message belongs to:
+
+    STATE     u8 version, u8 opcode, u32 tick,
+              i16 ball x, i16 ball y, i16 p1 x, i16 p1 y, i16 p2 x, i16 p2 y,
+              i64 p1 last_ts, i64 p2 last_ts
+    SCORE     u8 version, u8 opcode, u32 tick, u8 scored_by (1 or 2)
+    GAME_END  u8 version, u8 opcode, u32 tick, i32 winner_id,
+              u8 score_player1, u8 score_player2
+
+Positions are quantized to 1/16th of a pixel, a last_ts of 0 means no input
+was acknowledged yet.
+
+Clients that offer `pong.delta.v1` additionally acknowledge the ticks they
+received with `{"type": "ACK", "tick": n}` and get STATE as a delta against
+the newest acknowledged tick still in the server history:
+
+    DELTA     u8 version, u8 opcode, u32 tick, u32 baseline tick,
+              u8 changed field mask, changed fields in STATE order
+
+A full STATE frame is sent as keyframe every KEYFRAME_INTERVAL_TICKS, when
+nothing usable was acknowledged and after the client sent
+`{"type": "RESYNC"}` because it detected a gap.
+
+Clients of either binary subprotocol may send their high frequency messages
+as binary frames too, JSON text frames stay accepted for every message:
+
+    MOVE_UP, MOVE_DOWN, HEARTBEAT
+              u8 version, u8 opcode, i64 timestamp
+    ACK       u8 version, u8 opcode, u32 tick
+    RESYNC    u8 version, u8 opcode
+"""
+import struct
+from websockets import ServerConnection
+
+SUBPROTOCOL_DELTA = 'pong.delta.v1'
+SUBPROTOCOL_BINARY = 'pong.bin.v1'
+SUBPROTOCOL_JSON = 'pong.json'
+SUBPROTOCOLS = [SUBPROTOCOL_DELTA, SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON]
+
+FRAME_VERSION = 1
+OPCODE_STATE = 1
+OPCODE_SCORE = 2
+OPCODE_GAME_END = 3
+OPCODE_DELTA = 4
+# client to server
+OPCODE_MOVE_UP = 16
+OPCODE_MOVE_DOWN = 17
+OPCODE_HEARTBEAT = 18
+OPCODE_ACK = 19
+OPCODE_RESYNC = 20
+
+POSITION_SCALE = 16
+INT16_MIN = -(2 ** 15)
+INT16_MAX = (2 ** 15) - 1
+
+HEADER = struct.Struct('<BBI')
+STATE_FRAME = struct.Struct('<BBIhhhhhhqq')
+SCORE_FRAME = struct.Struct('<BBIB')
+GAME_END_FRAME = struct.Struct('<BBIiBB')
+DELTA_HEADER = struct.Struct('<BBIIB')
+INPUT_FRAME = struct.Struct('<BBq')
+ACK_FRAME = struct.Struct('<BBI')
+RESYNC_FRAME = struct.Struct('<BB')
+# STATE fields in frame order, positions are i16 and timestamps i64
+STATE_FIELD_FORMATS = 'hhhhhhqq'
+
+HISTORY_TICKS = 64
+KEYFRAME_INTERVAL_TICKS = 66
+
+
+def quantize(position: float) -> int:
+    value = round(position * POSITION_SCALE)
+    return min(max(value, INT16_MIN), INT16_MAX)
+
+
+def dequantize(value: int) -> float:
+    return value / POSITION_SCALE
+
+
+def state_fields(message: dict) -> tuple:
+    ball = message['ball']
+    p1 = message['p1']
+    p2 = message['p2']
+    return (
+        quantize(ball['x']), quantize(ball['y']),
+        quantize(p1['x']), quantize(p1['y']),
+        quantize(p2['x']), quantize(p2['y']),
+        int(p1['last_ts'] or 0), int(p2['last_ts'] or 0)
+    )
+
+
+def encode_frame(message: dict) -> bytes | None:
+    """
+    Returns None for messages that have no binary representation.
+    """
+    match message['type']:
+        case 'STATE':
+            return STATE_FRAME.pack(
+                FRAME_VERSION, OPCODE_STATE, message['tick'],
+                *state_fields(message)
+            )
+        case 'SCORE':
+            return SCORE_FRAME.pack(
+                FRAME_VERSION, OPCODE_SCORE, message['tick'],
+                1 if message['scored_by'] == 'p1' else 2
+            )
+        case 'GAME_END':
+            return GAME_END_FRAME.pack(
+                FRAME_VERSION, OPCODE_GAME_END, message['tick'],
+                message['winner_id'], message['score_player1'],
+                message['score_player2']
+            )
+    return None
+
+
+def encode_delta(
+        tick: int, fields: tuple, baseline_tick: int, baseline: tuple
+        ) -> bytes:
+    mask = 0
+    formats = '<'
+    changed = []
+    for i, value in enumerate(fields):
+        if value != baseline[i]:
+            mask |= 1 << i
+            formats += STATE_FIELD_FORMATS[i]
+            changed.append(value)
+    return DELTA_HEADER.pack(
+        FRAME_VERSION, OPCODE_DELTA, tick, baseline_tick, mask
+    ) + struct.pack(formats, *changed)
+
+
+def state_message(tick: int, fields: tuple) -> dict:
+    bx, by, p1x, p1y, p2x, p2y, p1_ts, p2_ts = fields
+    return {
+        'type': 'STATE',
+        'tick': tick,
+        'ball': {'x': dequantize(bx), 'y': dequantize(by)},
+        'p1': {
+            'x': dequantize(p1x),
+            'y': dequantize(p1y),
+            'last_ts': p1_ts or None
+        },
+        'p2': {
+            'x': dequantize(p2x),
+            'y': dequantize(p2y),
+            'last_ts': p2_ts or None
+        }
+    }
+
+
+def decode_frame(frame: bytes, baselines: dict[int, tuple] = None) -> dict:
+    """
+    Inverse of encode_frame, used by tooling and tests. Delta frames need the
+    quantized fields of earlier ticks, decoded STATE fields are added to
+    `baselines` when it is passed.
+    """
+    version, opcode, tick = HEADER.unpack_from(frame)
+    if version != FRAME_VERSION:
+        raise RuntimeError(f"Unsupported frame version: {version}")
+    if opcode == OPCODE_STATE or opcode == OPCODE_DELTA:
+        if opcode == OPCODE_STATE:
+            fields = STATE_FRAME.unpack(frame)[3:]
+        else:
+            _, _, _, baseline_tick, mask = DELTA_HEADER.unpack_from(frame)
+            if baselines is None or baseline_tick not in baselines:
+                raise RuntimeError(f"Missing baseline tick {baseline_tick}")
+            formats = '<' + ''.join(
+                STATE_FIELD_FORMATS[i]
+                for i in range(len(STATE_FIELD_FORMATS)) if mask & (1 << i)
+            )
+            changed = iter(
+                struct.unpack_from(formats, frame, DELTA_HEADER.size))
+            fields = tuple(
+                next(changed) if mask & (1 << i) else value
+                for i, value in enumerate(baselines[baseline_tick])
+            )
+        if baselines is not None:
+            baselines[tick] = fields
+        return state_message(tick, fields)
+    if opcode == OPCODE_SCORE:
+        scored_by = SCORE_FRAME.unpack(frame)[3]
+        return {
+            'type': 'SCORE',
+            'tick': tick,
+            'scored_by': 'p1' if scored_by == 1 else 'p2'
+        }
+    if opcode == OPCODE_GAME_END:
+        _, _, _, winner_id, score1, score2 = GAME_END_FRAME.unpack(frame)
+        return {
+            'type': 'GAME_END',
+            'tick': tick,
+            'winner_id': winner_id,
+            'score_player1': score1,
+            'score_player2': score2
+        }
+    raise RuntimeError(f"Unknown frame opcode: {opcode}")
+
+
+def encode_input(opcode: int, value=0) -> bytes:
+    """
+    Client side of decode_input, `value` is the timestamp or the tick.
+    """
+    if opcode == OPCODE_ACK:
+        return ACK_FRAME.pack(FRAME_VERSION, opcode, value)
+    if opcode == OPCODE_RESYNC:
+        return RESYNC_FRAME.pack(FRAME_VERSION, opcode)
+    return INPUT_FRAME.pack(FRAME_VERSION, opcode, value)
+
+
+def decode_input(frame: bytes) -> tuple[int, int]:
+    """
+    Returns the opcode of a client frame and its timestamp or tick, 0 for
+    RESYNC.
+    """
+    if len(frame) < RESYNC_FRAME.size or frame[0] != FRAME_VERSION:
+        raise RuntimeError('Unsupported input frame')
+    opcode = frame[1]
+    if OPCODE_MOVE_UP <= opcode <= OPCODE_HEARTBEAT:
+        return opcode, INPUT_FRAME.unpack(frame)[2]
+    if opcode == OPCODE_ACK:
+        return opcode, ACK_FRAME.unpack(frame)[2]
+    if opcode == OPCODE_RESYNC:
+        return opcode, 0
+    raise RuntimeError(f"Unknown input opcode: {opcode}")
+
+
+def select_subprotocol(
+        connection: ServerConnection, subprotocols: list[str]) -> str | None:
+    """
+    Unlike the websockets default, clients that offer no subprotocol are
+    accepted and fall back to JSON.
+    """
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in subprotocols:
+            return subprotocol
+    return None
+
+
+class DeltaEncoder:
+    """
+    Per lobby snapshot history and the acknowledged tick of every delta
+    connection.
+    """
+    history: dict[int, tuple]
+    acked: dict[ServerConnection, int]
+    last_keyframe: dict[ServerConnection, int]
+
+    def __init__(self):
+        self.history = dict()
+        self.acked = dict()
+        self.last_keyframe = dict()
+
+    def ack(self, connection: ServerConnection, tick: int):
+        if tick in self.history and tick > self.acked.get(connection, -1):
+            self.acked[connection] = tick
+
+    def resync(self, connection: ServerConnection):
+        self.acked.pop(connection, None)
+        self.last_keyframe.pop(connection, None)
+
+    def baseline_for(self, connection: ServerConnection, tick: int) -> int:
+        """
+        Returns the baseline tick to encode against, -1 for a keyframe.
+        """
+        last_keyframe = self.last_keyframe.get(connection)
+        if last_keyframe is None or \
+                tick - last_keyframe >= KEYFRAME_INTERVAL_TICKS:
+            return -1
+        acked = self.acked.get(connection, -1)
+        if acked not in self.history:
+            return -1
+        return acked
+
+    def record(self, tick: int, fields: tuple):
+        self.history[tick] = fields
+        # snapshots are not recorded every tick while the rate is lowered
+        while True:
+            oldest = next(iter(self.history))
+            if oldest > tick - HISTORY_TICKS:
+                break
+            del self.history[oldest]
+
+    def group(
+            self, connections: list[ServerConnection], tick: int
+            ) -> dict[int, list[ServerConnection]]:
+        """
+        Groups connections by the baseline their frame is encoded against,
+        so connections sharing a baseline share the encoded frame.
+        """
+        groups: dict[int, list[ServerConnection]] = dict()
+        for connection in connections:
+            baseline_tick = self.baseline_for(connection, tick)
+            if baseline_tick == -1:
+                self.last_keyframe[connection] = tick
+            groups.setdefault(baseline_tick, []).append(connection)
+        return groups
@@ -1,35 +1,36 @@
 import asyncio
 import json
 import random as rand
-import requests
-import sys
-from websockets import ServerConnection, broadcast, WebSocketException
+from typing import Callable
+from websockets import ServerConnection
 from player import Player
 from ball import Ball
-from lib import Vector2, Rect, is_colliding_ball_paddle
+from lib import Vector2, Rect
+from collision import sweep_ball
 from player_paddle import PlayerPaddle
+from input_buffer import InputBuffer
+from rewind import REWIND_MAX_MS, RewindHistory
+from rates import IDLE_INTERVAL, SIM_HZ, SNAPSHOT_INTERVAL
+from result_upload import UPLOADER
+from pipeline import FramePipeline
+from spectators import SpectatorFeed, spectator_interval
+from recorder import RECORD_MATCHES, MatchRecorder, record_match
+from sendqueue import send
+from metrics import INPUT_QUEUE_DEPTH
+from logger import Logger
 from datetime import datetime
-from base64 import b64encode
+from math import ceil
 from os import getenv
-from time import time_ns
-
-HTTP_PASSWD = getenv('HTTP_PASSWD')
-BACKEND_PORT = getenv('BACKEND_PORT')
-
-if HTTP_PASSWD is None:
-    print('Missing HTTP_PASSWD environment variable', file=sys.stderr)
-    exit(1)
-
-if BACKEND_PORT is None:
-    print('Missing BACKEND_PORT environment variable', file=sys.stderr)
-    exit(1)
+from time import monotonic
 
 
 # game dimensions
 ARENA_WIDTH = 1024
 ARENA_HEIGHT = 768
 
-TICK = 1000 / 66
+TICK = 1000 / SIM_HZ
+# the frontend sends one MOVE per client tick whatever the simulation rate
+CLIENT_TICK = 1000 / 66
 BALL_RADIUS = 15
 BALL_SIZE = BALL_RADIUS * 2
 ROUND_MAX = 5
@@ -38,20 +39,17 @@ ROUND_MAX = 5
 BALL_SPEED_PER_TICK = 0.4
 PADDLE_SPEED_PER_TICK = 0.5
 BALL_SPEED = BALL_SPEED_PER_TICK * TICK
-PADDLE_SPEED = PADDLE_SPEED_PER_TICK * TICK
+PADDLE_SPEED = PADDLE_SPEED_PER_TICK * CLIENT_TICK
+# the ball rests in the center this long after a score, 0 serves it on the
+# next tick like the frontend expects
+SERVE_PAUSE_MS = int(getenv('SERVE_PAUSE_MS', '0'))
+SERVE_PAUSE_TICKS = ceil(SERVE_PAUSE_MS / TICK)
 
 # networking
-HEARTBEAT_GRACE_MS = 100
-HEARTBEAT_FREQUENCY_MS = 3000
-
-
-class Point:
-    x: float
-    y: float
+# ticks a late move can be scheduled back in time
+REWIND_TICKS = ceil(REWIND_MAX_MS / TICK)
 
-    def __init__(self, x: float, y: float):
-        self.x = x
-        self.y = y
+LOG = Logger('lobby')
 
 
 class GameInstance:
@@ -60,18 +58,36 @@ class GameInstance:
     game_running = False
     is_done = False
     force_kill = False
+    # a result was submitted, the game can not be played again
+    result_submitted = False
+    # restored from the snapshot of a previous process, see restart.py
+    resumed = False
+    tick_count = 0
+    # the ball stays put before this tick
+    serve_tick = 0
+    # a replay sets the pause of the recording
+    serve_pause_ticks = SERVE_PAUSE_TICKS
+    filled: asyncio.Event
+    # notified once by `kill`, see lifecycle.py
+    on_done: Callable[['GameInstance'], None] | None = None
 
     p1_last_ts: int
-    p1_input: []
+    p1_input: InputBuffer
     p1_paddle: PlayerPaddle
     p1_score: int
 
     p2_last_ts: int
-    p2_input: []
+    p2_input: InputBuffer
     p2_paddle: PlayerPaddle
     p2_score: int
 
     ball: Ball
+    history: RewindHistory
+    pipeline: FramePipeline
+    spectators: SpectatorFeed
+    recorder: MatchRecorder | None = None
+    # where the direction of every serve comes from, replays replace it
+    next_serve: Callable[[], Vector2]
 
     # database information, should receive this on creation
     db_game_id: int
@@ -81,7 +97,8 @@ class GameInstance:
     def __init__(self, db_game_id: int, db_p1_id: int, db_p2_id: int):
         self.ball = Ball(
             BALL_SPEED, BALL_SPEED * 2, BALL_RADIUS)
-        self.ball.set_start(ARENA_HEIGHT, ARENA_WIDTH, random_ball_vec())
+        self.next_serve = random_ball_vec
+        self.ball.set_start(ARENA_HEIGHT, ARENA_WIDTH, self.next_serve())
         self.p1_paddle = PlayerPaddle(
             PADDLE_SPEED,
             Rect(0, 0, BALL_SIZE, BALL_SIZE * 4)
@@ -93,47 +110,141 @@ class GameInstance:
         self.set_game_start()
         self.players = list()
         self.connections = list()
+        self.pipeline = FramePipeline()
+        self.spectators = SpectatorFeed()
+        self.pipeline.add_tap(self.spectators)
+        self.filled = asyncio.Event()
         self.db_game_id = db_game_id
         self.db_p1_id = db_p1_id
         self.db_p2_id = db_p2_id
 
     def set_game_start(self):
         # player one
-        self.p1_input = []
+        self.p1_input = InputBuffer()
         self.p1_last_ts = None
         self.p1_paddle.shape.x = 0
         self.p1_paddle.shape.y = 0
         self.p1_score = 0
         # player two
-        self.p2_input = []
+        self.p2_input = InputBuffer()
         self.p2_last_ts = None
         self.p2_paddle.shape.x = ARENA_WIDTH-BALL_SIZE
         self.p2_paddle.shape.y = 0
         self.p2_score = 0
+        self.history = RewindHistory(REWIND_TICKS + 1)
 
     def kill(self):
+        if self.is_done:
+            return
         self.log('killed...')
+        self.game_running = False
+        self.is_done = True
+        if self.recorder is not None:
+            self.recorder.kill(self.tick_count)
+            self.recorder = None
+        if self.on_done is not None:
+            self.on_done(self)
+            self.on_done = None
         self.set_game_start()
+        # release every reference to the players and their connections
         self.players.clear()
+        self.connections.clear()
+        self.pipeline.close()
+        self.spectators.close()
         self.db_game_id = -1
         self.db_p1_id = -1
         self.db_p2_id = -1
-        self.lobby_id = None
-        self.game_running = False
-        self.is_done = True
 
-    def log(self, message: str):
-        print(f"lobby {self.db_game_id}: {message}")
+    def log(self, message: str, **context):
+        LOG.info(message, lobby=self.db_game_id, **context)
 
     async def add_player(self, player: Player):
         is_p1 = self.db_p1_id == player.user_id
         game_player_id = 1 if is_p1 else 2
+        # a player that reconnects replaces its previous connection
+        for old_player in self.players:
+            if old_player.user_id == player.user_id:
+                self.detach(old_player.connection)
+                if old_player in self.players:
+                    self.players.remove(old_player)
+                break
         self.players.append(player)
         self.connections.append(player.connection)
-        self.log(f"player \"{player.username}\" added")
-        await player.connection.send(json.dumps(
+        self.pipeline.subscribe(player.connection)
+        self.log(f"player \"{player.username}\" added", user=player.user_id)
+        if self.lobby_full():
+            self.filled.set()
+        send(player.connection, json.dumps(
             {'type': 'ID', 'player_id': game_player_id}
         ))
+        # a player joining a match under way did not see its SCORE messages
+        if self.tick_count > 0:
+            send(player.connection, json.dumps({
+                'type': 'RESUME',
+                'score_player1': self.p1_score,
+                'score_player2': self.p2_score,
+                'tick': self.tick_count
+            }))
+
+    def add_spectator(self, connection: ServerConnection, hz: int | None):
+        send(connection, json.dumps({
+            'type': 'SPECTATING',
+            'game_id': self.db_game_id,
+            'player1_id': self.db_p1_id,
+            'player2_id': self.db_p2_id,
+            'score_player1': self.p1_score,
+            'score_player2': self.p2_score,
+            'tick': self.tick_count
+        }))
+        self.spectators.add(connection, spectator_interval(hz))
+
+    def push_input(self, player: Player, direction: int, timestamp: int):
+        """
+        Schedules a move for the tick the player issued it, estimated from
+        the round trip of its last keepalive ping, see rewind.py.
+        """
+        lag_ms = player.connection.latency * 1000 / 2
+        tick = self.tick_count - round(min(lag_ms, REWIND_MAX_MS) / TICK)
+        is_p1 = player.user_id == self.db_p1_id
+        if is_p1:
+            self.p1_input.push(direction, timestamp, tick)
+        else:
+            self.p2_input.push(direction, timestamp, tick)
+        if self.recorder is not None:
+            self.recorder.input(
+                self.tick_count, 1 if is_p1 else 2, direction, timestamp,
+                tick)
+
+    def start_recording(self):
+        """
+        Moves queued while the lobby was waiting are recorded as if they
+        arrived right before the first tick.
+        """
+        self.recorder = record_match(
+            self.db_game_id, self.db_p1_id, self.db_p2_id, SIM_HZ,
+            SERVE_PAUSE_TICKS, REWIND_TICKS)
+        self.recorder.serve(self.tick_count, self.ball.dir_vect)
+        for player, buffer in ((1, self.p1_input), (2, self.p2_input)):
+            for direction, timestamp, tick in buffer.pending():
+                self.recorder.input(
+                    self.tick_count, player, direction, timestamp, tick)
+
+    def detach(self, connection: ServerConnection):
+        """
+        Forgets a closed connection. A lobby that did not start yet also
+        forgets its player, who may join again. A running game keeps the
+        player until it times out.
+        """
+        if connection in self.connections:
+            self.connections.remove(connection)
+        self.pipeline.unsubscribe(connection)
+        if not self.game_running and not self.is_done:
+            self.players = [
+                player for player in self.players
+                if player.connection is not connection
+            ]
+            if not self.lobby_full():
+                self.filled.clear()
 
     def has_player_conn(self, connection: ServerConnection):
         return connection in self.players
@@ -147,26 +258,59 @@ class GameInstance:
     def set_force_kill(self):
         self.force_kill = True
 
-    async def start_lobby(self):
+    async def start_lobby(self, scheduler):
+        """
+        Announces LOBBY_WAIT every `sec_pause` and starts as soon as the
+        second player joined.
+        """
         lobby_timeout_sec = 30
-        sec_passed = 0
         sec_pause = 5
-        while not self.lobby_full() and sec_passed < lobby_timeout_sec:
-            message = {'type': 'LOBBY_WAIT'}
-            broadcast(self.connections, json.dumps(message))
-            sec_passed += sec_pause
-            await asyncio.sleep(sec_pause)
+        deadline = monotonic() + lobby_timeout_sec
+        while not self.lobby_full() and monotonic() < deadline:
+            self.pipeline.publish({'type': 'LOBBY_WAIT'})
+            try:
+                await asyncio.wait_for(
+                    self.filled.wait(),
+                    min(sec_pause, deadline - monotonic()))
+            except TimeoutError:
+                pass
+        if not self.lobby_full() and self.resumed and self.players:
+            # the match was under way, whoever did not come back forfeits
+            self.game_running = True
+            self.forfeit(self.players[0].user_id != self.db_p1_id)
+            send(self.players[0].connection, json.dumps(
+                {'type': 'OPPONENT_DISCONNECT'}))
+            self.log("restored match resumed without opponent")
+            scheduler.add(self)
+            return
         if not self.lobby_full():
-            message = {'type': 'ERROR', 'message': 'Lobby timed out'}
-            broadcast(self.connections, json.dumps(message))
-            raise Exception(f"lobby {self.db_game_id} timed out")
+            self.pipeline.publish(
+                {'type': 'ERROR', 'message': 'Lobby timed out'})
+            self.log("timed out waiting for players")
+            self.kill()
+            return
         self.game_running = True
+        if RECORD_MATCHES and not self.resumed:
+            self.start_recording()
         self.log("all players connected, starting...")
-        while self.game_running:
-            broadcast(self.connections, json.dumps(await game_loop(self)))
-            await asyncio.sleep(TICK/1000)
+        scheduler.add(self)
+
+    def snapshot_due(self) -> bool:
+        """
+        Whether this tick's STATE is published, at IDLE_INTERVAL while the
+        ball waits for the serve.
+        """
+        if self.tick_count < self.serve_tick:
+            return self.tick_count % IDLE_INTERVAL == 0
+        return self.tick_count % SNAPSHOT_INTERVAL == 0
+
+    async def tick(self):
+        if self.snapshot_due():
+            self.pipeline.publish(await game_loop(self))
+        else:
+            await update(self)
 
-    async def on_client_disconnect(self, player):
+    def on_client_disconnect(self, player):
         # the player that is left gets a default win
         was_p1 = player.user_id == self.db_p1_id
         player_left = None
@@ -177,60 +321,18 @@ class GameInstance:
         if player_left is None:
             self.set_force_kill()
         else:
-            if was_p1:
-                self.p2_score = ROUND_MAX
-            else:
-                self.p1_score = ROUND_MAX
-            try:
-                await player_left.connection.send(json.dumps(
-                {'type': 'OPPONENT_DISCONNECT'}))
-            except WebSocketException:
+            self.forfeit(was_p1)
+            if not send(player_left.connection, json.dumps(
+                    {'type': 'OPPONENT_DISCONNECT'})):
                 self.set_force_kill()
 
-
-def line_line_intersect(
-        p1: Point, p2: Point, p3: Point, p4: Point, side: str
-        ) -> None | tuple[Point, str]:
-    denom = ((p2.x - p1.x) * (p4.y - p3.y)) - ((p2.y - p1.y) * (p4.x - p3.x))
-    if denom == 0:
-        return None
-    dist1 = (
-        ((p1.y - p3.y) * (p4.x - p3.x)) -
-        ((p1.x - p3.x) * (p4.y - p3.y))) / denom
-    dist2 = (
-        ((p1.y - p3.y) * (p2.x - p1.x)) -
-        ((p1.x - p3.x) * (p2.y - p1.y))) / denom
-    if (dist1 >= 0 and dist1 <= 1) and (dist2 >= 0 and dist2 <= 1):
-        intersect_x = p1.x + (dist1 * (p2.x - p1.x))
-        intersect_y = p1.y + (dist1 * (p2.y - p1.y))
-        return (Point(intersect_x, intersect_y), side)
-    return None
-
-
-def handle_court_collision(
-        old_ball_pos: Point, new_ball_pos: Point, ball: Ball
-        ) -> None | tuple[Point, str]:
-    intersect = None
-    if ball.dir_vect.y < 0:
-        intersect = line_line_intersect(
-            old_ball_pos,
-            new_ball_pos,
-            Point(-ball.radius_px, ball.radius_px),
-            Point(ARENA_WIDTH + ball.radius_px, ball.radius_px),
-            "top"
-        )
-    elif ball.dir_vect.y > 0:
-        intersect = line_line_intersect(
-                old_ball_pos,
-                new_ball_pos,
-                Point(-ball.radius_px, ARENA_HEIGHT - ball.radius_px),
-                Point(
-                    ARENA_WIDTH + ball.radius_px,
-                    ARENA_HEIGHT - ball.radius_px
-                ),
-                "bottom"
-            )
-    return intersect
+    def forfeit(self, was_p1: bool):
+        if self.recorder is not None:
+            self.recorder.forfeit(self.tick_count, 1 if was_p1 else 2)
+        if was_p1:
+            self.p2_score = ROUND_MAX
+        else:
+            self.p1_score = ROUND_MAX
 
 
 def handle_score(game: GameInstance):
@@ -245,9 +347,19 @@ def handle_score(game: GameInstance):
         scored_by = "p1"
         game.p1_score += 1
     if scored:
-        message = {'type': 'SCORE', 'scored_by': scored_by}
-        broadcast(game.connections, json.dumps(message))
-        game.ball.set_start(ARENA_HEIGHT, ARENA_WIDTH, random_ball_vec())
+        game.pipeline.publish({
+            'type': 'SCORE',
+            'tick': game.tick_count,
+            'scored_by': scored_by
+        })
+        serve = game.next_serve()
+        game.ball.set_start(ARENA_HEIGHT, ARENA_WIDTH, serve)
+        if game.recorder is not None:
+            game.recorder.score(
+                game.tick_count, 1 if scored_by == "p1" else 2)
+            game.recorder.serve(game.tick_count, serve)
+        game.serve_tick = game.tick_count + 1 + game.serve_pause_ticks
+        game.history.clear()
     # game is finished, we need to upload the results to the database
     if game.p1_score == ROUND_MAX or game.p2_score == ROUND_MAX:
         winner_id = 0
@@ -258,85 +370,29 @@ def handle_score(game: GameInstance):
         # Send GAME_END to all clients before killing
         game_end_message = {
             'type': 'GAME_END',
+            'tick': game.tick_count,
             'winner_id': winner_id,
             'score_player1': game.p1_score,
             'score_player2': game.p2_score
         }
-        broadcast(game.connections, json.dumps(game_end_message))
+        game.pipeline.publish(game_end_message)
         game.log("game finished, uploading results...")
-        try:
-            timestamp = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now())
-            auth_header = "Basic " + b64encode(
-                f"gameserver:{HTTP_PASSWD}".encode()).decode()
-            response = requests.put(
-                f"http://backend:{BACKEND_PORT}/api/games/{game.db_game_id}"
-                "/finish",
-                headers={"Authorization": auth_header},
-                json={
-                    "winner_id": winner_id,
-                    "score_player1": game.p1_score,
-                    "score_player2": game.p2_score,
-                    "finished_at": timestamp
-                }
-            )
-            game.log(f"upload response code {response.status_code}")
-        except requests.ConnectionError as e:
-            game.log(f"{repr(e)}")
+        if game.recorder is not None:
+            game.recorder.end(
+                game.tick_count, winner_id, game.p1_score, game.p2_score)
+        timestamp = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now())
+        game.result_submitted = True
+        UPLOADER.submit(game.db_game_id, {
+            "winner_id": winner_id,
+            "score_player1": game.p1_score,
+            "score_player2": game.p2_score,
+            "finished_at": timestamp
+        })
         game.kill()
 
 
 def move_ball(ball: Ball, player_one: PlayerPaddle, player_two: PlayerPaddle):
-    old_pos = Point(
-        ball.shape.x + ball.radius_px,
-        ball.shape.y + ball.radius_px)
-    new_pos = Point(
-        old_pos.x + (ball.dir_vect.x * ball.movement_speed),
-        old_pos.y + (ball.dir_vect.y * ball.movement_speed))
-    ball.shape.x = new_pos.x - ball.radius_px
-    ball.shape.y = new_pos.y - ball.radius_px
-    # Paddle collision
-    paddle = None
-    if ball.dir_vect.x < 0:
-        paddle = player_one
-    elif ball.dir_vect.x > 0:
-        paddle = player_two
-    if paddle is None:
-        return
-    paddle_intersect = is_colliding_ball_paddle(
-        new_pos, ball.radius_px, Point(paddle.shape.x, paddle.shape.y),
-        paddle.shape.width, paddle.shape.height)
-    if paddle_intersect is None:
-        # Court collision
-        court_pt = handle_court_collision(old_pos, new_pos, ball)
-        if court_pt is not None:
-            pt, side = court_pt
-            match side:
-                case "left" | "right":
-                    ball.dir_vect.x *= -1
-                    ball.shape.x = pt.x - ball.radius_px
-                case "bottom" | "top":
-                    ball.dir_vect.y *= -1
-                    ball.shape.y = pt.y - ball.radius_px
-        # Make sure the ball is not past the court lines
-        else:
-            if ball.dir_vect.y < 0 and ((new_pos.y - ball.radius_px) < 0):
-                ball.dir_vect.y = -ball.dir_vect.y
-                ball.shape.x = new_pos.x - ball.radius_px
-                ball.shape.y = 0
-            elif ball.dir_vect.y > 0 and (
-                    (new_pos.y + ball.radius_px) > ARENA_HEIGHT):
-                ball.dir_vect.y = -ball.dir_vect.y
-                ball.shape.x = new_pos.x - ball.radius_px
-                ball.shape.y = ARENA_HEIGHT - (ball.radius_px * 2)
-        return
-    if paddle_intersect == 'vert':
-        ball.dir_vect.x *= -1
-        ball.shape.x = old_pos.x - ball.radius_px
-        ball.shape.y = old_pos.y - ball.radius_px
-    else:
-        ball.dir_vect.y *= -1
-        ball.shape.x = old_pos.x - ball.radius_px
-        ball.shape.y = old_pos.y - ball.radius_px
+    sweep_ball(ball, player_one.shape, player_two.shape, ARENA_HEIGHT)
 
 
 def random_ball_vec() -> Vector2:
@@ -345,65 +401,161 @@ def random_ball_vec() -> Vector2:
     return Vector2(x, y)
 
 
-async def check_heartbeat(game: GameInstance):
-    now = time_ns() // 1_000_000
-    i = 0
-    while i < 2:
-        player: Player = game.players[i]
-        if now - player.last_hearbeat > \
-           HEARTBEAT_FREQUENCY_MS + HEARTBEAT_GRACE_MS:
-            game.log(f"\"{player.username}\" timed out...")
-            await game.on_client_disconnect(player)
-            return
-        i += 1
-
-
 async def update(game: GameInstance):
-    await check_heartbeat(game)
     if game.force_kill:
         game.force_kill = False
         game.kill()
-    move_ball(game.ball, game.p1_paddle, game.p2_paddle)
+    record_history(game)
+    if game.tick_count >= game.serve_tick:
+        move_ball(game.ball, game.p1_paddle, game.p2_paddle)
     process_input(game)
     handle_score(game)
+    game.tick_count += 1
 
 
-async def game_loop(game: GameInstance):
-    game_state = {
+def get_game_state(game: GameInstance) -> dict:
+    return captured_state(capture_state(game))
+
+
+def capture_state(game: GameInstance) -> tuple:
+    """
+    What a STATE message carries. Unlike the message, a tuple of numbers is
+    untracked by the garbage collector once it survived a collection, so
+    holding one per lobby across a tick does not trigger full collections.
+    """
+    return (
+        game.tick_count, game.ball.shape.x, game.ball.shape.y,
+        game.p1_paddle.shape.x, game.p1_paddle.shape.y, game.p1_last_ts,
+        game.p2_paddle.shape.x, game.p2_paddle.shape.y, game.p2_last_ts
+    )
+
+
+def captured_state(state: tuple) -> dict:
+    tick, ball_x, ball_y, p1_x, p1_y, p1_last_ts, p2_x, p2_y, p2_last_ts = \
+        state
+    return {
         'type': 'STATE',
+        'tick': tick,
         'ball': {
-            'x': game.ball.shape.x,
-            'y': game.ball.shape.y,
+            'x': ball_x,
+            'y': ball_y,
             },
         'p1': {
-            'x': game.p1_paddle.shape.x,
-            'y': game.p1_paddle.shape.y,
-            'last_ts': game.p1_last_ts
+            'x': p1_x,
+            'y': p1_y,
+            'last_ts': p1_last_ts
         },
         'p2': {
-            'x': game.p2_paddle.shape.x,
-            'y': game.p2_paddle.shape.y,
-            'last_ts': game.p2_last_ts
+            'x': p2_x,
+            'y': p2_y,
+            'last_ts': p2_last_ts
         }
     }
+
+
+async def game_loop(game: GameInstance):
+    game_state = get_game_state(game)
     await update(game)
     return game_state
 
 
-def process_paddle(input: list, paddle: PlayerPaddle, ball: Ball):
-    for move in input:
-        if move[0] == 'DOWN':
-            paddle.move_down(ball, ARENA_HEIGHT)
-        elif move[0] == 'UP':
-            paddle.move_up(ball)
+def record_history(game: GameInstance):
+    game.history.record(
+        game.tick_count, game.ball, game.p1_paddle.shape.y,
+        game.p2_paddle.shape.y)
 
 
-def process_input(game: GameInstance):
+def process_input(game: GameInstance) -> bool:
+    """
+    Queued moves are applied as one net displacement per tick, so a player
+    costs at most one collision test per tick however fast it sends. Returns
+    True when a late move rewound the ball.
+    """
+    rewound = False
     if len(game.p1_input) != 0:
-        process_paddle(game.p1_input, game.p1_paddle, game.ball)
-        game.p1_last_ts = game.p1_input[-1][1]
-        game.p1_input.clear()
+        INPUT_QUEUE_DEPTH.observe(len(game.p1_input))
+        steps, game.p1_last_ts, tick = game.p1_input.drain()
+        if steps != 0:
+            rewound = apply_move(game, game.p1_paddle, steps, tick)
     if len(game.p2_input) != 0:
-        process_paddle(game.p2_input, game.p2_paddle, game.ball)
-        game.p2_last_ts = game.p2_input[-1][1]
-        game.p2_input.clear()
+        INPUT_QUEUE_DEPTH.observe(len(game.p2_input))
+        steps, game.p2_last_ts, tick = game.p2_input.drain()
+        if steps != 0:
+            rewound = apply_move(game, game.p2_paddle, steps, tick) or rewound
+    return rewound
+
+
+def apply_move(
+        game: GameInstance, paddle: PlayerPaddle, steps: int,
+        issued_tick: int) -> bool:
+    if issued_tick < game.tick_count and \
+            rewind_move(game, paddle, steps, issued_tick):
+        return True
+    paddle.move(game.ball, steps, ARENA_HEIGHT)
+    return False
+
+
+def in_reach(game: GameInstance, is_p1: bool, first: int) -> bool:
+    """
+    Whether the ball came close enough to the paddle since slot `first` for
+    a different paddle position to change its path.
+    """
+    history = game.history
+    speed = game.ball.movement_speed
+    left_reach = game.p1_paddle.shape.x + game.p1_paddle.shape.width + speed
+    right_reach = game.p2_paddle.shape.x - BALL_SIZE - speed
+    i = first
+    while True:
+        if is_p1:
+            if history.ball_x[i] <= left_reach:
+                return True
+        elif history.ball_x[i] >= right_reach:
+            return True
+        if i == history.head:
+            return False
+        i = (i + 1) % history.capacity
+
+
+def rewind_move(
+        game: GameInstance, paddle: PlayerPaddle, steps: int,
+        issued_tick: int) -> bool:
+    """
+    Moves the paddle at `issued_tick` and simulates the ball again up to the
+    current tick, the recorded states are rewritten along the way. Returns
+    False when the ball was out of reach, applying the move now has the same
+    outcome then.
+    """
+    history = game.history
+    is_p1 = paddle is game.p1_paddle
+    first = history.slot(issued_tick)
+    if first is None or not in_reach(game, is_p1, first):
+        return False
+    own_y = history.p1_y if is_p1 else history.p2_y
+    other_y = history.p2_y if is_p1 else history.p1_y
+    other = game.p2_paddle if is_p1 else game.p1_paddle
+    other_now = other.shape.y
+    ball = game.ball
+    lowest = ARENA_HEIGHT - paddle.shape.height
+    i = first
+    ball.shape.x = history.ball_x[i]
+    ball.shape.y = history.ball_y[i]
+    ball.dir_vect.x = history.dir_x[i]
+    ball.dir_vect.y = history.dir_y[i]
+    paddle.shape.y = own_y[i]
+    paddle.move(ball, steps, ARENA_HEIGHT)
+    shift = paddle.shape.y - own_y[i]
+    while True:
+        own_y[i] = min(max(own_y[i] + shift, 0), lowest)
+        paddle.shape.y = own_y[i]
+        other.shape.y = other_y[i]
+        if history.ticks[i] >= game.serve_tick:
+            move_ball(ball, game.p1_paddle, game.p2_paddle)
+        if i == history.head:
+            break
+        i = (i + 1) % history.capacity
+        history.ball_x[i] = ball.shape.x
+        history.ball_y[i] = ball.shape.y
+        history.dir_x[i] = ball.dir_vect.x
+        history.dir_y[i] = ball.dir_vect.y
+    other.shape.y = other_now
+    return True
@@ -0,0 +1,109 @@
+"""
+Heartbeat supervision of every connected player.
+
+Deadlines live in a hashed timer wheel of HEARTBEAT_SLOT_MS slots that is
+advanced by its own task, so liveness costs nothing per game tick. A
+HEARTBEAT only moves the deadline of its player, the entry stays in the slot
+it was put in and is moved once that slot comes up. A player is therefore
+touched about once per timeout, however often its client sends HEARTBEAT,
+and expires at most one slot late.
+"""
+import asyncio
+from collections.abc import Callable
+from time import monotonic
+from player import Player
+
+HEARTBEAT_GRACE_MS = 100
+HEARTBEAT_FREQUENCY_MS = 3000
+HEARTBEAT_TIMEOUT_MS = HEARTBEAT_FREQUENCY_MS + HEARTBEAT_GRACE_MS
+HEARTBEAT_SLOT_MS = 100
+
+
+def now_ms() -> int:
+    return int(monotonic() * 1000)
+
+
+class HeartbeatWheel:
+    timeout_ms: int
+    slot_ms: int
+    on_expired: Callable[[Player], None]
+    # a deadline is never more than one lap ahead of the current slot
+    slots: list[set[Player]]
+    deadlines: dict[Player, int]
+    # absolute slot number each player is currently stored in
+    placed: dict[Player, int]
+    # absolute number of the next slot to expire
+    cursor: int
+    expired_count: int
+
+    def __init__(
+            self, on_expired: Callable[[Player], None],
+            timeout_ms=HEARTBEAT_TIMEOUT_MS, slot_ms=HEARTBEAT_SLOT_MS):
+        self.timeout_ms = timeout_ms
+        self.slot_ms = slot_ms
+        self.on_expired = on_expired
+        self.slots = [set() for _ in range(timeout_ms // slot_ms + 2)]
+        self.deadlines = dict()
+        self.placed = dict()
+        self.cursor = now_ms() // slot_ms
+        self.expired_count = 0
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, player: Player) -> bool:
+        return player in self.deadlines
+
+    def place(self, player: Player, deadline: int):
+        slot = deadline // self.slot_ms
+        self.placed[player] = slot
+        self.slots[slot % len(self.slots)].add(player)
+
+    def arm(self, player: Player):
+        """
+        Starts or restarts the timeout of a player.
+        """
+        deadline = now_ms() + self.timeout_ms
+        if player not in self.deadlines:
+            self.place(player, deadline)
+        self.deadlines[player] = deadline
+
+    def reset(self, player: Player):
+        if player in self.deadlines:
+            self.deadlines[player] = now_ms() + self.timeout_ms
+
+    def disarm(self, player: Player):
+        if self.deadlines.pop(player, None) is None:
+            return
+        slot = self.placed.pop(player)
+        self.slots[slot % len(self.slots)].discard(player)
+
+    def expire(self, now: int):
+        """
+        Fires `on_expired` for every player whose deadline passed and moves
+        the ones that sent a HEARTBEAT in the meantime.
+        """
+        while (self.cursor + 1) * self.slot_ms <= now:
+            slot = self.slots[self.cursor % len(self.slots)]
+            self.cursor += 1
+            if not slot:
+                continue
+            players = list(slot)
+            slot.clear()
+            for player in players:
+                deadline = self.deadlines.get(player)
+                if deadline is None:
+                    # disarmed by an earlier callback
+                    continue
+                if deadline > now:
+                    self.place(player, deadline)
+                    continue
+                del self.deadlines[player]
+                del self.placed[player]
+                self.expired_count += 1
+                self.on_expired(player)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.slot_ms / 1000)
+            self.expire(now_ms())
@@ -0,0 +1,80 @@
+MOVE_UP = -1
+MOVE_DOWN = 1
+
+INPUT_BUFFER_SIZE = 16
+# moves applied per tick, a client at the tick rate sends one per tick and
+# the rest of the budget lets it catch up after a network hiccup
+INPUT_BUDGET_PER_TICK = 4
+
+
+class InputBuffer:
+    """
+    Fixed size ring of the pending paddle moves of one player. A client that
+    sends faster than the moves are applied overwrites its oldest moves, so
+    neither memory nor tick cost grow with the inbound message rate.
+    """
+    __slots__ = (
+        'directions', 'timestamps', 'ticks', 'head', 'size', 'overwritten'
+    )
+    directions: list[int]
+    timestamps: list[int]
+    # tick the move was issued for, see rewind.py
+    ticks: list[int]
+    head: int
+    size: int
+    overwritten: int
+
+    def __init__(self):
+        self.directions = [0] * INPUT_BUFFER_SIZE
+        self.timestamps = [0] * INPUT_BUFFER_SIZE
+        self.ticks = [0] * INPUT_BUFFER_SIZE
+        self.head = 0
+        self.size = 0
+        self.overwritten = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def push(self, direction: int, timestamp: int, tick: int):
+        tail = (self.head + self.size) % INPUT_BUFFER_SIZE
+        self.directions[tail] = direction
+        self.timestamps[tail] = timestamp
+        self.ticks[tail] = tick
+        if self.size == INPUT_BUFFER_SIZE:
+            self.head = (self.head + 1) % INPUT_BUFFER_SIZE
+            self.overwritten += 1
+        else:
+            self.size += 1
+
+    def drain(self, budget=INPUT_BUDGET_PER_TICK) -> tuple[int, int, int]:
+        """
+        Consumes up to `budget` moves in arrival order, returns their net
+        displacement in paddle steps, the timestamp of the newest one and
+        the tick the oldest one was issued for.
+        """
+        steps = 0
+        timestamp = 0
+        tick = self.ticks[self.head]
+        for _ in range(min(budget, self.size)):
+            steps += self.directions[self.head]
+            timestamp = self.timestamps[self.head]
+            self.head = (self.head + 1) % INPUT_BUFFER_SIZE
+            self.size -= 1
+        return steps, timestamp, tick
+
+    def pending(self) -> list[tuple[int, int, int]]:
+        """
+        The queued moves as (direction, timestamp, tick), oldest first,
+        without consuming them.
+        """
+        moves = []
+        for i in range(self.size):
+            slot = (self.head + i) % INPUT_BUFFER_SIZE
+            moves.append(
+                (self.directions[slot], self.timestamps[slot],
+                 self.ticks[slot]))
+        return moves
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
@@ -3,6 +3,7 @@ from math import sqrt
 
 
 class Vector2:
+    __slots__ = ('x', 'y')
     x: int
     y: int
 
@@ -16,16 +17,8 @@ class Vector2:
         self.y = self.y / magnitude
 
 
-class Point:
-    x: float
-    y: float
-
-    def __init__(self, x: int, y: int):
-        self.x = x
-        self.y = y
-
-
 class Rect:
+    __slots__ = ('x', 'y', 'width', 'height')
     x: float
     y: float
     width: float
@@ -39,22 +32,27 @@ class Rect:
 
 
 def is_colliding_ball_paddle(
-        ball_center: Point, ball_radius: float, paddle_point: Point,
-        paddle_width: float, paddle_height: float) -> None | str:
-    test_x = ball_center.x
-    test_y = ball_center.y
-
-    if ball_center.x < paddle_point.x:
-        test_x = paddle_point.x
-    elif ball_center.x > paddle_point.x + paddle_width:
-        test_x = paddle_point.x + paddle_width
-
-    if ball_center.y < paddle_point.y:
-        test_y = paddle_point.y
-    elif ball_center.y > paddle_point.y + paddle_height:
-        test_y = paddle_point.y + paddle_height
-    dist_x = ball_center.x-test_x
-    dist_y = ball_center.y-test_y
+        ball_x: float, ball_y: float, ball_radius: float, paddle_x: float,
+        paddle_y: float, paddle_width: float, paddle_height: float
+        ) -> None | str:
+    """
+    Takes the ball center and the top left corner of the paddle as plain
+    numbers, so the tick path does not allocate points.
+    """
+    test_x = ball_x
+    test_y = ball_y
+
+    if ball_x < paddle_x:
+        test_x = paddle_x
+    elif ball_x > paddle_x + paddle_width:
+        test_x = paddle_x + paddle_width
+
+    if ball_y < paddle_y:
+        test_y = paddle_y
+    elif ball_y > paddle_y + paddle_height:
+        test_y = paddle_y + paddle_height
+    dist_x = ball_x-test_x
+    dist_y = ball_y-test_y
     distance = sqrt((dist_x*dist_x) + (dist_y*dist_y))
     if distance <= ball_radius:
         if abs(dist_x) > abs(dist_y):
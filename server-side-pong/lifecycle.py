@@ -0,0 +1,161 @@
+"""
+Event driven lifecycle of lobbies and connections. Nothing is polled: a
+closed connection is detached from its lobby when its handler ends, and a
+lobby that is killed, whether its game ended, its players timed out or it
+was never filled, is dropped from the registry and the scheduler in the same
+call. A match holds no references once it is over, so memory follows the
+number of live matches instead of the number of matches served.
+
+Every connected player is supervised by the heartbeat wheel. A player whose
+deadline passes forfeits its running game and its connection is closed,
+which in turn detaches it from a lobby it was waiting in. A player whose
+connection closed during a game keeps its deadline, it either reconnects in
+time or forfeits. Spectators are exempt while they watch, they have nothing
+to forfeit and the keepalive pings of websockets still close a dead
+connection.
+"""
+import asyncio
+from time import monotonic
+from websockets import ServerConnection
+from gameinstance import GameInstance
+from heartbeat import HeartbeatWheel
+from player import Player
+from registry import Registry
+from scheduler import TickScheduler
+from sendqueue import close_queue
+from logger import Logger
+
+# a START_GAME for a game that ended this recently is refused instead of
+# opening a new lobby for it
+FINISHED_GAME_TTL_SEC = 300
+
+LOG = Logger('lifecycle')
+
+
+class Lifecycle:
+    registry: Registry
+    scheduler: TickScheduler
+    # lobbies waiting for their second player, kept referenced until started
+    waiting: dict[GameInstance, asyncio.Task]
+    # database game id to the time its result was submitted, oldest first
+    finished: dict[int, float]
+    heartbeats: HeartbeatWheel
+    # players whose connection closed during a game, until they time out
+    dropped: dict[Player, GameInstance]
+    closing: set[asyncio.Task]
+    lobbies_opened: int
+    lobbies_closed: int
+
+    def __init__(self, registry: Registry, scheduler: TickScheduler):
+        self.registry = registry
+        self.scheduler = scheduler
+        self.waiting = dict()
+        self.finished = dict()
+        self.heartbeats = HeartbeatWheel(self.heartbeat_expired)
+        self.dropped = dict()
+        self.closing = set()
+        self.lobbies_opened = 0
+        self.lobbies_closed = 0
+
+    def is_finished(self, db_game_id: int) -> bool:
+        self.expire_finished()
+        return db_game_id in self.finished
+
+    def expire_finished(self):
+        expired = monotonic() - FINISHED_GAME_TTL_SEC
+        while self.finished:
+            db_game_id, finished_at = next(iter(self.finished.items()))
+            if finished_at > expired:
+                break
+            del self.finished[db_game_id]
+
+    def open_lobby(
+            self, db_game_id: int, db_p1_id: int,
+            db_p2_id: int) -> GameInstance:
+        LOG.info("creating lobby", lobby=db_game_id)
+        lobby = GameInstance(db_game_id, db_p1_id, db_p2_id)
+        lobby.on_done = self.close_lobby
+        self.registry.add_lobby(lobby)
+        self.lobbies_opened += 1
+        return lobby
+
+    def wait_for_players(self, lobby: GameInstance):
+        if lobby in self.waiting:
+            return
+        task = asyncio.create_task(lobby.start_lobby(self.scheduler))
+        self.waiting[lobby] = task
+        task.add_done_callback(lambda _: self.waiting.pop(lobby, None))
+
+    def close_lobby(self, lobby: GameInstance):
+        """
+        Called by `GameInstance.kill` while the lobby still knows its ids and
+        connections.
+        """
+        self.registry.remove_lobby(lobby.db_game_id, lobby)
+        self.scheduler.remove(lobby)
+        task = self.waiting.pop(lobby, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        # a lobby that timed out or lost its players may be opened again
+        if lobby.result_submitted:
+            self.expire_finished()
+            self.finished[lobby.db_game_id] = monotonic()
+        self.lobbies_closed += 1
+        LOG.info("lobby closed", lobby=lobby.db_game_id)
+
+    def connect(self, player: Player):
+        self.heartbeats.arm(player)
+
+    def disconnect(self, connection: ServerConnection):
+        """
+        Releases everything that refers to a closed connection.
+        """
+        player = self.registry.get_player(connection)
+        lobby = self.registry.lobby_by_conn.get(connection)
+        self.stop_spectating(connection)
+        self.registry.remove_player(connection)
+        close_queue(connection)
+        if lobby is not None:
+            lobby.detach(connection)
+        if player is None or player not in self.heartbeats:
+            return
+        if lobby is not None and lobby.game_running:
+            self.dropped[player] = lobby
+        else:
+            self.heartbeats.disarm(player)
+
+    def spectate(
+            self, connection: ServerConnection, lobby: GameInstance,
+            hz: int | None):
+        self.stop_spectating(connection)
+        self.registry.spectating[connection] = lobby
+        lobby.add_spectator(connection, hz)
+        player = self.registry.get_player(connection)
+        if player is not None:
+            self.heartbeats.disarm(player)
+
+    def stop_spectating(self, connection: ServerConnection):
+        lobby = self.registry.spectating.pop(connection, None)
+        if lobby is None:
+            return
+        lobby.spectators.remove(connection)
+        player = self.registry.get_player(connection)
+        if player is not None:
+            self.heartbeats.arm(player)
+
+    def heartbeat_expired(self, player: Player):
+        lobby = self.dropped.pop(player, None)
+        if lobby is None:
+            lobby = self.registry.lobby_of(player)
+        if lobby is not None and lobby.game_running and \
+           player in lobby.players:
+            lobby.log(f"\"{player.username}\" timed out...",
+                      user=player.user_id)
+            lobby.on_client_disconnect(player)
+        # a connection that is still open is closed, which detaches it
+        if self.registry.get_player(player.connection) is player:
+            LOG.info("heartbeat timed out", user=player.user_id)
+            task = asyncio.create_task(player.connection.close(
+                reason='Heartbeat timed out'))
+            self.closing.add(task)
+            task.add_done_callback(self.closing.discard)
@@ -0,0 +1,456 @@
+"""
+Load generator for a running game server:
+
+    JWT_SECRET=... python loadgen.py [--url ws://127.0.0.1:8081]
+        [--matches 500] [--ramp 200] [--duration 30] [--workers 4]
+        [--subprotocol json] [--spectators 0] [--stub-backend 3000]
+
+Every match is two clients with freshly minted HS256 tokens that connect,
+send START_GAME for the same game id and then behave like the frontend: a
+HEARTBEAT every --heartbeat-ms and, while a simulated key is held, one MOVE
+per client tick. Connections are opened at --ramp handshakes per second and
+spread over --workers processes so the generator is not the bottleneck.
+Clients of a binary subprotocol send moves, heartbeats and ACKs as binary
+frames unless --json-input is given. With --spectators every match also
+gets that many read-only clients that send SPECTATE once its players are
+in, at --spectator-hz. A client closed with 1012 by a restarting server
+connects again and sends its START_GAME or SPECTATE again.
+
+With --stub-backend the result endpoint is served locally on that port,
+start the server with BACKEND_HOST=127.0.0.1 and the same BACKEND_PORT.
+All clients share one address, so start the server with an
+IP_HANDSHAKE_RATE above --ramp and a MAX_CONNECTIONS above the number of
+clients.
+
+Reported: handshake rate and latency, STATE inter-arrival times of players
+and spectators, input to acknowledge latency (a MOVE timestamp coming back
+as last_ts), WebSocket ping round trips, which the server answers from its
+event loop, and match and error counts.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random as rand
+import resource
+import sys
+import threading
+from os import getenv
+from time import monotonic, time
+import jwt
+from websockets.asyncio.client import connect
+from frames import (
+    OPCODE_ACK, OPCODE_HEARTBEAT, OPCODE_MOVE_DOWN, OPCODE_MOVE_UP,
+    SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA, decode_frame, encode_input
+)
+from stub_backend import StubBackendHandler, serve_stub
+
+JWT_SECRET = getenv('JWT_SECRET')
+if JWT_SECRET is None:
+    print('Missing JWT_SECRET environment variable', file=sys.stderr)
+    exit(1)
+
+SUBPROTOCOLS = {
+    'json': None,
+    'bin': SUBPROTOCOL_BINARY,
+    'delta': SUBPROTOCOL_DELTA
+}
+CLIENT_TICK_SEC = 1 / 66
+# a spectator that arrives before the lobby exists asks again after this
+SPECTATE_RETRY_SEC = 0.5
+PING_INTERVAL_SEC = 5
+# close code of a server that hands its matches over to the next process
+SERVICE_RESTART = 1012
+RECONNECT_RETRY_SEC = 0.2
+# how long a simulated key stays pressed or released
+KEY_HOLD_SEC = (0.1, 1.0)
+HISTOGRAM_MAX_MS = 5000
+
+
+class Histogram:
+    """
+    Millisecond buckets, cheap enough to record every STATE of every client.
+    """
+    buckets: list[int]
+    count: int
+    total: float
+
+    def __init__(self):
+        self.buckets = [0] * (HISTOGRAM_MAX_MS + 1)
+        self.count = 0
+        self.total = 0
+
+    def add(self, value_ms: float):
+        self.buckets[min(int(value_ms), HISTOGRAM_MAX_MS)] += 1
+        self.count += 1
+        self.total += value_ms
+
+    def merge(self, other: 'Histogram'):
+        for i, count in enumerate(other.buckets):
+            self.buckets[i] += count
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, fraction: float) -> int:
+        target = self.count * fraction
+        seen = 0
+        for value, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                return value
+        return 0
+
+    def summary(self) -> str:
+        if self.count == 0:
+            return 'no samples'
+        return (f"n={self.count} mean={self.total / self.count:.1f}ms "
+                f"p50={self.percentile(0.5)}ms p99={self.percentile(0.99)}ms "
+                f"max={self.percentile(1.0)}ms")
+
+
+class LoadStats:
+    handshake: Histogram
+    state_interval: Histogram
+    spectator_interval: Histogram
+    input_ack: Histogram
+    ping: Histogram
+    handshakes: int
+    handshake_failures: int
+    matches_started: int
+    games_ended: int
+    disconnects: int
+    reconnects: int
+    first_handshake: float
+    last_handshake: float
+
+    def __init__(self):
+        self.handshake = Histogram()
+        self.state_interval = Histogram()
+        self.spectator_interval = Histogram()
+        self.input_ack = Histogram()
+        self.ping = Histogram()
+        self.handshakes = 0
+        self.handshake_failures = 0
+        self.matches_started = 0
+        self.games_ended = 0
+        self.disconnects = 0
+        self.reconnects = 0
+        self.first_handshake = 0
+        self.last_handshake = 0
+
+    def merge(self, other: 'LoadStats'):
+        for name in ('handshake', 'state_interval', 'spectator_interval',
+                     'input_ack', 'ping'):
+            getattr(self, name).merge(getattr(other, name))
+        for name in ('handshakes', 'handshake_failures', 'matches_started',
+                     'games_ended', 'disconnects', 'reconnects'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        if other.first_handshake and (
+                not self.first_handshake or
+                other.first_handshake < self.first_handshake):
+            self.first_handshake = other.first_handshake
+        self.last_handshake = max(self.last_handshake, other.last_handshake)
+
+
+def mint_token(user_id: int) -> str:
+    now = int(time())
+    return jwt.encode({
+        'userId': user_id,
+        'username': f"load{user_id}",
+        'iat': now,
+        'exp': now + 3600
+    }, JWT_SECRET, algorithm='HS256')
+
+
+class LoadClient:
+    user_id: int
+    game_id: int
+    player1_id: int
+    player2_id: int
+    spectator: bool
+    args: argparse.Namespace
+    stats: LoadStats
+    player_id: int | None
+    sent_moves: set[int]
+    last_state: float | None
+    baselines: dict[int, tuple]
+
+    def __init__(
+            self, user_id: int, game_id: int, player1_id: int,
+            player2_id: int, args: argparse.Namespace, stats: LoadStats,
+            spectator=False):
+        self.user_id = user_id
+        self.game_id = game_id
+        self.player1_id = player1_id
+        self.player2_id = player2_id
+        self.spectator = spectator
+        self.args = args
+        self.stats = stats
+        self.player_id = None
+        self.sent_moves = set()
+        self.last_state = None
+        self.baselines = dict()
+
+    async def run(self, deadline: float):
+        websocket = await self.connect(deadline)
+        while websocket is not None:
+            if not await self.play(websocket, deadline):
+                return
+            # the server restarts and hands its matches over, see restart.py
+            self.stats.reconnects += 1
+            websocket = await self.connect(deadline, retry=True)
+
+    async def connect(self, deadline: float, retry=False):
+        subprotocol = SUBPROTOCOLS[self.args.subprotocol]
+        start = monotonic()
+        while True:
+            try:
+                websocket = await connect(
+                    self.args.url,
+                    additional_headers={'Bearer': mint_token(self.user_id)},
+                    subprotocols=[subprotocol] if subprotocol else None,
+                    open_timeout=30)
+                break
+            except Exception as e:
+                if retry and monotonic() + RECONNECT_RETRY_SEC < deadline:
+                    await asyncio.sleep(RECONNECT_RETRY_SEC)
+                    continue
+                self.stats.handshake_failures += 1
+                print(f"handshake failed for {self.user_id}: {e}",
+                      file=sys.stderr)
+                return None
+        now = monotonic()
+        self.stats.handshake.add((now - start) * 1000)
+        self.stats.handshakes += 1
+        if not self.stats.first_handshake:
+            self.stats.first_handshake = now
+        self.stats.last_handshake = now
+        return websocket
+
+    async def play(self, websocket, deadline: float) -> bool:
+        """
+        Returns True when the server closed the connection to restart.
+        """
+        async with websocket:
+            tasks = [
+                asyncio.create_task(self.heartbeat(websocket)),
+                asyncio.create_task(self.measure_ping(websocket))
+            ]
+            if self.spectator:
+                await self.spectate(websocket)
+            else:
+                await websocket.send(json.dumps({
+                    'type': 'START_GAME',
+                    'game_id': self.game_id,
+                    'player1_id': self.player1_id,
+                    'player2_id': self.player2_id
+                }))
+                tasks.append(asyncio.create_task(self.press_keys(websocket)))
+            try:
+                await asyncio.wait_for(
+                    self.receive(websocket), deadline - monotonic())
+            except TimeoutError:
+                pass
+            except Exception:
+                if websocket.close_code != SERVICE_RESTART:
+                    self.stats.disconnects += 1
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return websocket.close_code == SERVICE_RESTART
+
+    async def spectate(self, websocket):
+        await websocket.send(json.dumps({
+            'type': 'SPECTATE',
+            'game_id': self.game_id,
+            'hz': self.args.spectator_hz
+        }))
+
+    def binary_input(self) -> bool:
+        return self.args.subprotocol != 'json' and not self.args.json_input
+
+    async def heartbeat(self, websocket):
+        while True:
+            timestamp = int(time() * 1000)
+            if self.binary_input():
+                await websocket.send(
+                    encode_input(OPCODE_HEARTBEAT, timestamp))
+            else:
+                await websocket.send(json.dumps(
+                    {'type': 'HEARTBEAT', 'timestamp': timestamp}))
+            await asyncio.sleep(self.args.heartbeat_ms / 1000)
+
+    async def press_keys(self, websocket):
+        rng = rand.Random(self.user_id)
+        while True:
+            await asyncio.sleep(rng.uniform(*KEY_HOLD_SEC))
+            message_type = rng.choice(('MOVE_UP', 'MOVE_DOWN'))
+            opcode = OPCODE_MOVE_UP if message_type == 'MOVE_UP' \
+                else OPCODE_MOVE_DOWN
+            release = monotonic() + rng.uniform(*KEY_HOLD_SEC)
+            while monotonic() < release:
+                timestamp = int(time() * 1000)
+                self.sent_moves.add(timestamp)
+                if self.binary_input():
+                    await websocket.send(encode_input(opcode, timestamp))
+                else:
+                    await websocket.send(json.dumps(
+                        {'type': message_type, 'timestamp': timestamp}))
+                await asyncio.sleep(CLIENT_TICK_SEC)
+
+    async def measure_ping(self, websocket):
+        while True:
+            await asyncio.sleep(PING_INTERVAL_SEC)
+            latency = await (await websocket.ping())
+            self.stats.ping.add(latency * 1000)
+
+    async def receive(self, websocket):
+        async for message in websocket:
+            if isinstance(message, bytes):
+                message = decode_frame(message, self.baselines)
+                if message['type'] == 'STATE' and self.args.subprotocol == \
+                        'delta':
+                    await websocket.send(self.ack(message['tick']))
+            else:
+                message = json.loads(message)
+            match message['type']:
+                case 'ID':
+                    self.player_id = message['player_id']
+                case 'ERROR' if self.spectator:
+                    await asyncio.sleep(SPECTATE_RETRY_SEC)
+                    await self.spectate(websocket)
+                case 'STATE':
+                    self.on_state(message)
+                case 'GAME_END':
+                    self.stats.games_ended += 1
+                    return
+
+    def ack(self, tick: int) -> bytes | str:
+        if self.binary_input():
+            return encode_input(OPCODE_ACK, tick)
+        return json.dumps({'type': 'ACK', 'tick': tick})
+
+    def on_state(self, message: dict):
+        now = monotonic()
+        if self.spectator:
+            if self.last_state is not None:
+                self.stats.spectator_interval.add(
+                    (now - self.last_state) * 1000)
+            self.last_state = now
+            return
+        if self.last_state is None:
+            if self.player_id == 1:
+                self.stats.matches_started += 1
+        else:
+            self.stats.state_interval.add((now - self.last_state) * 1000)
+        self.last_state = now
+        own = message['p1'] if self.player_id == 1 else message['p2']
+        last_ts = own['last_ts']
+        if last_ts in self.sent_moves:
+            self.stats.input_ack.add(time() * 1000 - last_ts)
+            # older moves can not be acknowledged anymore
+            self.sent_moves = {ts for ts in self.sent_moves if ts > last_ts}
+
+
+async def run_worker(
+        worker: int, args: argparse.Namespace, stats: LoadStats):
+    matches = range(worker, args.matches, args.workers)
+    deadline = monotonic() + args.duration
+    clients = []
+    # every worker opens its share of the overall ramp rate
+    interval = args.workers / args.ramp
+    for i, match in enumerate(matches):
+        player1_id = args.user_id_base + (match * 2)
+        player2_id = player1_id + 1
+        game_id = args.game_id_base + match
+        for user_id in (player1_id, player2_id):
+            client = LoadClient(
+                user_id, game_id, player1_id, player2_id, args, stats)
+            clients.append(asyncio.create_task(client.run(deadline)))
+            await asyncio.sleep(interval)
+        # spectator ids follow the ids of all players
+        spectator_base = args.user_id_base + (args.matches * 2) + \
+            (match * args.spectators)
+        for user_id in range(spectator_base,
+                             spectator_base + args.spectators):
+            client = LoadClient(
+                user_id, game_id, player1_id, player2_id, args, stats,
+                spectator=True)
+            clients.append(asyncio.create_task(client.run(deadline)))
+            await asyncio.sleep(interval)
+    await asyncio.gather(*clients, return_exceptions=True)
+
+
+def worker_main(worker: int, args: argparse.Namespace, results):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    stats = LoadStats()
+    asyncio.run(run_worker(worker, args, stats))
+    results.put(stats)
+
+
+def report(stats: LoadStats, args: argparse.Namespace):
+    ramp = stats.last_handshake - stats.first_handshake
+    rate = stats.handshakes / ramp if ramp > 0 else float(stats.handshakes)
+    print(f"handshakes      {stats.handshakes} ok, "
+          f"{stats.handshake_failures} failed, {rate:.1f}/s")
+    print(f"handshake time  {stats.handshake.summary()}")
+    print(f"STATE interval  {stats.state_interval.summary()}")
+    if args.spectators:
+        print(f"spectator STATE {stats.spectator_interval.summary()}")
+    print(f"input to ack    {stats.input_ack.summary()}")
+    print(f"ping round trip {stats.ping.summary()}")
+    print(f"matches         {stats.matches_started}/{args.matches} started, "
+          f"{stats.games_ended // 2} ended, "
+          f"{stats.disconnects} clients disconnected, "
+          f"{stats.reconnects} reconnected after a restart")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='ws://127.0.0.1:8081')
+    parser.add_argument('--matches', type=int, default=500)
+    parser.add_argument('--ramp', type=float, default=200,
+                        help='handshakes per second')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds from start until clients disconnect')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--subprotocol', default='json',
+                        choices=tuple(SUBPROTOCOLS))
+    parser.add_argument('--json-input', action='store_true',
+                        help='send JSON moves and heartbeats with a binary '
+                        'subprotocol')
+    parser.add_argument('--heartbeat-ms', type=int, default=1000,
+                        help='the frontend sends one every 1000ms')
+    parser.add_argument('--spectators', type=int, default=0,
+                        help='read-only clients per match')
+    parser.add_argument('--spectator-hz', type=int, default=20)
+    parser.add_argument('--user-id-base', type=int, default=1_000_000)
+    parser.add_argument('--game-id-base', type=int, default=1_000_000)
+    parser.add_argument('--stub-backend', type=int, metavar='PORT',
+                        help='serve the result endpoint on this port')
+    args = parser.parse_args()
+    if args.stub_backend:
+        stub = serve_stub(args.stub_backend)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=worker_main, args=(i, args, results))
+        for i in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    stats = LoadStats()
+    for _ in workers:
+        stats.merge(results.get())
+    for worker in workers:
+        worker.join()
+    report(stats, args)
+    if args.stub_backend:
+        print(f"results stored by the stub backend "
+              f"{len(StubBackendHandler.finished)}")
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
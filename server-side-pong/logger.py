@@ -0,0 +1,140 @@
+"""
+Structured logging that never writes from the event loop.
+
+A log call checks the level and the sampling rate of its category and
+appends one tuple to a bounded deque, formatting and the blocking writes to
+stdout and stderr happen on a background thread in batches. When the writer
+falls behind by LOG_QUEUE_MAX records new ones are counted and dropped.
+
+    LOG_LEVEL=debug|info|warning|error      default info
+    LOG_FORMAT=text|json                    default text, key=value pairs
+    LOG_SAMPLE=heartbeat=0.01,lobby=1       kept fraction per category
+
+Warnings and errors are never sampled.
+"""
+import json
+import sys
+from datetime import datetime, timezone
+from os import getenv
+from time import time
+from writer import BackgroundWriter
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {
+    DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+LOG_LEVEL = LEVELS.get(getenv('LOG_LEVEL', 'info').lower(), INFO)
+LOG_FORMAT = getenv('LOG_FORMAT', 'text')
+LOG_SAMPLE = getenv('LOG_SAMPLE', 'heartbeat=0.01')
+LOG_QUEUE_MAX = 65536
+LOG_FLUSH_SEC = 0.1
+
+# added to every record, e.g. the shard index
+LOG_CONTEXT: dict[str, object] = dict()
+
+
+def parse_sample_rates(spec: str) -> dict[str, float]:
+    rates = dict()
+    for pair in spec.split(','):
+        if '=' not in pair:
+            continue
+        category, rate = pair.split('=', 1)
+        try:
+            rates[category.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            print(f"ignoring LOG_SAMPLE entry {pair!r}", file=sys.stderr)
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(LOG_SAMPLE)
+
+
+def format_value(value) -> str:
+    text = str(value)
+    if text and ' ' not in text and '"' not in text and '=' not in text:
+        return text
+    return json.dumps(text)
+
+
+def format_record(record: tuple) -> str:
+    timestamp, level, category, message, context = record
+    when = datetime.fromtimestamp(timestamp, timezone.utc).isoformat(
+        timespec='milliseconds')
+    fields = {'time': when, 'level': LEVEL_NAMES[level],
+              'category': category} | LOG_CONTEXT | context
+    if LOG_FORMAT == 'json':
+        return json.dumps(fields | {'msg': message}, default=str)
+    pairs = ' '.join(f"{key}={format_value(value)}"
+                     for key, value in fields.items())
+    return f"{pairs} msg={format_value(message)}"
+
+
+class LogWriter(BackgroundWriter):
+    """
+    Formats the queued records, warnings and errors go to stderr.
+    """
+
+    def write(self, records: list[tuple]):
+        out = []
+        err = []
+        for record in records:
+            line = format_record(record)
+            (err if record[1] >= WARNING else out).append(line)
+        try:
+            if out:
+                sys.stdout.write('\n'.join(out) + '\n')
+                sys.stdout.flush()
+            if err:
+                sys.stderr.write('\n'.join(err) + '\n')
+                sys.stderr.flush()
+        except (OSError, ValueError):
+            # a closed or broken pipe must not take the writer down
+            pass
+
+
+WRITER = LogWriter('log-writer', LOG_QUEUE_MAX, LOG_FLUSH_SEC)
+
+
+class Logger:
+    """
+    One per category. Context such as lobby=db_game_id or user=user_id is
+    passed as keyword arguments and formatted on the writer thread.
+    """
+    __slots__ = ('category', 'sample_every', 'seen')
+    category: str
+    # keep every n-th record below WARNING, 0 drops all of them
+    sample_every: int
+    seen: int
+
+    def __init__(self, category: str):
+        self.category = category
+        rate = SAMPLE_RATES.get(category, 1.0)
+        self.sample_every = round(1 / rate) if rate > 0 else 0
+        self.seen = 0
+
+    def log(self, level: int, message: str, context: dict):
+        if level < LOG_LEVEL:
+            return
+        if level < WARNING and self.sample_every != 1:
+            if self.sample_every == 0:
+                return
+            self.seen += 1
+            if self.seen % self.sample_every != 1:
+                return
+        WRITER.put((time(), level, self.category, message, context))
+
+    def debug(self, message: str, **context):
+        self.log(DEBUG, message, context)
+
+    def info(self, message: str, **context):
+        self.log(INFO, message, context)
+
+    def warning(self, message: str, **context):
+        self.log(WARNING, message, context)
+
+    def error(self, message: str, **context):
+        self.log(ERROR, message, context)
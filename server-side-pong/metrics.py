@@ -0,0 +1,223 @@
+"""
+Instrumentation in the Prometheus text exposition format, served on
+METRICS_HOST:METRICS_PORT (default 127.0.0.1:9100, plus the shard index in
+sharded mode) at /metrics. An empty METRICS_PORT disables the endpoint.
+
+Recording a sample is an integer increment or a bisect into a short bucket
+list, values that already exist elsewhere (scheduler accounting, lobby and
+player counts) are read through callbacks only when scraped.
+"""
+import asyncio
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from os import getenv
+from typing import Callable
+from logger import Logger
+
+METRICS_HOST = getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = getenv('METRICS_PORT', '9100')
+SCRAPE_TIMEOUT_SEC = 5
+
+LOG = Logger('metrics')
+
+TICK_BUCKETS_SEC = (
+    0.001, 0.0025, 0.005, 0.01, 0.015, 0.025, 0.05, 0.1, 0.25)
+PING_BUCKETS_SEC = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+UPLOAD_BUCKETS_SEC = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DEPTH_BUCKETS = (1, 2, 4, 8, 16)
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    return '{' + pairs + '}'
+
+
+class Metric(ABC):
+    name: str
+    help: str
+    kind: str
+    labels: dict[str, str]
+
+    def __init__(self, name: str, help: str, labels: dict[str, str]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    @abstractmethod
+    def samples(self, labels: dict[str, str]) -> list[str]:
+        ...
+
+
+class Counter(Metric):
+    """
+    Either incremented directly or read from `source` when scraped.
+    """
+    kind = 'counter'
+    value: float
+    source: Callable[[], float] | None
+
+    def __init__(
+            self, name: str, help: str, labels: dict[str, str],
+            source: Callable[[], float] | None = None):
+        super().__init__(name, help, labels)
+        self.value = 0
+        self.source = source
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self, labels: dict[str, str]) -> list[str]:
+        value = self.value if self.source is None else self.source()
+        return [f"{self.name}{format_labels(labels | self.labels)} {value}"]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    buckets: tuple
+    counts: list[int]
+    sum: float
+    count: int
+
+    def __init__(
+            self, name: str, help: str, labels: dict[str, str],
+            buckets: tuple):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, labels: dict[str, str]) -> list[str]:
+        labels = labels | self.labels
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            bucket_labels = format_labels(labels | {'le': str(bound)})
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        bucket_labels = format_labels(labels | {'le': '+Inf'})
+        lines.append(f"{self.name}_bucket{bucket_labels} {self.count}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {self.sum}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    metrics: list[Metric]
+    # added to every sample, e.g. the shard index
+    const_labels: dict[str, str]
+
+    def __init__(self):
+        self.metrics = list()
+        self.const_labels = dict()
+
+    def counter(
+            self, name: str, help: str, labels: dict[str, str] = {},
+            source: Callable[[], float] | None = None) -> Counter:
+        metric = Counter(name, help, labels, source)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(
+            self, name: str, help: str, labels: dict[str, str] = {},
+            source: Callable[[], float] | None = None) -> Gauge:
+        metric = Gauge(name, help, labels, source)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(
+            self, name: str, help: str, buckets: tuple,
+            labels: dict[str, str] = {}) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        described = set()
+        for metric in self.metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(self.const_labels))
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+
+TICK_DURATION = METRICS.histogram(
+    'pong_tick_duration_seconds', 'Time to advance all running lobbies',
+    TICK_BUCKETS_SEC)
+TICK_SENT_BYTES = METRICS.histogram(
+    'pong_tick_sent_bytes', 'Bytes handed to connections during one tick',
+    BYTES_BUCKETS)
+SENT_MESSAGES = METRICS.counter(
+    'pong_sent_messages_total', 'Messages handed to connections')
+SENT_BYTES = METRICS.counter(
+    'pong_sent_bytes_total', 'Bytes handed to connections')
+PLAYER_PING = METRICS.histogram(
+    'pong_player_ping_seconds', 'Player ping reported by HEARTBEAT',
+    PING_BUCKETS_SEC)
+INPUT_QUEUE_DEPTH = METRICS.histogram(
+    'pong_input_queue_depth', 'Queued moves of a player when applied',
+    DEPTH_BUCKETS)
+UPLOAD_DURATION = METRICS.histogram(
+    'pong_result_upload_seconds', 'Duration of one result upload attempt',
+    UPLOAD_BUCKETS_SEC)
+
+
+async def handle_scrape(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(
+            reader.readline(), SCRAPE_TIMEOUT_SEC)
+        while await asyncio.wait_for(
+                reader.readline(), SCRAPE_TIMEOUT_SEC) not in (
+                b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b'GET' and \
+                parts[1].split(b'?')[0] == b'/metrics':
+            status = '200 OK'
+            body = METRICS.render().encode()
+        else:
+            status = '404 Not Found'
+            body = b''
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(shard: int) -> asyncio.Server | None:
+    if not METRICS_PORT:
+        return None
+    port = int(METRICS_PORT) + shard
+    try:
+        server = await asyncio.start_server(handle_scrape, METRICS_HOST, port)
+    except OSError as e:
+        LOG.error(f"endpoint unavailable on port {port}: {e}")
+        return None
+    return server
@@ -0,0 +1,159 @@
+import json
+from typing import Callable
+from websockets import ServerConnection
+from frames import (
+    DeltaEncoder, SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA, STATE_FRAME,
+    FRAME_VERSION, OPCODE_STATE, encode_delta, encode_frame, state_fields
+)
+from sendqueue import deliver, snapshot_due
+
+# how often an outbound message was serialized per wire format, a tick should
+# add one encode per format in use regardless of the number of subscribers
+SERIALIZATION_COUNTS = {'published': 0, 'json': 0, 'binary': 0, 'delta': 0}
+
+
+class Frame:
+    """
+    One outbound message. Every wire format is encoded at most once, on first
+    use, and the encoded buffers are never modified afterwards.
+    """
+    message: dict
+    text: str | None
+    binary: bytes | None
+    fields: tuple | None
+    deltas: dict[int, bytes]
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.text = None
+        self.binary = None
+        self.fields = None
+        self.deltas = dict()
+
+    def as_text(self) -> str:
+        if self.text is None:
+            self.text = json.dumps(self.message)
+            SERIALIZATION_COUNTS['json'] += 1
+        return self.text
+
+    def as_fields(self) -> tuple:
+        if self.fields is None:
+            self.fields = state_fields(self.message)
+        return self.fields
+
+    def as_binary(self) -> bytes | None:
+        """
+        Returns None for messages without a binary layout.
+        """
+        if self.binary is None:
+            if self.message['type'] == 'STATE':
+                self.binary = STATE_FRAME.pack(
+                    FRAME_VERSION, OPCODE_STATE, self.message['tick'],
+                    *self.as_fields())
+            else:
+                self.binary = encode_frame(self.message)
+            if self.binary is None:
+                return None
+            SERIALIZATION_COUNTS['binary'] += 1
+        return self.binary
+
+    def as_delta(self, delta: DeltaEncoder, baseline_tick: int) -> bytes:
+        if baseline_tick not in self.deltas:
+            self.deltas[baseline_tick] = encode_delta(
+                self.message['tick'], self.as_fields(), baseline_tick,
+                delta.history[baseline_tick])
+            SERIALIZATION_COUNTS['delta'] += 1
+        return self.deltas[baseline_tick]
+
+
+class FramePipeline:
+    """
+    Fans the messages of one lobby out to its subscribers and taps. Each
+    message becomes one Frame that every subscriber of a wire format shares,
+    so a message is serialized once per format in use.
+    """
+    text_subscribers: list[ServerConnection]
+    binary_subscribers: list[ServerConnection]
+    delta_subscribers: list[ServerConnection]
+    taps: list[Callable[[Frame], None]]
+    delta: DeltaEncoder
+    # tick of the newest message, STATE subscribers at a reduced rate skip
+    # the ticks their rate leaves out
+    tick: int
+
+    def __init__(self):
+        self.text_subscribers = list()
+        self.binary_subscribers = list()
+        self.delta_subscribers = list()
+        self.taps = list()
+        self.delta = DeltaEncoder()
+        self.tick = 0
+
+    def subscribe(self, connection: ServerConnection):
+        if connection.subprotocol == SUBPROTOCOL_DELTA:
+            self.delta_subscribers.append(connection)
+        elif connection.subprotocol == SUBPROTOCOL_BINARY:
+            self.binary_subscribers.append(connection)
+        else:
+            self.text_subscribers.append(connection)
+
+    def unsubscribe(self, connection: ServerConnection):
+        for subscribers in (self.text_subscribers, self.binary_subscribers,
+                            self.delta_subscribers):
+            if connection in subscribers:
+                subscribers.remove(connection)
+        self.delta.resync(connection)
+
+    def close(self):
+        self.text_subscribers.clear()
+        self.binary_subscribers.clear()
+        self.delta_subscribers.clear()
+        self.taps.clear()
+        self.delta = DeltaEncoder()
+
+    def add_tap(self, tap: Callable[[Frame], None]):
+        """
+        Taps receive every published frame, e.g. for replays or metrics.
+        """
+        self.taps.append(tap)
+
+    def publish(self, message: dict) -> Frame:
+        self.tick = message.get('tick', self.tick)
+        frame = Frame(message)
+        SERIALIZATION_COUNTS['published'] += 1
+        self.fan_out(frame)
+        for tap in self.taps:
+            tap(frame)
+        return frame
+
+    def fan_out(self, frame: Frame):
+        # congested connections only keep the newest STATE
+        coalesce = frame.message['type'] == 'STATE'
+        text_subscribers = self.text_subscribers
+        binary_subscribers = self.binary_subscribers
+        delta_subscribers = self.delta_subscribers
+        if coalesce:
+            # connections at a reduced snapshot rate skip some ticks
+            text_subscribers = snapshot_due(text_subscribers, self.tick)
+            binary_subscribers = snapshot_due(binary_subscribers, self.tick)
+            delta_subscribers = snapshot_due(delta_subscribers, self.tick)
+        if coalesce and self.delta_subscribers:
+            self.delta.record(frame.message['tick'], frame.as_fields())
+            groups = self.delta.group(delta_subscribers, self.tick)
+            for baseline_tick, group in groups.items():
+                if baseline_tick == -1:
+                    deliver(group, frame.as_binary(), coalesce=True)
+                else:
+                    deliver(
+                        group, frame.as_delta(self.delta, baseline_tick),
+                        coalesce=True)
+        elif delta_subscribers:
+            binary_subscribers = binary_subscribers + delta_subscribers
+        if binary_subscribers:
+            binary = frame.as_binary()
+            if binary is None:
+                text_subscribers = text_subscribers + binary_subscribers
+            else:
+                deliver(binary_subscribers, binary, coalesce)
+        if text_subscribers:
+            deliver(text_subscribers, frame.as_text(), coalesce)
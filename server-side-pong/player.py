@@ -2,13 +2,15 @@ from websockets import ServerConnection
 
 
 class Player:
+    __slots__ = (
+        'user_id', 'username', 'iat', 'exp', 'connection', 'ping'
+    )
     user_id: int
     username: str
     iat: int
     exp: int
 
     connection: ServerConnection
-    last_hearbeat: int
     ping: int
 
     def __init__(
@@ -19,5 +21,4 @@ class Player:
         self.iat = iat
         self.exp = exp
         self.connection = connection
-        self.last_hearbeat = 0
         self.ping = 0
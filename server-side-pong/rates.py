@@ -0,0 +1,43 @@
+"""
+Simulation and snapshot rates.
+
+The simulation runs at SIM_HZ. STATE snapshots go out at most at SNAPSHOT_HZ
+and every connection steps down through SNAPSHOT_RATES_HZ when the round trip
+of its keepalive pings passes the matching SNAPSHOT_PING_MS limit or its
+socket backs up. While a lobby is idle, e.g. during the SERVE_PAUSE_MS pause
+before a serve, it sends at IDLE_HZ. Rates are rounded to whole simulation
+ticks, at 66Hz 66/33/20 become every 1st, 2nd and 3rd tick.
+
+SNAPSHOT_PING_MS holds one limit per rate after the first, by default every
+further SNAPSHOT_PING_STEP_MS of round trip lowers the rate by one step.
+"""
+import sys
+from os import getenv
+
+SIM_HZ = int(getenv('SIM_HZ', '66'))
+SNAPSHOT_HZ = int(getenv('SNAPSHOT_HZ', str(SIM_HZ)))
+SNAPSHOT_RATES_HZ = tuple(
+    int(hz) for hz in getenv('SNAPSHOT_RATES_HZ', '66,33,20').split(','))
+SNAPSHOT_PING_STEP_MS = 100
+# round trip from which a connection uses the next lower rate
+SNAPSHOT_PING_MS = tuple(
+    int(ms) for ms in getenv('SNAPSHOT_PING_MS', '').split(',') if ms) or \
+    tuple(SNAPSHOT_PING_STEP_MS * step
+          for step in range(1, len(SNAPSHOT_RATES_HZ)))
+if len(SNAPSHOT_PING_MS) != len(SNAPSHOT_RATES_HZ) - 1:
+    print('SNAPSHOT_PING_MS needs one limit per rate of SNAPSHOT_RATES_HZ '
+          'after the first', file=sys.stderr)
+    exit(1)
+# keepalive pings measure that round trip, websockets sends one every 20s
+KEEPALIVE_INTERVAL_SEC = float(getenv('KEEPALIVE_INTERVAL_SEC', '5'))
+IDLE_HZ = int(getenv('IDLE_HZ', '5'))
+
+
+def interval_ticks(hz: int) -> int:
+    return max(1, round(SIM_HZ / min(hz, SNAPSHOT_HZ)))
+
+
+# in simulation ticks
+SNAPSHOT_INTERVAL = interval_ticks(SNAPSHOT_HZ)
+SNAPSHOT_INTERVALS = tuple(interval_ticks(hz) for hz in SNAPSHOT_RATES_HZ)
+IDLE_INTERVAL = interval_ticks(IDLE_HZ)
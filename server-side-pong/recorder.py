@@ -0,0 +1,219 @@
+"""
+Append-only binary log of every match, replayed by replay.py.
+
+Only what the simulation can not reproduce by itself is recorded, nothing is
+written for a tick without events:
+
+    header   game and player ids, the rates the match was simulated with
+    SERVE    the outcome of random_ball_vec, at the start and after a score
+    INPUT    a move as pushed into the input buffer, with the tick it
+             arrived before, its client timestamp and the tick it was
+             scheduled for
+    FORFEIT  a player timed out
+    SCORE    who scored, kept to verify a replay against
+    END      winner and final score
+    KILL     the match ended without a result
+
+A record is packed once and appended to a queue, the files are written by a
+background thread every RECORD_FLUSH_SEC, one append per match per flush.
+All integers are little endian, see the structs below.
+
+Every match is recorded unless RECORD_MATCHES=0. The same thread keeps
+RECORD_DIR under RECORD_MAX_MB by removing the oldest recordings, a file
+written to in the last RECORD_ACTIVE_SEC may belong to a running match and
+is kept.
+"""
+import os
+import struct
+from os import getenv
+from time import monotonic, time
+from lib import Vector2
+from metrics import METRICS
+from logger import Logger
+from writer import BackgroundWriter
+
+RECORD_MATCHES = getenv('RECORD_MATCHES', '1') == '1'
+RECORD_DIR = getenv('RECORD_DIR', './records')
+RECORD_MAX_MB = int(getenv('RECORD_MAX_MB', '1024'))
+RECORD_QUEUE_MAX = 1 << 20
+RECORD_FLUSH_SEC = 0.5
+RECORD_PRUNE_SEC = 60
+RECORD_ACTIVE_SEC = 600
+
+RECORD_MAGIC = b'PONGRC'
+RECORD_VERSION = 1
+RECORD_SUFFIX = '.pongrec'
+
+# magic, version, game id, player one id, player two id, SIM_HZ, serve pause
+# ticks, rewind ticks, start as unix time in ms
+HEADER = struct.Struct('<6sHiiiHHHq')
+# every record starts with its type and the tick it belongs to
+EVENT = struct.Struct('<BI')
+EVENT_SERVE = 1
+EVENT_INPUT = 2
+EVENT_FORFEIT = 3
+EVENT_SCORE = 4
+EVENT_END = 5
+EVENT_KILL = 6
+# direction x, direction y
+SERVE_RECORD = struct.Struct('<BIbb')
+# player 1 or 2, direction, client timestamp, tick the move was issued for
+INPUT_RECORD = struct.Struct('<BIBbqi')
+# player 1 or 2, the one that left for FORFEIT, the one that scored for SCORE
+PLAYER_RECORD = struct.Struct('<BIB')
+# winner id, score of player one, score of player two
+END_RECORD = struct.Struct('<BIiBB')
+KILL_RECORD = EVENT
+
+RECORDED_MATCHES = METRICS.counter(
+    'pong_record_matches_total', 'Matches recorded')
+RECORDED_RECORDS = METRICS.counter(
+    'pong_record_records_total', 'Records queued for a match file')
+RECORDED_BYTES = METRICS.counter(
+    'pong_record_bytes_total', 'Bytes queued for match files')
+RECORDS_DROPPED = METRICS.counter(
+    'pong_record_dropped_total', 'Records dropped by a full queue')
+RECORDINGS_PRUNED = METRICS.counter(
+    'pong_record_pruned_total', 'Recordings removed over RECORD_MAX_MB')
+
+LOG = Logger('recorder')
+
+
+def prune_records(directory: str, max_bytes: int, now: float):
+    """
+    Removes the oldest recordings of `directory` until the rest fit in
+    `max_bytes`.
+    """
+    files = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(RECORD_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError as e:
+        LOG.error(f"could not list recordings: {e}", path=directory)
+        return
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in sorted(files):
+        if total <= max_bytes or now - mtime < RECORD_ACTIVE_SEC:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # shards share the directory, another one pruned it first
+            pass
+        except OSError as e:
+            LOG.error(f"could not remove recording: {e}", path=path)
+            continue
+        total -= size
+        RECORDINGS_PRUNED.inc()
+
+
+class RecordWriter(BackgroundWriter):
+    """
+    Appends the queued records to their files and prunes RECORD_DIR every
+    RECORD_PRUNE_SEC.
+    """
+    last_prune: float
+
+    def __init__(self):
+        super().__init__('record-writer', RECORD_QUEUE_MAX, RECORD_FLUSH_SEC)
+        self.last_prune = 0
+
+    def put(self, record: tuple[str, bytes]) -> bool:
+        if not super().put(record):
+            RECORDS_DROPPED.inc()
+            return False
+        RECORDED_RECORDS.inc()
+        RECORDED_BYTES.inc(len(record[1]))
+        return True
+
+    def write(self, records: list[tuple[str, bytes]]):
+        files: dict[str, list[bytes]] = dict()
+        for path, record in records:
+            files.setdefault(path, []).append(record)
+        for path, chunks in files.items():
+            try:
+                with open(path, 'ab') as f:
+                    f.write(b''.join(chunks))
+            except OSError as e:
+                LOG.error(f"could not write recording: {e}", path=path)
+        now = monotonic()
+        if now - self.last_prune >= RECORD_PRUNE_SEC:
+            self.last_prune = now
+            prune_records(RECORD_DIR, RECORD_MAX_MB << 20, time())
+
+
+WRITER = RecordWriter()
+
+
+class MatchRecorder:
+    """
+    Log of one match. A match whose records could not all be queued stops
+    recording, its file stays incomplete.
+    """
+    __slots__ = ('path', 'failed', 'ended')
+    path: str
+    failed: bool
+    ended: bool
+
+    def __init__(self, path: str):
+        self.path = path
+        self.failed = False
+        self.ended = False
+
+    def put(self, record: bytes):
+        if self.failed or self.ended:
+            return
+        if not WRITER.put((self.path, record)):
+            self.failed = True
+            LOG.warning("recording stopped, writer queue is full",
+                        path=self.path)
+
+    def serve(self, tick: int, direction: Vector2):
+        self.put(SERVE_RECORD.pack(
+            EVENT_SERVE, tick, int(direction.x), int(direction.y)))
+
+    def input(
+            self, tick: int, player: int, direction: int, timestamp: int,
+            issued_tick: int):
+        self.put(INPUT_RECORD.pack(
+            EVENT_INPUT, tick, player, direction, timestamp, issued_tick))
+
+    def forfeit(self, tick: int, player: int):
+        self.put(PLAYER_RECORD.pack(EVENT_FORFEIT, tick, player))
+
+    def score(self, tick: int, player: int):
+        self.put(PLAYER_RECORD.pack(EVENT_SCORE, tick, player))
+
+    def end(self, tick: int, winner_id: int, p1_score: int, p2_score: int):
+        self.put(END_RECORD.pack(
+            EVENT_END, tick, winner_id, p1_score, p2_score))
+        self.ended = True
+
+    def kill(self, tick: int):
+        self.put(KILL_RECORD.pack(EVENT_KILL, tick))
+        self.ended = True
+
+
+def record_match(
+        db_game_id: int, db_p1_id: int, db_p2_id: int, sim_hz: int,
+        serve_pause_ticks: int, rewind_ticks: int) -> MatchRecorder:
+    """
+    Starts the file of a match that starts now. A match restored after a
+    restart keeps appending to its file instead, see restart.py.
+    """
+    os.makedirs(RECORD_DIR, exist_ok=True)
+    started_ms = int(time() * 1000)
+    recorder = MatchRecorder(os.path.join(
+        RECORD_DIR, f"{db_game_id}-{started_ms}{RECORD_SUFFIX}"))
+    RECORDED_MATCHES.inc()
+    recorder.put(HEADER.pack(
+        RECORD_MAGIC, RECORD_VERSION, db_game_id, db_p1_id, db_p2_id,
+        sim_hz, serve_pause_ticks, rewind_ticks, started_ms))
+    return recorder
@@ -0,0 +1,70 @@
+from websockets import ServerConnection
+from gameinstance import GameInstance
+from player import Player
+
+
+class Registry:
+    """
+    Indexes of all lobbies and connected players, so routing an incoming
+    message never has to scan the server population.
+    """
+    lobbies: dict[int, GameInstance]
+    players_by_conn: dict[ServerConnection, Player]
+    players_by_user: dict[int, Player]
+    lobby_by_conn: dict[ServerConnection, GameInstance]
+    # spectators are never part of `lobby_by_conn`, they can not send moves
+    spectating: dict[ServerConnection, GameInstance]
+
+    def __init__(self):
+        self.lobbies = dict()
+        self.players_by_conn = dict()
+        self.players_by_user = dict()
+        self.lobby_by_conn = dict()
+        self.spectating = dict()
+
+    def add_lobby(self, lobby: GameInstance):
+        self.lobbies[lobby.db_game_id] = lobby
+
+    def get_lobby(self, db_game_id: int) -> GameInstance | None:
+        return self.lobbies.get(db_game_id)
+
+    def remove_lobby(self, db_game_id: int, lobby: GameInstance):
+        """
+        The lobby is passed alongside its id since a killed lobby no longer
+        knows its database id.
+        """
+        if self.lobbies.get(db_game_id) is lobby:
+            del self.lobbies[db_game_id]
+        for connection in lobby.connections:
+            if self.lobby_by_conn.get(connection) is lobby:
+                del self.lobby_by_conn[connection]
+        for connection in lobby.spectators.connections():
+            if self.spectating.get(connection) is lobby:
+                del self.spectating[connection]
+
+    def join_lobby(self, lobby: GameInstance, player: Player):
+        self.lobby_by_conn[player.connection] = lobby
+
+    def lobby_of(self, player: Player) -> GameInstance | None:
+        return self.lobby_by_conn.get(player.connection)
+
+    def add_player(self, player: Player) -> Player | None:
+        """
+        Returns the player that was previously registered for the same user.
+        """
+        old_player = self.players_by_user.get(player.user_id)
+        self.players_by_user[player.user_id] = player
+        self.players_by_conn[player.connection] = player
+        return old_player
+
+    def get_player(self, connection: ServerConnection) -> Player | None:
+        return self.players_by_conn.get(connection)
+
+    def remove_player(self, connection: ServerConnection):
+        player = self.players_by_conn.pop(connection, None)
+        self.lobby_by_conn.pop(connection, None)
+        if player is None:
+            return
+        # a newer connection of the same user may already have replaced it
+        if self.players_by_user.get(player.user_id) is player:
+            del self.players_by_user[player.user_id]
@@ -0,0 +1,325 @@
+"""
+Re-simulates recorded matches, see recorder.py:
+
+    python replay.py records/*.pongrec [--verify] [--states 600-660]
+        [--scores]
+
+Files are memory-mapped and parsed in place. Every match runs through the
+same `update` as the server, recorded moves are pushed into the input
+buffers before the tick they arrived before and the recorded serves replace
+random_ball_vec, so a replay reproduces the match tick for tick without
+sockets or sleeps.
+
+Per file the match, its result and the replay speed relative to real time
+are printed. `--verify` compares every replayed score and the result
+against the recorded ones and reports the first divergence of each file,
+which is the tick to look at when debugging a desync. All files are
+checked, the exit status is 1 when any of them diverged or could not be
+read. `--states FROM-TO` prints
+the STATE of those ticks as JSON lines, `--scores` every score.
+
+Each match is simulated with the rates in its header, whatever SIM_HZ,
+SERVE_PAUSE_MS and REWIND_MAX_MS this process runs with.
+"""
+import argparse
+import asyncio
+import json
+import mmap
+import os
+import struct
+import sys
+from collections import deque
+from time import perf_counter
+
+# replays never upload results and only report problems
+os.environ.setdefault('HTTP_PASSWD', 'replay')
+os.environ.setdefault('BACKEND_PORT', '0')
+os.environ.setdefault('LOG_LEVEL', 'warning')
+os.environ['RECORD_MATCHES'] = '0'
+
+from gameinstance import (  # noqa: E402
+    ARENA_HEIGHT, ARENA_WIDTH, BALL_SPEED_PER_TICK, GameInstance,
+    get_game_state, update
+)
+from lib import Vector2  # noqa: E402
+from recorder import (  # noqa: E402
+    END_RECORD, EVENT, EVENT_END, EVENT_FORFEIT, EVENT_INPUT, EVENT_KILL,
+    EVENT_SCORE, EVENT_SERVE, HEADER, INPUT_RECORD, KILL_RECORD,
+    PLAYER_RECORD, RECORD_MAGIC, RECORD_VERSION, SERVE_RECORD
+)
+from rewind import RewindHistory  # noqa: E402
+
+
+class Recording:
+    path: str
+    db_game_id: int
+    db_p1_id: int
+    db_p2_id: int
+    sim_hz: int
+    serve_pause_ticks: int
+    rewind_ticks: int
+    started_ms: int
+    # INPUT, FORFEIT and KILL records, applied before the tick they name
+    events: list[tuple]
+    serves: list[Vector2]
+    # (tick, player that scored)
+    scores: list[tuple[int, int]]
+    # (tick, winner id, score of player one, score of player two)
+    end: tuple[int, int, int, int] | None
+    killed_tick: int | None
+    # the file ended inside a record, e.g. the server stopped mid flush
+    truncated: bool
+
+    def __init__(
+            self, path: str, db_game_id: int, db_p1_id: int, db_p2_id: int,
+            sim_hz: int, serve_pause_ticks: int, rewind_ticks: int,
+            started_ms: int):
+        self.path = path
+        self.db_game_id = db_game_id
+        self.db_p1_id = db_p1_id
+        self.db_p2_id = db_p2_id
+        self.sim_hz = sim_hz
+        self.serve_pause_ticks = serve_pause_ticks
+        self.rewind_ticks = rewind_ticks
+        self.started_ms = started_ms
+        self.events = list()
+        self.serves = list()
+        self.scores = list()
+        self.end = None
+        self.killed_tick = None
+        self.truncated = False
+
+    def tick_ms(self) -> float:
+        return 1000 / self.sim_hz
+
+
+class Replay:
+    ticks: int
+    scores: list[tuple[int, int]]
+    end: tuple[int, int, int, int] | None
+    seconds: float
+
+    def __init__(self):
+        self.ticks = 0
+        self.scores = list()
+        self.end = None
+        self.seconds = 0
+
+
+class RecordingError(Exception):
+    pass
+
+
+class ServesExhausted(Exception):
+    pass
+
+
+def load(path: str) -> Recording:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise RecordingError('missing header')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse(path, data)
+
+
+def parse(path: str, data: mmap.mmap) -> Recording:
+    magic, version, *fields = HEADER.unpack_from(data, 0)
+    if magic != RECORD_MAGIC:
+        raise RecordingError('not a match recording')
+    if version != RECORD_VERSION:
+        raise RecordingError(f"unsupported version {version}")
+    recording = Recording(path, *fields)
+    offset = HEADER.size
+    size = len(data)
+    while offset < size:
+        try:
+            kind, tick = EVENT.unpack_from(data, offset)
+            if kind == EVENT_INPUT:
+                recording.events.append(
+                    INPUT_RECORD.unpack_from(data, offset))
+                offset += INPUT_RECORD.size
+            elif kind == EVENT_SERVE:
+                _, _, x, y = SERVE_RECORD.unpack_from(data, offset)
+                recording.serves.append(Vector2(x, y))
+                offset += SERVE_RECORD.size
+            elif kind == EVENT_FORFEIT:
+                recording.events.append(
+                    PLAYER_RECORD.unpack_from(data, offset))
+                offset += PLAYER_RECORD.size
+            elif kind == EVENT_SCORE:
+                _, _, player = PLAYER_RECORD.unpack_from(data, offset)
+                recording.scores.append((tick, player))
+                offset += PLAYER_RECORD.size
+            elif kind == EVENT_END:
+                recording.end = END_RECORD.unpack_from(data, offset)[1:]
+                offset += END_RECORD.size
+            elif kind == EVENT_KILL:
+                recording.events.append((kind, tick))
+                recording.killed_tick = tick
+                offset += KILL_RECORD.size
+            else:
+                raise RecordingError(
+                    f"unknown record {kind} at byte {offset}")
+        except struct.error:
+            recording.truncated = True
+            break
+    if not recording.serves:
+        raise RecordingError('missing first serve')
+    return recording
+
+
+def apply_rates(game: GameInstance, recording: Recording):
+    """
+    Replaces the rates of this process with the recorded ones, the ball
+    speed per tick follows from SIM_HZ like in GameInstance.__init__.
+    """
+    speed = BALL_SPEED_PER_TICK * recording.tick_ms()
+    game.ball.movement_speed = speed
+    game.ball.max_speed = speed * 2
+    game.serve_pause_ticks = recording.serve_pause_ticks
+    game.history = RewindHistory(recording.rewind_ticks + 1)
+
+
+async def replay(
+        recording: Recording,
+        states: range | None = None) -> Replay:
+    result = Replay()
+    game = GameInstance(
+        recording.db_game_id, recording.db_p1_id, recording.db_p2_id)
+    apply_rates(game, recording)
+    serves = deque(recording.serves)
+    game.ball.set_start(ARENA_HEIGHT, ARENA_WIDTH, serves.popleft())
+
+    def next_serve() -> Vector2:
+        if not serves:
+            raise ServesExhausted()
+        return serves.popleft()
+    game.next_serve = next_serve
+
+    def collect(frame):
+        message = frame.message
+        if message['type'] == 'SCORE':
+            result.scores.append(
+                (message['tick'], 1 if message['scored_by'] == 'p1' else 2))
+        elif message['type'] == 'GAME_END':
+            result.end = (
+                message['tick'], message['winner_id'],
+                message['score_player1'], message['score_player2'])
+    game.pipeline.add_tap(collect)
+    game.game_running = True
+    events = recording.events
+    last_tick = events[-1][1] if events else 0
+    if recording.scores:
+        last_tick = max(last_tick, recording.scores[-1][0])
+    i = 0
+    start = perf_counter()
+    while not game.is_done:
+        while i < len(events) and events[i][1] <= game.tick_count:
+            event = events[i]
+            i += 1
+            if event[0] == EVENT_INPUT:
+                _, _, player, direction, timestamp, issued_tick = event
+                buffer = game.p1_input if player == 1 else game.p2_input
+                buffer.push(direction, timestamp, issued_tick)
+            elif event[0] == EVENT_FORFEIT:
+                game.forfeit(event[2] == 1)
+            else:
+                game.kill()
+        if game.is_done:
+            break
+        # an incomplete recording is replayed as far as it goes
+        if recording.end is None and recording.killed_tick is None and \
+                game.tick_count > last_tick:
+            break
+        if states is not None and game.tick_count in states:
+            print(json.dumps(get_game_state(game)))
+        try:
+            await update(game)
+        except ServesExhausted:
+            # scored more often than recorded, divergence() reports it
+            break
+    result.seconds = perf_counter() - start
+    result.ticks = game.tick_count
+    return result
+
+
+def divergence(recording: Recording, result: Replay) -> str | None:
+    for recorded, replayed in zip(recording.scores, result.scores):
+        if recorded != replayed:
+            return f"score {recorded} was replayed as {replayed}"
+    if len(recording.scores) != len(result.scores):
+        return (f"{len(recording.scores)} scores recorded, "
+                f"{len(result.scores)} replayed")
+    if recording.end != result.end:
+        return f"result {recording.end} was replayed as {result.end}"
+    return None
+
+
+def describe(recording: Recording, result: Replay) -> str:
+    match_sec = result.ticks * recording.tick_ms() / 1000
+    speedup = match_sec / result.seconds if result.seconds > 0 else 0
+    if result.end is not None:
+        _, winner, p1_score, p2_score = result.end
+        outcome = f"{p1_score}-{p2_score}, winner {winner}"
+    elif recording.killed_tick is not None:
+        outcome = 'killed without a result'
+    else:
+        outcome = 'incomplete recording'
+    return (f"{recording.path}: game {recording.db_game_id}, "
+            f"{recording.db_p1_id} vs {recording.db_p2_id}, "
+            f"{result.ticks} ticks ({match_sec:.1f}s), {outcome}, "
+            f"replayed in {result.seconds * 1000:.1f}ms ({speedup:.0f}x)")
+
+
+def parse_range(spec: str) -> range:
+    first, _, last = spec.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--verify', action='store_true',
+                        help='exit with 1 when a replay diverges')
+    parser.add_argument('--states', type=parse_range, metavar='FROM-TO',
+                        help='print the STATE of these ticks')
+    parser.add_argument('--scores', action='store_true')
+    args = parser.parse_args()
+    diverged = 0
+    total_ticks = 0
+    total_match_sec = 0
+    total_sec = 0
+    for path in args.files:
+        try:
+            recording = load(path)
+        except (OSError, RecordingError) as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            diverged += 1
+            continue
+        result = await replay(recording, args.states)
+        total_ticks += result.ticks
+        total_match_sec += result.ticks * recording.tick_ms() / 1000
+        total_sec += result.seconds
+        print(describe(recording, result))
+        if args.scores:
+            for tick, player in result.scores:
+                print(f"  tick {tick} "
+                      f"({tick * recording.tick_ms() / 1000:.1f}s) "
+                      f"player {player} scored")
+        if recording.truncated:
+            print("  file ends inside a record", file=sys.stderr)
+        if args.verify:
+            problem = divergence(recording, result)
+            if problem is not None:
+                print(f"  diverged: {problem}", file=sys.stderr)
+                diverged += 1
+    if len(args.files) > 1 and total_sec > 0:
+        print(f"{len(args.files)} files, {total_ticks} ticks in "
+              f"{total_sec:.2f}s, {total_ticks / total_sec:.0f} ticks/s "
+              f"({total_match_sec / total_sec:.0f}x real time)")
+    if diverged:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
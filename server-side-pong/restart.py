@@ -0,0 +1,190 @@
+"""
+Handoff of running matches to the next server process.
+
+With RESTART_SNAPSHOT set, SIGTERM stops the tick loop and the heartbeat
+wheel and writes every running lobby to that file before the connections
+are closed with 1012 (service restart): ball, paddles, scores, the pending
+moves with their client timestamps, the rewind history, the ids of both
+players and the recording the match appends to. Nothing ticks between the
+snapshot and the exit, so the match continues from exactly that state.
+
+The next process restores the lobbies at startup, before it accepts
+connections, and removes the file. A restored lobby waits for its players
+like a new one, a player that sends START_GAME for its game gets ID and
+RESUME with the score and the match continues once both are back. The web
+client and loadgen.py reconnect on 1012 and send START_GAME again. When only
+one of them returns within the lobby timeout the other forfeits.
+
+A snapshot older than RESTART_SNAPSHOT_MAX_AGE_SEC, or taken with other
+simulation rates, is discarded. SIGINT still exits without a snapshot.
+"""
+import json
+import os
+from os import getenv
+from time import time
+from ball import Ball
+from gameinstance import REWIND_TICKS, SERVE_PAUSE_TICKS, GameInstance
+from lib import Vector2
+from lifecycle import Lifecycle
+from rates import SIM_HZ
+from recorder import WRITER, MatchRecorder
+from rewind import RewindHistory
+from shard import GAME_SHARDS, shard_of
+from logger import Logger
+
+RESTART_SNAPSHOT = getenv('RESTART_SNAPSHOT', '')
+RESTART_SNAPSHOT_MAX_AGE_SEC = int(
+    getenv('RESTART_SNAPSHOT_MAX_AGE_SEC', '30'))
+RESTART_SNAPSHOT_VERSION = 1
+# close code of every connection of the outgoing process
+CLOSE_SERVICE_RESTART = 1012
+
+LOG = Logger('restart')
+
+
+def snapshot_path(shard: int) -> str:
+    if GAME_SHARDS > 1:
+        return f"{RESTART_SNAPSHOT}.{shard}"
+    return RESTART_SNAPSHOT
+
+
+def ball_state(ball: Ball) -> dict:
+    return {
+        'x': ball.shape.x,
+        'y': ball.shape.y,
+        'dir_x': ball.dir_vect.x,
+        'dir_y': ball.dir_vect.y,
+        'speed': ball.movement_speed,
+        'speed_incr': ball.speed_incr
+    }
+
+
+def history_state(history: RewindHistory) -> dict:
+    return {name: getattr(history, name) for name in RewindHistory.__slots__
+            if name != 'capacity'}
+
+
+def lobby_state(lobby: GameInstance) -> dict:
+    recording = None
+    if lobby.recorder is not None and not lobby.recorder.failed:
+        recording = lobby.recorder.path
+    return {
+        'game_id': lobby.db_game_id,
+        'player1_id': lobby.db_p1_id,
+        'player2_id': lobby.db_p2_id,
+        'tick': lobby.tick_count,
+        'serve_tick': lobby.serve_tick,
+        'ball': ball_state(lobby.ball),
+        'p1': {
+            'y': lobby.p1_paddle.shape.y,
+            'score': lobby.p1_score,
+            'last_ts': lobby.p1_last_ts,
+            'moves': lobby.p1_input.pending()
+        },
+        'p2': {
+            'y': lobby.p2_paddle.shape.y,
+            'score': lobby.p2_score,
+            'last_ts': lobby.p2_last_ts,
+            'moves': lobby.p2_input.pending()
+        },
+        'history': history_state(lobby.history),
+        'recording': recording
+    }
+
+
+def write_snapshot(shard: int, lobbies: list[GameInstance]) -> int:
+    """
+    Writes the running `lobbies` and stops their recordings, the next
+    process appends to them. Returns the number of lobbies written.
+    """
+    lobbies = [lobby for lobby in lobbies
+               if lobby.game_running and not lobby.force_kill]
+    snapshot = {
+        'version': RESTART_SNAPSHOT_VERSION,
+        'written_at': time(),
+        'rates': [SIM_HZ, SERVE_PAUSE_TICKS, REWIND_TICKS],
+        'lobbies': [lobby_state(lobby) for lobby in lobbies]
+    }
+    path = snapshot_path(shard)
+    # a process that starts while this one writes never reads half a file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+    for lobby in lobbies:
+        lobby.recorder = None
+    WRITER.flush()
+    return len(lobbies)
+
+
+def read_snapshot(shard: int) -> list[dict]:
+    path = snapshot_path(shard)
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        LOG.error(f"could not read restart snapshot {path}: {e}")
+        return []
+    finally:
+        # restored at most once, a crash loop must not replay it
+        if os.path.exists(path):
+            os.remove(path)
+    age = time() - snapshot.get('written_at', 0)
+    if snapshot.get('version') != RESTART_SNAPSHOT_VERSION:
+        LOG.warning("discarding restart snapshot of another version")
+        return []
+    if age > RESTART_SNAPSHOT_MAX_AGE_SEC:
+        LOG.warning(f"discarding restart snapshot from {age:.0f}s ago")
+        return []
+    if snapshot['rates'] != [SIM_HZ, SERVE_PAUSE_TICKS, REWIND_TICKS]:
+        LOG.warning("discarding restart snapshot taken with other rates")
+        return []
+    return snapshot['lobbies']
+
+
+def restore_lobby(lobby: GameInstance, state: dict):
+    lobby.tick_count = state['tick']
+    lobby.serve_tick = state['serve_tick']
+    ball = lobby.ball
+    ball.shape.x = state['ball']['x']
+    ball.shape.y = state['ball']['y']
+    ball.dir_vect = Vector2(state['ball']['dir_x'], state['ball']['dir_y'])
+    ball.movement_speed = state['ball']['speed']
+    ball.speed_incr = state['ball']['speed_incr']
+    lobby.p1_paddle.shape.y = state['p1']['y']
+    lobby.p1_score = state['p1']['score']
+    lobby.p1_last_ts = state['p1']['last_ts']
+    lobby.p2_paddle.shape.y = state['p2']['y']
+    lobby.p2_score = state['p2']['score']
+    lobby.p2_last_ts = state['p2']['last_ts']
+    for buffer, moves in ((lobby.p1_input, state['p1']['moves']),
+                          (lobby.p2_input, state['p2']['moves'])):
+        for direction, timestamp, tick in moves:
+            buffer.push(direction, timestamp, tick)
+    for name, value in state['history'].items():
+        setattr(lobby.history, name, value)
+    if state['recording'] is not None and \
+            os.path.exists(state['recording']):
+        lobby.recorder = MatchRecorder(state['recording'])
+    lobby.resumed = True
+
+
+def restore_lobbies(lifecycle: Lifecycle, shard: int) -> int:
+    """
+    Opens a waiting lobby for every match of the snapshot this shard owns,
+    returns the number of lobbies restored.
+    """
+    restored = 0
+    for state in read_snapshot(shard):
+        if shard_of(state['game_id']) != shard:
+            LOG.warning("restored match belongs to another shard",
+                        lobby=state['game_id'])
+            continue
+        lobby = lifecycle.open_lobby(
+            state['game_id'], state['player1_id'], state['player2_id'])
+        restore_lobby(lobby, state)
+        lifecycle.wait_for_players(lobby)
+        restored += 1
+    return restored
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import requests
+from base64 import b64encode
+from os import getenv
+from time import monotonic
+from metrics import UPLOAD_DURATION
+from logger import Logger
+
+HTTP_PASSWD = getenv('HTTP_PASSWD')
+BACKEND_PORT = getenv('BACKEND_PORT')
+BACKEND_HOST = getenv('BACKEND_HOST', 'backend')
+RESULT_SPOOL_DIR = getenv('RESULT_SPOOL_DIR', './spool')
+
+if HTTP_PASSWD is None:
+    print('Missing HTTP_PASSWD environment variable', file=sys.stderr)
+    exit(1)
+
+if BACKEND_PORT is None:
+    print('Missing BACKEND_PORT environment variable', file=sys.stderr)
+    exit(1)
+
+UPLOAD_POOL_SIZE = 8
+UPLOAD_TIMEOUT_SEC = 5
+UPLOAD_MAX_ATTEMPTS = 5
+UPLOAD_BACKOFF_SEC = 0.5
+UPLOAD_BACKOFF_MAX_SEC = 8
+UPLOAD_MAX_BATCH = 32
+# results that exhausted their attempts stay on disk and are retried later
+SPOOL_RESCAN_SEC = 60
+
+LOG = Logger('upload')
+
+
+class ResultUploader:
+    """
+    Delivers finished game results to the backend off the event loop. Every
+    result is written to the spool directory as soon as it is queued and only
+    removed once the backend accepted it, so results survive a backend outage
+    and a restart of the game server. Each result is delivered by its own
+    task, a result that waits for its next attempt never holds up another.
+    Results finishing together are spooled in one go, the backend still takes
+    one request per result.
+    """
+    base_url: str
+    spool_dir: str
+    queue: asyncio.Queue
+    pending: set[int]
+    # requests in flight, each one holds a worker thread and its session
+    slots: asyncio.Semaphore
+    deliveries: set[asyncio.Task]
+    authorization: str
+    # a requests.Session is not thread safe, every worker thread of
+    # asyncio.to_thread keeps its own
+    local: threading.local
+    last_upload_ms: float
+
+    def __init__(self, base_url: str, spool_dir: str):
+        self.base_url = base_url
+        self.spool_dir = spool_dir
+        self.queue = asyncio.Queue()
+        self.pending = set()
+        self.slots = asyncio.Semaphore(UPLOAD_POOL_SIZE)
+        self.deliveries = set()
+        self.last_upload_ms = 0
+        self.authorization = "Basic " + b64encode(
+            f"gameserver:{HTTP_PASSWD}".encode()).decode()
+        self.local = threading.local()
+
+    def submit(self, db_game_id: int, result: dict):
+        """
+        Queue a result for delivery, safe to call from inside a tick.
+        """
+        if db_game_id in self.pending:
+            return
+        self.pending.add(db_game_id)
+        self.queue.put_nowait((db_game_id, result, False))
+
+    def spool_path(self, db_game_id: int) -> str:
+        return os.path.join(self.spool_dir, f"{db_game_id}.json")
+
+    def spool(self, batch: list[tuple[int, dict, bool]]):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        for db_game_id, result, spooled in batch:
+            if spooled:
+                continue
+            path = self.spool_path(db_game_id)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(result, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+
+    def unspool(self, db_game_id: int):
+        try:
+            os.remove(self.spool_path(db_game_id))
+        except FileNotFoundError:
+            pass
+
+    def read_spool(self) -> list[tuple[int, dict, bool]]:
+        results = []
+        if not os.path.isdir(self.spool_dir):
+            return results
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                db_game_id = int(name.removesuffix('.json'))
+                with open(os.path.join(self.spool_dir, name)) as f:
+                    results.append((db_game_id, json.load(f), True))
+            except (ValueError, OSError) as e:
+                LOG.warning(f"skipping spooled result {name}: {e}")
+        return results
+
+    async def requeue_spool(self):
+        for db_game_id, result, spooled in \
+                await asyncio.to_thread(self.read_spool):
+            if db_game_id in self.pending:
+                continue
+            self.pending.add(db_game_id)
+            self.queue.put_nowait((db_game_id, result, spooled))
+
+    def session(self) -> requests.Session:
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            session.headers['Authorization'] = self.authorization
+        return session
+
+    def put(self, db_game_id: int, result: dict) -> int:
+        response = self.session().put(
+            f"{self.base_url}/api/games/{db_game_id}/finish",
+            json=result, timeout=UPLOAD_TIMEOUT_SEC)
+        return response.status_code
+
+    async def deliver(self, db_game_id: int, result: dict):
+        for attempt in range(UPLOAD_MAX_ATTEMPTS):
+            try:
+                async with self.slots:
+                    start = monotonic()
+                    status = await asyncio.to_thread(
+                        self.put, db_game_id, result)
+                self.last_upload_ms = (monotonic() - start) * 1000
+                UPLOAD_DURATION.observe(self.last_upload_ms / 1000)
+                LOG.info(f"upload response code {status}", lobby=db_game_id)
+                # client errors other than timeouts and rate limits will not
+                # go away by trying again
+                if status < 500 and status not in (408, 429):
+                    await asyncio.to_thread(self.unspool, db_game_id)
+                    break
+            except requests.RequestException as e:
+                LOG.error(repr(e), lobby=db_game_id)
+            if attempt == UPLOAD_MAX_ATTEMPTS - 1:
+                continue
+            await asyncio.sleep(min(
+                UPLOAD_BACKOFF_SEC * (2 ** attempt), UPLOAD_BACKOFF_MAX_SEC))
+        else:
+            LOG.error("upload failed, result kept in spool", lobby=db_game_id)
+        self.pending.discard(db_game_id)
+
+    async def rescan(self):
+        while True:
+            await asyncio.sleep(SPOOL_RESCAN_SEC)
+            await self.requeue_spool()
+
+    async def run(self):
+        await self.requeue_spool()
+        asyncio.create_task(self.rescan())
+        while True:
+            batch = [await self.queue.get()]
+            # many games finishing at once are spooled in one go
+            while len(batch) < UPLOAD_MAX_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await asyncio.to_thread(self.spool, batch)
+            except OSError as e:
+                LOG.error(f"could not spool results: {e}")
+            for db_game_id, result, _ in batch:
+                task = asyncio.create_task(self.deliver(db_game_id, result))
+                self.deliveries.add(task)
+                task.add_done_callback(self.deliveries.discard)
+
+
+UPLOADER = ResultUploader(
+    f"http://{BACKEND_HOST}:{BACKEND_PORT}", RESULT_SPOOL_DIR)
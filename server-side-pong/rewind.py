@@ -0,0 +1,79 @@
+"""
+Short history of past lobby states for server side lag compensation.
+
+A move is scheduled for the tick its player issued it, which is the tick it
+arrived in minus half the round trip of the connection's last keepalive
+ping. The server measures that round trip itself, unlike the HEARTBEAT
+timestamp it does not depend on the client's clock and can not be forged.
+When the issued tick is still in the history and the ball came within reach
+of the player's paddle since then, the ball is rewound to the recorded
+state, the paddle is moved at the issued tick and the ticks up to now are
+simulated again, so a late block still counts. The window is capped by
+REWIND_MAX_MS, a client that delays its pongs can not rewind further.
+"""
+from os import getenv
+from ball import Ball
+
+REWIND_MAX_MS = int(getenv('REWIND_MAX_MS', '150'))
+
+
+class RewindHistory:
+    """
+    Ring of the state at the start of the last `capacity` ticks, stored in
+    parallel lists so recording a tick does not allocate.
+    """
+    __slots__ = (
+        'capacity', 'ticks', 'ball_x', 'ball_y', 'dir_x', 'dir_y', 'p1_y',
+        'p2_y', 'head', 'size'
+    )
+    capacity: int
+    ticks: list[int]
+    ball_x: list[float]
+    ball_y: list[float]
+    dir_x: list[float]
+    dir_y: list[float]
+    p1_y: list[float]
+    p2_y: list[float]
+    # slot of the newest entry
+    head: int
+    size: int
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ticks = [0] * capacity
+        self.ball_x = [0.0] * capacity
+        self.ball_y = [0.0] * capacity
+        self.dir_x = [0.0] * capacity
+        self.dir_y = [0.0] * capacity
+        self.p1_y = [0.0] * capacity
+        self.p2_y = [0.0] * capacity
+        self.head = capacity - 1
+        self.size = 0
+
+    def record(self, tick: int, ball: Ball, p1_y: float, p2_y: float):
+        self.head = (self.head + 1) % self.capacity
+        i = self.head
+        self.ticks[i] = tick
+        self.ball_x[i] = ball.shape.x
+        self.ball_y[i] = ball.shape.y
+        self.dir_x[i] = ball.dir_vect.x
+        self.dir_y[i] = ball.dir_vect.y
+        self.p1_y[i] = p1_y
+        self.p2_y[i] = p2_y
+        if self.size < self.capacity:
+            self.size += 1
+
+    def slot(self, tick: int) -> int | None:
+        """
+        Slot of the entry recorded at `tick`, None when it is not kept.
+        """
+        age = self.ticks[self.head] - tick
+        if self.size == 0 or age < 0 or age >= self.size:
+            return None
+        return (self.head - age) % self.capacity
+
+    def clear(self):
+        """
+        Called when the ball is served again, a rewind must not undo a score.
+        """
+        self.size = 0
@@ -0,0 +1,92 @@
+import asyncio
+from time import monotonic
+from gameinstance import GameInstance
+from batch_physics import BatchPhysics
+from metrics import SENT_BYTES, TICK_DURATION, TICK_SENT_BYTES
+from logger import Logger
+
+# how many missed ticks are simulated back to back before the scheduler gives
+# up on catching up and skips ahead to the current time
+MAX_CATCH_UP_TICKS = 5
+
+LOG = Logger('scheduler')
+
+
+class TickScheduler:
+    """
+    Advances every running lobby on one shared fixed timestep. Tick deadlines
+    are computed from a monotonic start time so sleep and processing time never
+    accumulate into drift.
+    """
+    tick_sec: float
+    max_catch_up: int
+    lobbies: set[GameInstance]
+    engine: BatchPhysics | None
+
+    # accounting
+    tick_count: int
+    overrun_count: int
+    skipped_ticks: int
+    last_tick_ms: float
+    worst_tick_ms: float
+
+    def __init__(
+            self, tick_ms: float, max_catch_up=MAX_CATCH_UP_TICKS,
+            engine: BatchPhysics | None = None):
+        self.tick_sec = tick_ms / 1000
+        self.max_catch_up = max_catch_up
+        self.lobbies = set()
+        self.engine = engine
+        self.tick_count = 0
+        self.overrun_count = 0
+        self.skipped_ticks = 0
+        self.last_tick_ms = 0
+        self.worst_tick_ms = 0
+
+    def add(self, lobby: GameInstance):
+        self.lobbies.add(lobby)
+
+    def remove(self, lobby: GameInstance):
+        self.lobbies.discard(lobby)
+
+    async def step(self):
+        start = monotonic()
+        sent_bytes = SENT_BYTES.value
+        if self.engine is not None:
+            try:
+                await self.engine.step(list(self.lobbies))
+            except Exception as e:
+                LOG.error(f"batch tick failed: {e}")
+        else:
+            for lobby in list(self.lobbies):
+                try:
+                    await lobby.tick()
+                except Exception as e:
+                    LOG.error(f"tick failed: {e}", lobby=lobby.db_game_id)
+                    lobby.kill()
+        for lobby in list(self.lobbies):
+            if not lobby.game_running:
+                self.remove(lobby)
+        self.tick_count += 1
+        self.last_tick_ms = (monotonic() - start) * 1000
+        TICK_DURATION.observe(self.last_tick_ms / 1000)
+        TICK_SENT_BYTES.observe(SENT_BYTES.value - sent_bytes)
+        if self.last_tick_ms > self.worst_tick_ms:
+            self.worst_tick_ms = self.last_tick_ms
+        if self.last_tick_ms > self.tick_sec * 1000:
+            self.overrun_count += 1
+
+    async def run(self):
+        next_tick = monotonic()
+        while True:
+            behind = int((monotonic() - next_tick) / self.tick_sec)
+            if behind > self.max_catch_up:
+                # too far behind, drop the backlog instead of spiraling
+                self.skipped_ticks += behind
+                next_tick += behind * self.tick_sec
+            await self.step()
+            next_tick += self.tick_sec
+            delay = next_tick - monotonic()
+            # a negative delay means we are late, the next iteration runs
+            # immediately to catch up but still yields to the event loop
+            await asyncio.sleep(max(delay, 0))
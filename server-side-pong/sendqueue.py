@@ -0,0 +1,207 @@
+import asyncio
+from collections import deque
+from os import getenv
+from websockets import ServerConnection, ConnectionClosed, broadcast
+from websockets.protocol import OPEN
+from websockets.typing import Data
+from metrics import SENT_BYTES, SENT_MESSAGES
+from logger import Logger
+from rates import SNAPSHOT_INTERVALS, SNAPSHOT_PING_MS
+
+# bytes in the socket write buffer above which a connection counts as
+# congested, its outbound messages are queued instead of written directly
+SEND_HIGH_WATER = int(getenv('SEND_HIGH_WATER', '16384'))
+# queued plus unsent bytes above which a congested client is dropped
+SEND_DROP_BYTES = int(getenv('SEND_DROP_BYTES', '262144'))
+SEND_MAX_QUEUED = 64
+# a client that has not accepted a single frame for this long is dropped
+SEND_STALL_SEC = 10
+
+SEND_STATS = {'queued': 0, 'coalesced': 0, 'dropped_clients': 0}
+
+LOG = Logger('send')
+
+
+class SendQueue:
+    """
+    Outbound buffer of one congested connection. Only the newest STATE frame
+    is kept, every other message is delivered before it and in order, so a
+    slow client holds at most SEND_DROP_BYTES before it is dropped.
+
+    Also holds the snapshot rate of the connection, an index into
+    SNAPSHOT_INTERVALS. A replaced STATE frame lowers it right away, a
+    HEARTBEAT sets it from the keepalive round trip once the connection
+    stayed uncongested.
+    """
+    connection: ServerConnection
+    messages: deque[Data]
+    message_bytes: int
+    state: Data | None
+    writer: asyncio.Task | None
+    dropped: bool
+    rate: int
+    congested: bool
+    # tick of the last STATE sent while below the full rate
+    state_tick: int
+
+    def __init__(self, connection: ServerConnection):
+        self.connection = connection
+        self.messages = deque()
+        self.message_bytes = 0
+        self.state = None
+        self.writer = None
+        self.dropped = False
+        self.rate = 0
+        self.congested = False
+        self.state_tick = -1
+
+    def is_idle(self) -> bool:
+        """
+        Idle connections are written to directly, without a queue hop.
+        """
+        return self.writer is None and \
+            self.connection.transport.get_write_buffer_size() < \
+            SEND_HIGH_WATER
+
+    def push(self, data: Data, coalesce=False):
+        if coalesce:
+            if self.state is not None:
+                SEND_STATS['coalesced'] += 1
+                self.set_rate(self.rate + 1)
+            self.state = data
+            self.congested = True
+        else:
+            self.messages.append(data)
+            self.message_bytes += len(data)
+        SEND_STATS['queued'] += 1
+        unsent = self.message_bytes + \
+            self.connection.transport.get_write_buffer_size()
+        if len(self.messages) > SEND_MAX_QUEUED or unsent > SEND_DROP_BYTES:
+            self.drop(f"{unsent} bytes unsent")
+            return
+        if self.writer is None:
+            self.writer = asyncio.create_task(self.write())
+
+    async def write(self):
+        try:
+            while self.messages or self.state is not None:
+                if self.messages:
+                    data = self.messages.popleft()
+                    self.message_bytes -= len(data)
+                else:
+                    data = self.state
+                    self.state = None
+                async with asyncio.timeout(SEND_STALL_SEC):
+                    await self.connection.send(data)
+        except TimeoutError:
+            self.drop(f"no progress for {SEND_STALL_SEC}s")
+        except ConnectionClosed:
+            pass
+        finally:
+            self.writer = None
+
+    def set_rate(self, rate: int):
+        rate = min(rate, len(SNAPSHOT_INTERVALS) - 1)
+        if rate == self.rate:
+            return
+        self.rate = rate
+        if rate == 0:
+            REDUCED_RATE.discard(self.connection)
+        else:
+            REDUCED_RATE.add(self.connection)
+
+    def adapt(self, rtt_ms: float):
+        rate = sum(1 for limit in SNAPSHOT_PING_MS if rtt_ms >= limit)
+        if self.congested:
+            rate = max(rate, self.rate)
+        self.congested = False
+        self.set_rate(rate)
+
+    def drop(self, reason: str):
+        if self.dropped:
+            return
+        self.dropped = True
+        self.messages.clear()
+        self.message_bytes = 0
+        self.state = None
+        SEND_STATS['dropped_clients'] += 1
+        LOG.warning(f"dropping slow client: {reason}",
+                    connection=self.connection.id)
+        # a closing handshake would queue behind the congested buffer
+        self.connection.transport.abort()
+
+
+SEND_QUEUES: dict[ServerConnection, SendQueue] = dict()
+# connections below the full snapshot rate
+REDUCED_RATE: set[ServerConnection] = set()
+
+
+def open_queue(connection: ServerConnection):
+    SEND_QUEUES[connection] = SendQueue(connection)
+
+
+def close_queue(connection: ServerConnection):
+    queue = SEND_QUEUES.pop(connection, None)
+    REDUCED_RATE.discard(connection)
+    if queue is not None and queue.writer is not None:
+        queue.writer.cancel()
+
+
+def deliver(connections: list[ServerConnection], data: Data, coalesce=False):
+    """
+    Drop-in for websockets.broadcast. Idle connections share one direct
+    write, congested ones get the message queued. Set `coalesce` for STATE
+    frames, which may replace each other while a connection is backed up.
+    """
+    SENT_MESSAGES.inc(len(connections))
+    SENT_BYTES.inc(len(data) * len(connections))
+    direct = []
+    for connection in connections:
+        queue = SEND_QUEUES.get(connection)
+        if queue is None or queue.is_idle():
+            direct.append(connection)
+        elif not queue.dropped:
+            queue.push(data, coalesce)
+    if direct:
+        broadcast(direct, data)
+
+
+def snapshot_due(
+        connections: list[ServerConnection],
+        tick: int) -> list[ServerConnection]:
+    """
+    The connections that receive the STATE of `tick` at their rate.
+    """
+    if not REDUCED_RATE:
+        return connections
+    due = []
+    for connection in connections:
+        if connection in REDUCED_RATE:
+            queue = SEND_QUEUES[connection]
+            if tick - queue.state_tick < SNAPSHOT_INTERVALS[queue.rate]:
+                continue
+            queue.state_tick = tick
+        due.append(connection)
+    return due
+
+
+def adapt_rate(connection: ServerConnection):
+    """
+    Follows the round trip of the last keepalive ping, unlike the HEARTBEAT
+    ping it does not depend on the client's clock.
+    """
+    queue = SEND_QUEUES.get(connection)
+    if queue is not None:
+        queue.adapt(connection.latency * 1000)
+
+
+def send(connection: ServerConnection, data: Data) -> bool:
+    """
+    Returns False when the connection can no longer receive messages.
+    """
+    queue = SEND_QUEUES.get(connection)
+    if connection.protocol.state is not OPEN or \
+            (queue is not None and queue.dropped):
+        return False
+    deliver([connection], data)
+    return True
@@ -1,16 +1,44 @@
 import asyncio
 import json
+import multiprocessing
+import os
 import random as rand
 import sys
 import signal
 from time import time
-from websockets import ServerConnection, Request, ConnectionClosed
-from websockets.asyncio.server import serve
-from gameinstance import GameInstance
+from websockets import ServerConnection, Request, Response, ConnectionClosed
+from websockets.asyncio.server import Server, serve
+from gameinstance import TICK
+from scheduler import TickScheduler
+from batch_physics import BatchPhysics, np
+from result_upload import UPLOADER, RESULT_SPOOL_DIR
+from registry import Registry
+from lifecycle import Lifecycle
+from admission import Admission, HandshakeConnection
+from frames import (
+    OPCODE_ACK, OPCODE_HEARTBEAT, OPCODE_MOVE_DOWN, OPCODE_MOVE_UP,
+    OPCODE_RESYNC, decode_input, select_subprotocol
+)
+from spectators import FAN_OUT, MAX_SPECTATORS
+from restart import (
+    CLOSE_SERVICE_RESTART, RESTART_SNAPSHOT, restore_lobbies, write_snapshot
+)
+from sendqueue import (
+    SEND_QUEUES, SEND_STATS, adapt_rate, open_queue, send
+)
+from rates import KEEPALIVE_INTERVAL_SEC, SNAPSHOT_RATES_HZ
+from pipeline import SERIALIZATION_COUNTS
+from metrics import METRICS, PLAYER_PING, serve_metrics
+from logger import LOG_CONTEXT, WRITER, Logger
+from shard import (
+    GAME_SHARDS, ConnectionHandedOff, HandoffReceiver, RecordingConnection,
+    hand_off, shard_of
+)
 from player import Player
+from session import Session
+from input_buffer import MOVE_DOWN, MOVE_UP
 from os import getenv
 from time import time_ns
-import jwt
 
 JWT_SECRET = getenv('JWT_SECRET')
 if JWT_SECRET is None:
@@ -20,40 +48,24 @@ if JWT_SECRET is None:
 IP = "0.0.0.0"
 PORT = 8081  # change to envvar
 
-CONNECTED: list[Player] = []
-LOBBIES: [GameInstance] = []
-
-
-def add_game_instance(
-        db_game_id: int, db_p1_id: int, db_p2_id: int) -> GameInstance:
-    """
-    The gameserver receives all the game information from the backend server.
-    """
-    print(f"creating lobby with id: {db_game_id}")
-    LOBBIES.append(GameInstance(db_game_id, db_p1_id, db_p2_id))
-    return LOBBIES[-1]
-
-
-def find_game_instance(
-        db_game_id=None | int, player=None | Player
-        ) -> GameInstance | None:
-    lobby: GameInstance
-    if db_game_id is not None:
-        for lobby in LOBBIES:
-            if lobby.db_game_id == db_game_id:
-                return lobby
-    if player is not None:
-        for lobby in LOBBIES:
-            if player in lobby.players:
-                return lobby
-    return None
+REGISTRY = Registry()
+ADMISSION = Admission(JWT_SECRET)
+# index of this worker process in sharded mode
+SHARD = 0
+# opt-in vectorized physics for all lobbies at once, requires numpy
+BATCH_PHYSICS = getenv('BATCH_PHYSICS') == '1'
+if BATCH_PHYSICS and np is None:
+    print('BATCH_PHYSICS is set but numpy is not installed', file=sys.stderr)
+    exit(1)
+SCHEDULER = TickScheduler(
+    TICK, engine=BatchPhysics() if BATCH_PHYSICS else None)
+LIFECYCLE = Lifecycle(REGISTRY, SCHEDULER)
 
+# inbound messages by format
+RECEIVED_COUNTS = {'json': 0, 'binary': 0}
 
-def find_player(connection: ServerConnection):
-    player: Player
-    for player in CONNECTED:
-        if player.connection is connection:
-            return player
+LOG = Logger('server')
+HEARTBEAT_LOG = Logger('heartbeat')
 
 
 def validate_message(message_content: dict):
@@ -61,138 +73,339 @@ def validate_message(message_content: dict):
         raise RuntimeError('Message is missing type property')
 
 
-async def reap_lobbies():
-    while True:
-        for i, lobby in enumerate(LOBBIES):
-            if lobby.is_done:
-                print("deleting lobby...")
-                del LOBBIES[i]
-        await asyncio.sleep(30)
+async def route_to_shard(player: Player, db_game_id: int):
+    """
+    Moves the connection to the shard that owns the game, raises
+    ConnectionHandedOff when it did.
+    """
+    if GAME_SHARDS == 1:
+        return
+    owner = shard_of(db_game_id)
+    if owner != SHARD:
+        if await hand_off(player.connection, player, owner):
+            raise ConnectionHandedOff
+        LOG.warning(f"could not hand lobby to shard {owner}",
+                    lobby=db_game_id, user=player.user_id)
+    if isinstance(player.connection, RecordingConnection):
+        player.connection.stop_recording()
 
 
 async def process_message(
-        message_type: str, message_content, player: Player):
+        message_type: str, message_content, session: Session):
+    player = session.player
     if message_type == 'START_GAME':
-        game_instance = find_game_instance(
-            db_game_id=message_content['game_id']
-        )
+        await route_to_shard(player, message_content['game_id'])
+        if LIFECYCLE.is_finished(message_content['game_id']):
+            send(player.connection, json.dumps(
+                {'type': 'ERROR', 'message': 'Game already finished'}))
+            return
+        game_instance = REGISTRY.get_lobby(message_content['game_id'])
+        # checked before a lobby is opened, a lobby nobody can join would
+        # never be timed out and would lock its game id
         if game_instance is None:
-            game_instance = add_game_instance(
+            is_player = player.user_id in (
+                message_content['player1_id'], message_content['player2_id'])
+        else:
+            is_player = game_instance.has_player_id(player.user_id)
+        if not is_player:
+            raise RuntimeError(
+                f"user {player.user_id} is not a player of game "
+                f"{message_content['game_id']}")
+        if game_instance is None:
+            # The gameserver receives all the game information from the
+            # backend server.
+            game_instance = LIFECYCLE.open_lobby(
                 message_content['game_id'],
                 message_content['player1_id'],
                 message_content['player2_id']
             )
+        LIFECYCLE.stop_spectating(player.connection)
+        previous = REGISTRY.lobby_of(player)
+        if previous is not None and previous is not game_instance:
+            previous.detach(player.connection)
         await game_instance.add_player(player)
-        if not game_instance.lobby_full():
-            asyncio.create_task(game_instance.start_lobby())
+        REGISTRY.join_lobby(game_instance, player)
+        session.lobby = game_instance
+        if not game_instance.game_running:
+            LIFECYCLE.wait_for_players(game_instance)
+        return
+    if message_type == 'SPECTATE':
+        await route_to_shard(player, message_content['game_id'])
+        error = None
+        lobby = REGISTRY.get_lobby(message_content['game_id'])
+        if REGISTRY.lobby_of(player) is not None:
+            error = 'Players can not spectate'
+        elif lobby is None or lobby.is_done:
+            error = 'Game not found'
+        elif len(lobby.spectators) >= MAX_SPECTATORS:
+            error = 'Too many spectators'
+        if error is not None:
+            send(player.connection, json.dumps(
+                {'type': 'ERROR', 'message': error}))
+            return
+        hz = message_content.get('hz')
+        LIFECYCLE.spectate(
+            player.connection, lobby, int(hz) if hz is not None else None)
+        return
+    if message_type == 'HEARTBEAT':
+        heartbeat(player, int(message_content['timestamp']))
         return
     # The message contains a game state update at this point so always look for
     # the related lobby first
-    lobby = find_game_instance(player=player)
+    lobby = session.current_lobby()
     if lobby is None:
         return
     match message_type:
         case 'MOVE_DOWN':
-            if player.user_id == lobby.db_p1_id:
-                lobby.p1_input.append(['DOWN', message_content['timestamp']])
-            else:
-                lobby.p2_input.append(['DOWN', message_content['timestamp']])
+            lobby.push_input(
+                player, MOVE_DOWN, int(message_content['timestamp']))
         case 'MOVE_UP':
-            if player.user_id == lobby.db_p1_id:
-                lobby.p1_input.append(['UP', message_content['timestamp']])
-            else:
-                lobby.p2_input.append(['UP', message_content['timestamp']])
-        case 'HEARTBEAT':
-            # https://stackoverflow.com/a/56394660
-            now = time_ns() // 1_000_000
-            player: Player
-            if player.connection == lobby.players[0].connection:
-                player = lobby.players[0]
-            else:
-                player = lobby.players[1]
-            player.last_hearbeat = now
-            player.ping = now - int(message_content['timestamp'])
-            if player.ping < 0:
-                player.ping = 0
-            print(f"player \"{player.username}\" sent HEARTBEAT, ping "
-                  f"{player.ping}ms")
+            lobby.push_input(
+                player, MOVE_UP, int(message_content['timestamp']))
+        case 'ACK':
+            lobby.pipeline.delta.ack(
+                player.connection, int(message_content['tick']))
+        case 'RESYNC':
+            lobby.pipeline.delta.resync(player.connection)
         case _:
             raise RuntimeError(f"Unknown message type: {message_type}")
 
 
-async def handler(websocket: ServerConnection):
-    print(f"connection added: {websocket}")
-    async for message in websocket:
-        try:
-            message_content = json.loads(message)
-            validate_message(message_content)
-            message_type = message_content['type']
-            player = find_player(websocket)
-            await process_message(message_type, message_content, player)
-        except ConnectionClosed as e:
-            print(f"connection closed: {websocket}: {e}")
-            break
-        except Exception as e:
-            print(e, file=sys.stderr)
-            continue
+def heartbeat(player: Player, timestamp: int):
+    # players are supervised whether they are in a lobby or not
+    LIFECYCLE.heartbeats.reset(player)
+    # https://stackoverflow.com/a/56394660
+    now = time_ns() // 1_000_000
+    player.ping = now - timestamp
+    if player.ping < 0:
+        player.ping = 0
+    PLAYER_PING.observe(player.ping / 1000)
+    adapt_rate(player.connection)
+    HEARTBEAT_LOG.info(
+        "HEARTBEAT", user=player.user_id, ping_ms=player.ping)
 
 
-async def add_player(player: Player):
-    i = 0
-    while i < len(CONNECTED):
-        conn_player: Player = CONNECTED[i]
-        # remove any old connections from the same player, new connections have
-        # priority
-        if conn_player.user_id is player.user_id:
-            await conn_player.connection.close(
-                reason="You have initiated a new request, you are probably "
-                "logged in on separate browser tabs"
-            )
-        i += 1
-    CONNECTED.append(player)
+def process_frame(frame: bytes, session: Session):
+    """
+    Binary counterpart of process_message for the high frequency messages,
+    see frames.py.
+    """
+    if not session.binary:
+        raise RuntimeError('Binary frames need a binary subprotocol')
+    opcode, value = decode_input(frame)
+    if opcode == OPCODE_HEARTBEAT:
+        heartbeat(session.player, value)
+        return
+    lobby = session.current_lobby()
+    if lobby is None:
+        return
+    if opcode == OPCODE_MOVE_DOWN:
+        lobby.push_input(session.player, MOVE_DOWN, value)
+    elif opcode == OPCODE_MOVE_UP:
+        lobby.push_input(session.player, MOVE_UP, value)
+    elif opcode == OPCODE_ACK:
+        lobby.pipeline.delta.ack(session.connection, value)
+    elif opcode == OPCODE_RESYNC:
+        lobby.pipeline.delta.resync(session.connection)
 
 
-async def process_request(connection: ServerConnection, request: Request):
+async def handler(websocket: ServerConnection):
+    LOG.info("connection added", connection=websocket.id)
+    open_queue(websocket)
+    # the player registered by process_request stays for this connection
+    session = Session(websocket, REGISTRY.get_player(websocket))
+    LIFECYCLE.connect(session.player)
     try:
-        jwt_encoded = request.headers['Bearer']
-        jwt_decoded = jwt.decode(jwt_encoded, JWT_SECRET, algorithms="HS256")
-        # validate jwt
-        required_fields = ["userId", "username", "iat", "exp"]
-        for field in required_fields:
-            if field not in jwt_decoded.keys():
-                raise RuntimeError
-        user_id = jwt_decoded["userId"]
-        username = jwt_decoded["username"]
-        iat = jwt_decoded["iat"]
-        exp = jwt_decoded["exp"]
-        await add_player(Player(user_id, username, iat, exp, connection))
-    except Exception as e:
-        print(
-            "An error occured when processing the request of connection: "
-            f"{connection}: {e}", file=sys.stderr
+        async for message in websocket:
+            try:
+                if isinstance(message, bytes):
+                    RECEIVED_COUNTS['binary'] += 1
+                    process_frame(message, session)
+                    continue
+                RECEIVED_COUNTS['json'] += 1
+                message_content = json.loads(message)
+                validate_message(message_content)
+                message_type = message_content['type']
+                await process_message(
+                    message_type, message_content, session)
+            except ConnectionClosed as e:
+                LOG.info(f"connection closed: {e}", connection=websocket.id)
+                break
+            except ConnectionHandedOff:
+                LOG.info("connection handed off", connection=websocket.id)
+                break
+            except Exception as e:
+                LOG.error(str(e), connection=websocket.id)
+                continue
+    except ConnectionClosed as e:
+        # closed without a normal close code, e.g. 1012 on a restart
+        LOG.info(f"connection closed: {e}", connection=websocket.id)
+    finally:
+        LIFECYCLE.disconnect(websocket)
+
+
+async def add_player(player: Player):
+    old_player = REGISTRY.add_player(player)
+    # remove any old connection from the same player, new connections have
+    # priority
+    if old_player is not None:
+        await old_player.connection.close(
+            reason="You have initiated a new request, you are probably "
+            "logged in on separate browser tabs"
         )
-        if e is KeyError:
-            print(
-                f"Missing Bearer header from connection: {connection}",
-                file=sys.stderr
-            )
-        try:
-            await connection.close()
-        except Exception:
-            pass
 
 
-async def main(ip: str, port: int):
+async def adopt_connection(connection: ServerConnection, player: Player):
+    """
+    Takes over a connection handed off by another shard, see
+    AdoptedConnection for the bytes it already read.
+    """
+    await add_player(player)
+    await handler(connection)
+
+
+async def process_request(
+        connection: ServerConnection, request: Request) -> Response | None:
+    admitted = ADMISSION.admit(
+        connection, request, len(REGISTRY.players_by_conn))
+    if isinstance(admitted, Response):
+        return admitted
+    await add_player(Player(
+        admitted['userId'], admitted['username'], admitted['iat'],
+        admitted['exp'], connection))
+    return None
+
+
+def register_metrics(shard: int):
+    """
+    Values the server already keeps are read when the endpoint is scraped.
+    """
+    METRICS.const_labels = {'shard': str(shard)}
+    lobbies = REGISTRY.lobbies.values
+    METRICS.gauge(
+        'pong_lobbies', 'Lobbies by state', {'state': 'waiting'},
+        lambda: sum(1 for lobby in lobbies()
+                    if not lobby.game_running and not lobby.is_done))
+    METRICS.gauge(
+        'pong_lobbies', 'Lobbies by state', {'state': 'running'},
+        lambda: len(SCHEDULER.lobbies))
+    METRICS.counter(
+        'pong_lobbies_opened_total', 'Lobbies opened', {},
+        lambda: LIFECYCLE.lobbies_opened)
+    METRICS.counter(
+        'pong_lobbies_closed_total', 'Lobbies closed', {},
+        lambda: LIFECYCLE.lobbies_closed)
+    # live object counts, these stay flat while the number of matches does
+    objects = {
+        'registry_lobbies': lambda: len(REGISTRY.lobbies),
+        'registry_players': lambda: len(REGISTRY.players_by_conn),
+        'registry_users': lambda: len(REGISTRY.players_by_user),
+        'registry_lobby_links': lambda: len(REGISTRY.lobby_by_conn),
+        'registry_spectators': lambda: len(REGISTRY.spectating),
+        'waiting_lobbies': lambda: len(LIFECYCLE.waiting),
+        'scheduled_lobbies': lambda: len(SCHEDULER.lobbies),
+        'finished_game_ids': lambda: len(LIFECYCLE.finished),
+        'heartbeat_deadlines': lambda: len(LIFECYCLE.heartbeats),
+        'dropped_players': lambda: len(LIFECYCLE.dropped),
+        'send_queues': lambda: len(SEND_QUEUES),
+        'lobby_connections': lambda: sum(
+            len(lobby.connections) for lobby in lobbies()),
+        'lobby_spectators': lambda: sum(
+            len(lobby.spectators) for lobby in lobbies())
+    }
+    for kind, source in objects.items():
+        METRICS.gauge(
+            'pong_live_objects', 'Objects currently held by the server',
+            {'kind': kind}, source)
+    METRICS.gauge(
+        'pong_players_connected', 'Players with an open connection', {},
+        lambda: len(REGISTRY.players_by_conn))
+    METRICS.counter(
+        'pong_heartbeat_timeouts_total', 'Players whose heartbeat expired',
+        {}, lambda: LIFECYCLE.heartbeats.expired_count)
+    METRICS.counter(
+        'pong_ticks_total', 'Scheduler ticks', {},
+        lambda: SCHEDULER.tick_count)
+    METRICS.counter(
+        'pong_tick_overruns_total', 'Ticks that took longer than TICK', {},
+        lambda: SCHEDULER.overrun_count)
+    METRICS.counter(
+        'pong_ticks_skipped_total', 'Ticks dropped to catch up', {},
+        lambda: SCHEDULER.skipped_ticks)
+    for wire_format in RECEIVED_COUNTS:
+        METRICS.counter(
+            'pong_received_messages_total', 'Decoded inbound messages',
+            {'format': wire_format},
+            lambda wire_format=wire_format: RECEIVED_COUNTS[wire_format])
+    for wire_format in ('json', 'binary', 'delta'):
+        METRICS.counter(
+            'pong_serializations_total', 'Encoded outbound messages',
+            {'format': wire_format},
+            lambda wire_format=wire_format: SERIALIZATION_COUNTS[wire_format])
+    METRICS.gauge(
+        'pong_handshakes_in_flight', 'Accepted connections not upgraded yet',
+        {}, lambda: HandshakeConnection.handshakes)
+    for stat in SEND_STATS:
+        METRICS.counter(
+            f"pong_send_{stat}_total",
+            f"Slow consumer handling: {stat.replace('_', ' ')}", {},
+            lambda stat=stat: SEND_STATS[stat])
+    METRICS.gauge(
+        'pong_spectators', 'Connections spectating a lobby', {},
+        lambda: len(REGISTRY.spectating))
+    for rate, hz in enumerate(SNAPSHOT_RATES_HZ):
+        METRICS.gauge(
+            'pong_connections_by_snapshot_rate',
+            'Connections by the STATE rate they are stepped down to',
+            {'hz': str(hz)},
+            lambda rate=rate: sum(
+                1 for queue in SEND_QUEUES.values() if queue.rate == rate))
+    METRICS.counter(
+        'pong_log_dropped_total', 'Log records dropped by a full queue', {},
+        lambda: WRITER.dropped)
+    METRICS.gauge(
+        'pong_result_uploads_pending', 'Results not uploaded yet', {},
+        lambda: len(UPLOADER.pending))
+
+
+async def main(ip: str, port: int, shard=0):
+    global SHARD
+    SHARD = shard
     loop = asyncio.get_running_loop()
     rand.seed(time())
     stop = loop.create_future()
     loop.add_signal_handler(signal.SIGTERM, stop.set_result, signal.SIGTERM)
     loop.add_signal_handler(signal.SIGINT, stop.set_result, signal.SIGINT)
-    asyncio.create_task(reap_lobbies())
+    serve_kwargs = {'create_connection': HandshakeConnection}
+    if GAME_SHARDS > 1:
+        serve_kwargs = {
+            'reuse_port': True,
+            'create_connection': RecordingConnection,
+            'compression': None
+        }
+        UPLOADER.spool_dir = os.path.join(RESULT_SPOOL_DIR, f"shard-{shard}")
+        LOG_CONTEXT['shard'] = shard
+    scheduler_task = asyncio.create_task(SCHEDULER.run())
+    asyncio.create_task(UPLOADER.run())
+    heartbeat_task = asyncio.create_task(LIFECYCLE.heartbeats.run())
+    asyncio.create_task(FAN_OUT.run())
+    if RESTART_SNAPSHOT:
+        restored = restore_lobbies(LIFECYCLE, shard)
+        if restored:
+            LOG.info(f"restored {restored} matches of the previous process")
+    register_metrics(shard)
+    metrics_server = await serve_metrics(shard)
     async with serve(
-        handler, ip, port, process_request=process_request
+        handler, ip, port, process_request=process_request,
+        select_subprotocol=select_subprotocol,
+        ping_interval=KEEPALIVE_INTERVAL_SEC, **serve_kwargs
     ) as server:
-        print("Game server is running")
+        receiver = None
+        if GAME_SHARDS > 1:
+            receiver = HandoffReceiver(shard, server, adopt_connection)
+            LOG.info(f"Game server shard {shard} is running")
+        else:
+            LOG.info("Game server is running")
         await stop
         signal_print = None
         match stop.result():
@@ -200,11 +413,64 @@ async def main(ip: str, port: int):
                 signal_print = 'SIGINT'
             case signal.SIGTERM:
                 signal_print = 'SIGTERM'
-        print(
-            f"\n{signal_print} received, gracefully exiting server...",
-            file=sys.stderr)
+        LOG.warning(f"{signal_print} received, gracefully exiting server...")
+        if receiver is not None:
+            receiver.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        if stop.result() == signal.SIGTERM and RESTART_SNAPSHOT:
+            await hand_over_matches(server, shard, [
+                scheduler_task, heartbeat_task])
         server.close()
         await server.wait_closed()
 
+
+async def hand_over_matches(
+        server: Server, shard: int, tasks: list[asyncio.Task]):
+    """
+    Freezes every running match and snapshots it for the next process, the
+    players are told to reconnect with 1012.
+    """
+    # neither a tick nor a heartbeat timeout may change a match from here
+    for task in tasks:
+        task.cancel()
+    try:
+        handed_over = write_snapshot(shard, list(SCHEDULER.lobbies))
+        LOG.warning(f"handed {handed_over} matches over to the next process")
+    except OSError as e:
+        LOG.error(f"could not write restart snapshot: {e}")
+        return
+    server.close(close_connections=False)
+    await asyncio.gather(*(
+        connection.close(CLOSE_SERVICE_RESTART, 'Server restarting')
+        for connection in server.connections))
+
+
+def run_shard(shard: int):
+    asyncio.run(main(IP, PORT, shard))
+
+
+def run_sharded():
+    workers = [
+        multiprocessing.Process(target=run_shard, args=(shard,))
+        for shard in range(GAME_SHARDS)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def forward_signal(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+    for worker in workers:
+        worker.join()
+
+
 if __name__ == "__main__":
-    asyncio.run(main(IP, PORT))
+    if GAME_SHARDS > 1:
+        run_sharded()
+    else:
+        asyncio.run(main(IP, PORT))
@@ -0,0 +1,32 @@
+from websockets import ServerConnection
+from frames import SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA
+from gameinstance import GameInstance
+from player import Player
+
+
+class Session:
+    """
+    Everything the handler of one connection needs per message, bound once
+    when the handler starts, so routing a move or a heartbeat costs no
+    registry lookups. The registry stays the index used by everything else.
+    """
+    __slots__ = ('connection', 'player', 'lobby', 'binary')
+    connection: ServerConnection
+    player: Player
+    # lobby the player joined last, a killed lobby is recognized by is_done
+    lobby: GameInstance | None
+    # the client negotiated binary frames and may send them, see frames.py
+    binary: bool
+
+    def __init__(self, connection: ServerConnection, player: Player):
+        self.connection = connection
+        self.player = player
+        self.lobby = None
+        self.binary = connection.subprotocol in (
+            SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA)
+
+    def current_lobby(self) -> GameInstance | None:
+        lobby = self.lobby
+        if lobby is None or lobby.is_done:
+            return None
+        return lobby
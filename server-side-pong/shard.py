@@ -0,0 +1,199 @@
+"""
+Sharded mode: GAME_SHARDS worker processes accept on the same port with
+SO_REUSEPORT, every lobby is owned by shard `db_game_id % GAME_SHARDS`.
+
+The kernel spreads connections over the workers without knowing the game,
+which is only sent in the first START_GAME message. A worker that receives
+START_GAME for a game owned by another shard hands the TCP socket over a
+Unix datagram socket to the owner, together with the player identity, the
+negotiated subprotocol and the raw bytes it already read after the opening
+handshake. The owner adopts the socket in the OPEN state and replays those
+bytes, so it processes START_GAME as if the client connected to it directly.
+Compression is disabled in this mode since its state can not be handed over.
+"""
+import asyncio
+import base64
+import json
+import os
+import socket
+from typing import Awaitable, Callable
+from os import getenv
+from websockets.asyncio.connection import Connection
+from websockets.asyncio.server import Server, ServerConnection
+from websockets.protocol import OPEN, Event
+from websockets.server import ServerProtocol
+from admission import HandshakeConnection
+from player import Player
+from rates import KEEPALIVE_INTERVAL_SEC
+from logger import Logger
+
+GAME_SHARDS = int(getenv('GAME_SHARDS', '1'))
+SHARD_SOCKET_DIR = getenv('SHARD_SOCKET_DIR', '/tmp')
+
+HANDOFF_MAX_BYTES = 65536
+HANDOFF_DRAIN_TRIES = 50
+
+LOG = Logger('shard')
+
+
+class ConnectionHandedOff(Exception):
+    """
+    Raised while processing a message when the connection moved to another
+    shard, its handler on this shard has to stop.
+    """
+
+
+def shard_of(db_game_id: int) -> int:
+    return db_game_id % GAME_SHARDS
+
+
+def shard_socket_path(shard: int) -> str:
+    return os.path.join(SHARD_SOCKET_DIR, f"pong-shard-{shard}.sock")
+
+
+class RecordingConnection(HandshakeConnection):
+    """
+    Keeps a copy of the bytes received after the opening handshake until the
+    owner of the connection is known.
+    """
+    recorded: bytearray | None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recorded = bytearray()
+
+    def data_received(self, data: bytes):
+        if self.recorded is not None and self.protocol.state is OPEN:
+            self.recorded += data
+            if len(self.recorded) > HANDOFF_MAX_BYTES:
+                self.recorded = None
+        super().data_received(data)
+
+    def stop_recording(self):
+        self.recorded = None
+
+
+class AdoptedConnection(ServerConnection):
+    """
+    A connection handed over by another shard, its handshake already
+    happened so it is not registered with the server handshake machinery.
+    The bytes the previous shard read are replayed in `connection_made`,
+    the transport only starts reading after it returned, so they are parsed
+    before anything the client sends later.
+    """
+    prefix: bytes
+
+    def __init__(self, *args, prefix: bytes, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prefix = prefix
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        Connection.connection_made(self, transport)
+        if self.prefix:
+            self.data_received(self.prefix)
+        self.prefix = b''
+
+    def process_event(self, event: Event):
+        Connection.process_event(self, event)
+
+
+async def hand_off(
+        connection: RecordingConnection, player: Player, shard: int) -> bool:
+    """
+    Sends the connection to its owning shard, returns False when it has to
+    stay on this shard.
+    """
+    if getattr(connection, 'recorded', None) is None:
+        return False
+    connection.transport.pause_reading()
+    # a partially written frame would corrupt the stream for the new owner
+    for _ in range(HANDOFF_DRAIN_TRIES):
+        if connection.transport.get_write_buffer_size() == 0:
+            break
+        await asyncio.sleep(0.01)
+    else:
+        connection.transport.resume_reading()
+        return False
+    header = json.dumps({
+        'user_id': player.user_id,
+        'username': player.username,
+        'iat': player.iat,
+        'exp': player.exp,
+        'subprotocol': connection.subprotocol,
+        'prefix': base64.b64encode(bytes(connection.recorded)).decode()
+    }).encode()
+    sock = connection.transport.get_extra_info('socket')
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as handoff:
+            # send_fds ignores its address argument, so connect first
+            handoff.connect(shard_socket_path(shard))
+            socket.send_fds(handoff, [header], [sock.fileno()])
+    except OSError as e:
+        LOG.error(f"handoff to shard {shard} failed: {e}",
+                  user=player.user_id)
+        connection.transport.resume_reading()
+        return False
+    connection.stop_recording()
+    # the owner holds its own reference to the socket, closing ours only
+    # releases this process' file descriptor
+    connection.transport.abort()
+    return True
+
+
+class HandoffReceiver:
+    shard: int
+    server: Server
+    on_adopt: Callable[[ServerConnection, Player], Awaitable[None]]
+    sock: socket.socket
+
+    def __init__(
+            self, shard: int, server: Server,
+            on_adopt: Callable[[ServerConnection, Player], Awaitable[None]]):
+        self.shard = shard
+        self.server = server
+        self.on_adopt = on_adopt
+        path = shard_socket_path(shard)
+        if os.path.exists(path):
+            os.remove(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.sock, self.on_readable)
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.sock)
+        self.sock.close()
+        try:
+            os.remove(shard_socket_path(self.shard))
+        except FileNotFoundError:
+            pass
+
+    def on_readable(self):
+        try:
+            data, fds, _, _ = socket.recv_fds(
+                self.sock, HANDOFF_MAX_BYTES * 2, 1)
+        except BlockingIOError:
+            return
+        for fd in fds:
+            asyncio.create_task(self.adopt(fd, json.loads(data)))
+
+    async def adopt(self, fd: int, header: dict):
+        sock = socket.socket(fileno=fd)
+        sock.setblocking(False)
+        protocol = ServerProtocol(state=OPEN)
+        protocol.subprotocol = header['subprotocol']
+        prefix = base64.b64decode(header['prefix'])
+        _, connection = await asyncio.get_running_loop() \
+            .connect_accepted_socket(
+                lambda: AdoptedConnection(
+                    protocol, self.server,
+                    ping_interval=KEEPALIVE_INTERVAL_SEC, prefix=prefix),
+                sock)
+        player = Player(
+            header['user_id'], header['username'], header['iat'],
+            header['exp'], connection)
+        connection.start_keepalive()
+        try:
+            await self.on_adopt(connection, player)
+        finally:
+            await connection.close()
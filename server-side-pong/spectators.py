@@ -0,0 +1,241 @@
+"""
+Read-only viewers of a match.
+
+A spectator sends `{"type": "SPECTATE", "game_id": ..., "hz": ...}` and
+receives the STATE, SCORE and GAME_END messages of that lobby, STATE at
+`hz`, capped by SPECTATOR_HZ. On joining it first gets SPECTATING with the
+ids and score of the match followed by the newest STATE, so it can draw
+before the next snapshot. Spectators of the delta subprotocol receive full
+binary frames, every one of them is a keyframe. A spectator does not have
+to send HEARTBEAT while it watches, see lifecycle.py.
+
+Spectators never join the lobby or its pipeline. The feed of a lobby is a
+tap that only collects the frames published during a tick, the frames are
+written by the fan-out task once the tick is over, SPECTATOR_BATCH
+connections at a time with the event loop free in between. Every write
+reuses the buffer the players were sent, or the one encoding made for all
+spectators. A spectator whose socket backs up skips STATE frames and is
+dropped past SPECTATOR_DROP_BYTES, it is never queued for.
+"""
+import asyncio
+from os import getenv
+from websockets import ServerConnection, broadcast
+from frames import SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA
+from pipeline import Frame
+from rates import SIM_HZ, interval_ticks
+from sendqueue import SEND_DROP_BYTES, SEND_HIGH_WATER
+from metrics import METRICS, SENT_BYTES, SENT_MESSAGES
+from logger import Logger
+
+SPECTATOR_HZ = int(getenv('SPECTATOR_HZ', '20'))
+MAX_SPECTATORS = int(getenv('MAX_SPECTATORS', '5000'))
+# connections written to before the event loop gets to run other tasks
+SPECTATOR_BATCH = 256
+SPECTATOR_HIGH_WATER = SEND_HIGH_WATER
+SPECTATOR_DROP_BYTES = SEND_DROP_BYTES
+# lobby messages that concern spectators, LOBBY_WAIT and ERROR are for the
+# players
+SPECTATOR_MESSAGES = frozenset(('STATE', 'SCORE', 'GAME_END'))
+
+SPECTATORS_JOINED = METRICS.counter(
+    'pong_spectator_joined_total', 'Connections that started spectating')
+SPECTATOR_FRAMES = METRICS.counter(
+    'pong_spectator_frames_total', 'Frames written to spectators')
+SPECTATOR_SKIPPED_STATES = METRICS.counter(
+    'pong_spectator_skipped_states_total',
+    'STATE frames skipped for a backed up spectator')
+SPECTATORS_DROPPED = METRICS.counter(
+    'pong_spectator_dropped_total', 'Spectators dropped for not reading')
+
+LOG = Logger('spectators')
+
+
+def spectator_interval(hz: int | None) -> int:
+    if hz is None or hz <= 0:
+        hz = SPECTATOR_HZ
+    return interval_ticks(min(hz, SPECTATOR_HZ, SIM_HZ))
+
+
+class SpectatorFeed:
+    """
+    Spectators of one lobby, grouped by STATE interval and by whether they
+    take binary frames.
+    """
+    # interval in ticks to binary and text connections
+    groups: dict[int, tuple[list[ServerConnection], list[ServerConnection]]]
+    intervals: dict[ServerConnection, int]
+    # tick of the last STATE each interval group was sent
+    last_state: dict[int, int]
+    # frames of the current tick not written yet
+    pending: list[Frame]
+    latest_state: Frame | None
+    closed: bool
+
+    def __init__(self):
+        self.groups = dict()
+        self.intervals = dict()
+        self.last_state = dict()
+        self.pending = list()
+        self.latest_state = None
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self.intervals)
+
+    def add(self, connection: ServerConnection, interval: int):
+        self.remove(connection)
+        binary, text = self.groups.setdefault(interval, (list(), list()))
+        if connection.subprotocol in (SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA):
+            binary.append(connection)
+        else:
+            text.append(connection)
+        self.intervals[connection] = interval
+        SPECTATORS_JOINED.inc()
+        if self.latest_state is not None:
+            write([connection], self.latest_state)
+
+    def remove(self, connection: ServerConnection):
+        interval = self.intervals.pop(connection, None)
+        if interval is None:
+            return
+        for connections in self.groups[interval]:
+            if connection in connections:
+                connections.remove(connection)
+        if not any(self.groups[interval]):
+            del self.groups[interval]
+            self.last_state.pop(interval, None)
+
+    def __call__(self, frame: Frame):
+        """
+        Pipeline tap, called for every frame the lobby publishes.
+        """
+        message_type = frame.message['type']
+        if message_type == 'STATE':
+            self.latest_state = frame
+        elif message_type not in SPECTATOR_MESSAGES:
+            return
+        if not self.intervals:
+            return
+        if not self.pending:
+            FAN_OUT.schedule(self)
+        self.pending.append(frame)
+
+    def close(self):
+        """
+        Called when the lobby is killed, frames still pending, GAME_END
+        among them, are written before the spectators are released.
+        """
+        self.closed = True
+        self.latest_state = None
+        if not self.pending:
+            self.release()
+
+    def release(self):
+        self.groups.clear()
+        self.intervals.clear()
+
+    async def flush(self):
+        frames = self.pending
+        self.pending = list()
+        newest_state = None
+        for frame in frames:
+            if frame.message['type'] == 'STATE':
+                newest_state = frame
+        for frame in frames:
+            if frame.message['type'] != 'STATE':
+                targets = self.connections()
+            elif frame is newest_state:
+                targets = self.due(frame.message['tick'])
+            else:
+                continue
+            for i in range(0, len(targets), SPECTATOR_BATCH):
+                write(targets[i:i + SPECTATOR_BATCH], frame)
+                await asyncio.sleep(0)
+        if self.closed:
+            self.release()
+
+    def connections(self) -> list[ServerConnection]:
+        return list(self.intervals)
+
+    def due(self, tick: int) -> list[ServerConnection]:
+        due = []
+        for interval, (binary, text) in self.groups.items():
+            if tick - self.last_state.get(interval, -interval) < interval:
+                continue
+            self.last_state[interval] = tick
+            due.extend(binary)
+            due.extend(text)
+        return due
+
+
+def write(connections: list[ServerConnection], frame: Frame):
+    """
+    Writes `frame` to spectators of any format, skipping STATE frames for
+    backed up sockets and dropping the ones that stopped reading.
+    """
+    is_state = frame.message['type'] == 'STATE'
+    binary = []
+    text = []
+    for connection in connections:
+        buffered = connection.transport.get_write_buffer_size()
+        if buffered > SPECTATOR_DROP_BYTES:
+            SPECTATORS_DROPPED.inc()
+            LOG.warning("dropping slow spectator",
+                        connection=connection.id)
+            connection.transport.abort()
+        elif is_state and buffered > SPECTATOR_HIGH_WATER:
+            SPECTATOR_SKIPPED_STATES.inc()
+        elif connection.subprotocol in (
+                SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA):
+            binary.append(connection)
+        else:
+            text.append(connection)
+    if binary:
+        data = frame.as_binary()
+        if data is None:
+            text.extend(binary)
+        else:
+            broadcast(binary, data)
+            count(len(binary), len(data))
+    if text:
+        data = frame.as_text()
+        broadcast(text, data)
+        count(len(text), len(data))
+
+
+def count(connections: int, size: int):
+    SPECTATOR_FRAMES.inc(connections)
+    SENT_MESSAGES.inc(connections)
+    SENT_BYTES.inc(size * connections)
+
+
+class SpectatorFanOut:
+    """
+    Writes the pending frames of every feed after the tick that published
+    them, outside of the scheduler step.
+    """
+    feeds: list[SpectatorFeed]
+    wake: asyncio.Event
+
+    def __init__(self):
+        self.feeds = list()
+        self.wake = asyncio.Event()
+
+    def schedule(self, feed: SpectatorFeed):
+        self.feeds.append(feed)
+        self.wake.set()
+
+    async def run(self):
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            feeds = self.feeds
+            self.feeds = list()
+            for feed in feeds:
+                try:
+                    await feed.flush()
+                except Exception as e:
+                    LOG.error(f"spectator fan-out failed: {e}")
+
+
+FAN_OUT = SpectatorFanOut()
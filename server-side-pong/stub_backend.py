@@ -0,0 +1,57 @@
+"""
+Minimal stand-in for the backend game result endpoint, used to run the game
+server locally without the full stack:
+
+    python stub_backend.py [port] [failure_rate]
+
+then start the game server with BACKEND_HOST=localhost and BACKEND_PORT set to
+the same port. A failure rate between 0 and 1 answers that share of requests
+with a 503 to exercise the retry and spool path of the result uploader.
+"""
+import json
+import random as rand
+import re
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FINISH_PATH = re.compile(r'^/api/games/(\d+)/finish$')
+
+
+class StubBackendHandler(BaseHTTPRequestHandler):
+    failure_rate = 0.0
+    finished: dict[int, dict] = {}
+
+    def do_PUT(self):
+        match = FINISH_PATH.match(self.path)
+        if match is None:
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if rand.random() < self.failure_rate:
+            self.send_error(503)
+            return
+        db_game_id = int(match.group(1))
+        self.finished[db_game_id] = json.loads(body)
+        print(f"game {db_game_id} finished: {self.finished[db_game_id]}")
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stub(port: int, failure_rate=0.0) -> ThreadingHTTPServer:
+    StubBackendHandler.failure_rate = failure_rate
+    return ThreadingHTTPServer(('127.0.0.1', port), StubBackendHandler)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    failure_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    server = serve_stub(port, failure_rate)
+    print(f"Stub backend listening on 127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,15 @@
+"""
+Run from server-side-pong with `python -m pytest tests`. The server modules
+are imported flat like server.py does, and the settings it refuses to start
+without get harmless values since no test talks to the backend.
+"""
+import os
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+os.environ.setdefault('HTTP_PASSWD', 'test')
+os.environ.setdefault('BACKEND_PORT', '0')
+os.environ.setdefault('LOG_LEVEL', 'warning')
+os.environ['RECORD_MATCHES'] = '0'
+os.environ.setdefault('JWT_SECRET', 'test-secret-long-enough-for-hs256!')
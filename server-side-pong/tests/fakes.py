@@ -0,0 +1,63 @@
+"""
+Stand-ins for websockets connections that keep what the server sent them.
+"""
+import json
+from itertools import count
+from websockets.protocol import CLOSED, OPEN
+
+CONNECTION_IDS = count(1)
+
+
+class FakeProtocol:
+    def __init__(self):
+        self.state = OPEN
+        self.sent = []
+
+    def send_text(self, data: bytes):
+        self.sent.append(data.decode())
+
+    def send_binary(self, data: bytes):
+        self.sent.append(bytes(data))
+
+
+class FakeTransport:
+    def __init__(self):
+        # bytes the socket has not accepted yet
+        self.buffered = 0
+        self.aborted = False
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffered
+
+    def abort(self):
+        self.aborted = True
+
+
+class FakeConnection:
+    fragmented_send_waiter = None
+    remote_address = ('test', 0)
+
+    def __init__(self, subprotocol: str | None = None, latency=0.0):
+        self.id = next(CONNECTION_IDS)
+        self.subprotocol = subprotocol
+        self.latency = latency
+        self.protocol = FakeProtocol()
+        self.transport = FakeTransport()
+        self.close_reason = None
+
+    def send_data(self):
+        pass
+
+    async def send(self, data):
+        self.protocol.sent.append(data)
+
+    async def close(self, code=1000, reason=''):
+        self.protocol.state = CLOSED
+        self.close_reason = reason
+
+    def messages(self) -> list[dict]:
+        return [json.loads(data) for data in self.protocol.sent
+                if isinstance(data, str)]
+
+    def types(self) -> list[str]:
+        return [message['type'] for message in self.messages()]
@@ -0,0 +1,68 @@
+from time import time
+import jwt
+from admission import TOKEN_CACHE_HITS, Admission, RateLimiter, TokenBucket
+
+SECRET = 'test-secret-long-enough-for-hs256!'
+
+
+def token(**claims) -> str:
+    now = int(time())
+    claims = {
+        'userId': 1, 'username': 'alice', 'iat': now, 'exp': now + 60,
+    } | claims
+    return jwt.encode(claims, SECRET, algorithm='HS256')
+
+
+def test_bucket_allows_a_burst_then_refills():
+    bucket = TokenBucket(3, 0.0)
+    assert [bucket.take(2, 3, 0.0) for _ in range(4)] == \
+        [True, True, True, False]
+    assert bucket.take(2, 3, 0.5)
+    assert not bucket.take(2, 3, 0.5)
+    # never refills above the burst
+    assert [bucket.take(2, 3, 100.0) for _ in range(4)] == \
+        [True, True, True, False]
+
+
+def test_limiter_keeps_keys_apart_and_prunes_full_buckets():
+    limiter = RateLimiter(1, 2)
+    assert limiter.allow('a', 0.0) and limiter.allow('a', 0.0)
+    assert not limiter.allow('a', 0.0)
+    assert limiter.allow('b', 0.0)
+    limiter.prune(1.0)
+    assert set(limiter.buckets) == {'a', 'b'}
+    limiter.prune(2.0)
+    assert limiter.buckets == {}
+
+
+def test_verify_caches_valid_tokens():
+    admission = Admission(SECRET)
+    encoded = token()
+    claims = admission.verify(encoded)
+    assert claims['username'] == 'alice'
+    hits = TOKEN_CACHE_HITS.value
+    assert admission.verify(encoded) is claims
+    assert TOKEN_CACHE_HITS.value == hits + 1
+
+
+def test_verify_refuses_bad_tokens():
+    admission = Admission(SECRET)
+    assert admission.verify('not a token') is None
+    assert admission.verify(token(exp=int(time()) - 1)) is None
+    forged = jwt.encode(
+        {'userId': 1, 'username': 'alice', 'iat': 0,
+         'exp': int(time()) + 60}, SECRET[::-1], algorithm='HS256')
+    assert admission.verify(forged) is None
+    missing = jwt.encode(
+        {'userId': 1, 'exp': int(time()) + 60}, SECRET, algorithm='HS256')
+    assert admission.verify(missing) is None
+    assert admission.tokens == {}
+
+
+def test_expired_cache_entries_are_pruned():
+    admission = Admission(SECRET)
+    admission.tokens['stale'] = {'exp': time() - 1}
+    admission.verify(token())
+    admission.prune_tokens()
+    assert 'stale' not in admission.tokens
+    assert len(admission.tokens) == 1
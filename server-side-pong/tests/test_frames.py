@@ -0,0 +1,163 @@
+import struct
+import pytest
+from frames import (
+    DELTA_HEADER, FRAME_VERSION, GAME_END_FRAME, HISTORY_TICKS, INT16_MAX,
+    INT16_MIN, KEYFRAME_INTERVAL_TICKS, OPCODE_ACK, OPCODE_HEARTBEAT,
+    OPCODE_MOVE_DOWN, OPCODE_MOVE_UP, OPCODE_RESYNC, SCORE_FRAME,
+    STATE_FRAME, DeltaEncoder, decode_frame, decode_input, dequantize,
+    encode_delta, encode_frame, encode_input, quantize, state_fields
+)
+
+
+def state(tick=7, ball=(400.0625, 299.5), p1_y=12.25, p2_y=500.0,
+          p1_last_ts=1700000000123, p2_last_ts=None) -> dict:
+    return {
+        'type': 'STATE',
+        'tick': tick,
+        'ball': {'x': ball[0], 'y': ball[1]},
+        'p1': {'x': 0, 'y': p1_y, 'last_ts': p1_last_ts},
+        'p2': {'x': 790, 'y': p2_y, 'last_ts': p2_last_ts}
+    }
+
+
+def test_state_round_trip():
+    message = state()
+    frame = encode_frame(message)
+    assert len(frame) == STATE_FRAME.size
+    assert decode_frame(frame) == message
+
+
+def test_state_positions_are_quantized():
+    decoded = decode_frame(encode_frame(state(ball=(100.01, 0.97))))
+    assert decoded['ball'] == {'x': 100.0, 'y': 1.0}
+
+
+def test_state_positions_saturate():
+    decoded = decode_frame(encode_frame(state(ball=(1e9, -1e9))))
+    assert decoded['ball']['x'] == dequantize(INT16_MAX)
+    assert decoded['ball']['y'] == dequantize(INT16_MIN)
+    assert quantize(1e9) == INT16_MAX
+
+
+def test_score_round_trip():
+    for scored_by in ('p1', 'p2'):
+        message = {'type': 'SCORE', 'tick': 123456, 'scored_by': scored_by}
+        frame = encode_frame(message)
+        assert len(frame) == SCORE_FRAME.size
+        assert decode_frame(frame) == message
+
+
+def test_game_end_round_trip():
+    message = {
+        'type': 'GAME_END', 'tick': 4000, 'winner_id': 42,
+        'score_player1': 5, 'score_player2': 3
+    }
+    frame = encode_frame(message)
+    assert len(frame) == GAME_END_FRAME.size
+    assert decode_frame(frame) == message
+
+
+def test_text_only_messages_have_no_frame():
+    assert encode_frame({'type': 'LOBBY_WAIT'}) is None
+
+
+def test_unknown_version_is_refused():
+    frame = bytearray(encode_frame(state()))
+    frame[0] = FRAME_VERSION + 1
+    with pytest.raises(RuntimeError):
+        decode_frame(bytes(frame))
+
+
+def test_delta_round_trip():
+    baseline = state(tick=10)
+    current = state(tick=12, ball=(410.5, 290.25), p1_last_ts=1700000000200)
+    baselines = dict()
+    decode_frame(encode_frame(baseline), baselines)
+    frame = encode_delta(
+        12, state_fields(current), 10, state_fields(baseline))
+    # ball x, ball y and p1 last_ts changed
+    assert len(frame) == DELTA_HEADER.size + 2 + 2 + 8
+    assert decode_frame(frame, baselines) == current
+    assert 12 in baselines
+
+
+def test_unchanged_delta_is_a_header():
+    fields = state_fields(state())
+    frame = encode_delta(8, fields, 7, fields)
+    assert len(frame) == DELTA_HEADER.size
+    assert decode_frame(frame, {7: fields}) == state(tick=8)
+
+
+def test_delta_without_baseline_is_refused():
+    fields = state_fields(state())
+    with pytest.raises(RuntimeError):
+        decode_frame(encode_delta(8, fields, 7, fields), {})
+
+
+def test_first_frame_and_keyframe_interval():
+    encoder = DeltaEncoder()
+    connection = object()
+    encoder.record(0, state_fields(state(tick=0)))
+    assert encoder.group([connection], 0) == {-1: [connection]}
+    encoder.ack(connection, 0)
+    encoder.record(1, state_fields(state(tick=1)))
+    assert encoder.group([connection], 1) == {0: [connection]}
+    tick = KEYFRAME_INTERVAL_TICKS
+    for recorded in range(2, tick + 1):
+        encoder.record(recorded, state_fields(state(tick=recorded)))
+    encoder.ack(connection, tick - 1)
+    assert encoder.baseline_for(connection, tick - 1) == tick - 1
+    assert encoder.baseline_for(connection, tick) == -1
+
+
+def test_ack_of_unknown_or_older_tick_is_ignored():
+    encoder = DeltaEncoder()
+    connection = object()
+    encoder.record(5, state_fields(state(tick=5)))
+    encoder.record(6, state_fields(state(tick=6)))
+    encoder.ack(connection, 4)
+    assert connection not in encoder.acked
+    encoder.ack(connection, 6)
+    encoder.ack(connection, 5)
+    assert encoder.acked[connection] == 6
+
+
+def test_resync_sends_a_keyframe():
+    encoder = DeltaEncoder()
+    connection = object()
+    encoder.record(0, state_fields(state(tick=0)))
+    encoder.group([connection], 0)
+    encoder.ack(connection, 0)
+    encoder.resync(connection)
+    assert encoder.baseline_for(connection, 1) == -1
+
+
+def test_history_is_pruned_by_age():
+    encoder = DeltaEncoder()
+    for tick in range(0, HISTORY_TICKS * 2, 3):
+        encoder.record(tick, state_fields(state(tick=tick)))
+    newest = max(encoder.history)
+    assert min(encoder.history) > newest - HISTORY_TICKS
+
+
+@pytest.mark.parametrize('opcode, value', [
+    (OPCODE_MOVE_UP, 1700000000123),
+    (OPCODE_MOVE_DOWN, 1700000000456),
+    (OPCODE_HEARTBEAT, 1700000000789),
+    (OPCODE_ACK, 4294967295),
+    (OPCODE_RESYNC, 0)
+])
+def test_input_round_trip(opcode, value):
+    assert decode_input(encode_input(opcode, value)) == (opcode, value)
+
+
+@pytest.mark.parametrize('frame', [
+    b'',
+    bytes([FRAME_VERSION]),
+    bytes([FRAME_VERSION + 1, OPCODE_RESYNC]),
+    bytes([FRAME_VERSION, 99]),
+    bytes([FRAME_VERSION, OPCODE_MOVE_UP, 1, 2])
+])
+def test_malformed_input_is_refused(frame):
+    with pytest.raises((RuntimeError, struct.error)):
+        decode_input(frame)
@@ -0,0 +1,70 @@
+import pytest
+import heartbeat
+from heartbeat import HeartbeatWheel
+
+TIMEOUT_MS = 1000
+SLOT_MS = 100
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [10_000]
+    monkeypatch.setattr(heartbeat, 'now_ms', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def wheel(clock):
+    expired = []
+    wheel = HeartbeatWheel(expired.append, TIMEOUT_MS, SLOT_MS)
+    wheel.expired = expired
+    return wheel
+
+
+def test_silent_player_expires_within_a_slot(clock, wheel):
+    player = object()
+    wheel.arm(player)
+    wheel.expire(clock[0] + TIMEOUT_MS - 1)
+    assert wheel.expired == []
+    wheel.expire(clock[0] + TIMEOUT_MS + SLOT_MS)
+    assert wheel.expired == [player]
+    assert player not in wheel
+    assert wheel.expired_count == 1
+
+
+def test_reset_moves_the_deadline(clock, wheel):
+    player = object()
+    wheel.arm(player)
+    clock[0] += TIMEOUT_MS // 2
+    wheel.reset(player)
+    wheel.expire(clock[0] + TIMEOUT_MS // 2 + SLOT_MS)
+    assert wheel.expired == []
+    assert player in wheel
+    wheel.expire(clock[0] + TIMEOUT_MS + SLOT_MS)
+    assert wheel.expired == [player]
+
+
+def test_disarmed_player_never_expires(clock, wheel):
+    player = object()
+    wheel.arm(player)
+    wheel.disarm(player)
+    wheel.disarm(player)
+    wheel.expire(clock[0] + 3 * TIMEOUT_MS)
+    assert wheel.expired == []
+    assert len(wheel) == 0
+
+
+def test_callback_may_disarm_another_player(clock):
+    first, second = object(), object()
+    expired = []
+
+    def on_expired(player):
+        expired.append(player)
+        wheel.disarm(second if player is first else first)
+
+    wheel = HeartbeatWheel(on_expired, TIMEOUT_MS, SLOT_MS)
+    wheel.arm(first)
+    wheel.arm(second)
+    wheel.expire(clock[0] + TIMEOUT_MS + SLOT_MS)
+    assert len(expired) == 1
+    assert len(wheel) == 0
@@ -0,0 +1,49 @@
+from input_buffer import (
+    INPUT_BUDGET_PER_TICK, INPUT_BUFFER_SIZE, MOVE_DOWN, MOVE_UP, InputBuffer
+)
+
+
+def test_drain_in_arrival_order_within_budget():
+    buffer = InputBuffer()
+    moves = [MOVE_UP, MOVE_UP, MOVE_DOWN, MOVE_UP, MOVE_DOWN, MOVE_DOWN]
+    for i, direction in enumerate(moves):
+        buffer.push(direction, 1000 + i, 50 + i)
+    steps, timestamp, tick = buffer.drain()
+    assert steps == sum(moves[:INPUT_BUDGET_PER_TICK])
+    assert timestamp == 1000 + INPUT_BUDGET_PER_TICK - 1
+    assert tick == 50
+    assert len(buffer) == len(moves) - INPUT_BUDGET_PER_TICK
+    steps, timestamp, tick = buffer.drain()
+    assert steps == sum(moves[INPUT_BUDGET_PER_TICK:])
+    assert timestamp == 1000 + len(moves) - 1
+    assert tick == 50 + INPUT_BUDGET_PER_TICK
+    assert len(buffer) == 0
+
+
+def test_empty_drain_moves_nothing():
+    steps, timestamp, _ = InputBuffer().drain()
+    assert (steps, timestamp) == (0, 0)
+
+
+def test_full_buffer_overwrites_the_oldest_moves():
+    buffer = InputBuffer()
+    total = INPUT_BUFFER_SIZE + 3
+    for i in range(total):
+        buffer.push(MOVE_DOWN, i, i)
+    assert len(buffer) == INPUT_BUFFER_SIZE
+    assert buffer.overwritten == 3
+    pending = buffer.pending()
+    assert [timestamp for _, timestamp, _ in pending] == \
+        list(range(3, total))
+    _, _, tick = buffer.drain()
+    assert tick == 3
+
+
+def test_pending_does_not_consume():
+    buffer = InputBuffer()
+    buffer.push(MOVE_UP, 1, 2)
+    buffer.push(MOVE_DOWN, 3, 4)
+    assert buffer.pending() == [(MOVE_UP, 1, 2), (MOVE_DOWN, 3, 4)]
+    assert len(buffer) == 2
+    buffer.clear()
+    assert buffer.pending() == []
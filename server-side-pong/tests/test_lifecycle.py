@@ -0,0 +1,124 @@
+import asyncio
+import pytest
+import heartbeat
+from gameinstance import TICK
+from lifecycle import Lifecycle
+from player import Player
+from registry import Registry
+from scheduler import TickScheduler
+from session import Session
+from fakes import FakeConnection
+
+
+@pytest.fixture
+def lifecycle() -> Lifecycle:
+    return Lifecycle(Registry(), TickScheduler(TICK))
+
+
+def connect(lifecycle: Lifecycle, user_id: int) -> Player:
+    player = Player(user_id, f"p{user_id}", 0, 0, FakeConnection())
+    lifecycle.registry.add_player(player)
+    lifecycle.connect(player)
+    return player
+
+
+async def expire_all(lifecycle: Lifecycle):
+    lifecycle.heartbeats.expire(
+        heartbeat.now_ms() + 2 * lifecycle.heartbeats.timeout_ms)
+    await asyncio.sleep(0)
+
+
+def test_spectators_need_no_heartbeat(lifecycle):
+    async def run():
+        lobby = lifecycle.open_lobby(1, 10, 11)
+        spectator = connect(lifecycle, 20)
+        silent = connect(lifecycle, 21)
+        lifecycle.spectate(spectator.connection, lobby, None)
+        assert spectator not in lifecycle.heartbeats
+        await expire_all(lifecycle)
+        assert spectator.connection.close_reason is None
+        assert silent.connection.close_reason == 'Heartbeat timed out'
+        lobby.kill()
+    asyncio.run(run())
+
+
+def test_heartbeat_is_armed_again_after_spectating(lifecycle):
+    async def run():
+        lobby = lifecycle.open_lobby(1, 10, 11)
+        player = connect(lifecycle, 20)
+        lifecycle.spectate(player.connection, lobby, None)
+        lifecycle.stop_spectating(player.connection)
+        assert player in lifecycle.heartbeats
+        await expire_all(lifecycle)
+        assert player.connection.close_reason == 'Heartbeat timed out'
+        lobby.kill()
+    asyncio.run(run())
+
+
+@pytest.fixture(scope='module')
+def server_metrics():
+    import server
+    server.register_metrics(0)
+    return server
+
+
+def live_objects() -> dict[str, float]:
+    from metrics import METRICS
+    counts = dict()
+    for line in METRICS.render().splitlines():
+        if line.startswith('pong_live_objects{'):
+            labels, value = line.split(' ')
+            kind = labels.split('kind="')[1].split('"')[0]
+            counts[kind] = float(value)
+    return counts
+
+
+async def play_match(server, game_id: int) -> dict[str, float]:
+    players = []
+    for user_id in (1, 2):
+        connection = FakeConnection()
+        player = Player(user_id, f"p{user_id}", 0, 0, connection)
+        server.REGISTRY.add_player(player)
+        server.open_queue(connection)
+        server.LIFECYCLE.connect(player)
+        await server.process_message('START_GAME', {
+            'type': 'START_GAME', 'game_id': game_id,
+            'player1_id': 1, 'player2_id': 2
+        }, Session(connection, player))
+        players.append(player)
+    await asyncio.sleep(0)
+    lobby = server.REGISTRY.get_lobby(game_id)
+    assert lobby.game_running
+    during = live_objects()
+    lobby.forfeit(was_p1=False)
+    await server.SCHEDULER.step()
+    assert lobby.is_done
+    for player in players:
+        assert 'GAME_END' in player.connection.types()
+        server.LIFECYCLE.disconnect(player.connection)
+    return during
+
+
+def test_live_objects_return_to_their_level_after_a_match(server_metrics):
+    server = server_metrics
+    game_id = 9001
+    before = live_objects()
+    during = asyncio.run(play_match(server, game_id))
+    after = live_objects()
+    try:
+        for kind, added in (('registry_lobbies', 1),
+                            ('scheduled_lobbies', 1),
+                            ('registry_players', 2),
+                            ('registry_users', 2),
+                            ('registry_lobby_links', 2),
+                            ('heartbeat_deadlines', 2),
+                            ('send_queues', 2),
+                            ('lobby_connections', 2)):
+            assert during[kind] == before[kind] + added, kind
+        assert after == before | {
+            'finished_game_ids': before['finished_game_ids'] + 1}
+    finally:
+        server.LIFECYCLE.finished.pop(game_id, None)
+        server.UPLOADER.pending.discard(game_id)
+        while not server.UPLOADER.queue.empty():
+            server.UPLOADER.queue.get_nowait()
@@ -0,0 +1,111 @@
+import asyncio
+import random
+import pytest
+from gameinstance import (
+    ARENA_HEIGHT, ARENA_WIDTH, REWIND_TICKS, TICK, GameInstance
+)
+from input_buffer import MOVE_DOWN, MOVE_UP
+from lib import Vector2
+
+np = pytest.importorskip('numpy')
+from batch_physics import BatchPhysics  # noqa: E402
+from scheduler import TickScheduler  # noqa: E402
+
+LOBBIES = 32
+TICKS = 3000
+
+
+def seeded_serves(seed: int):
+    rng = random.Random(seed)
+
+    def next_serve() -> Vector2:
+        return Vector2(rng.choice((-1, 1)), rng.choice((-1, 1)))
+    return next_serve
+
+
+def lobby(seed: int) -> GameInstance:
+    game = GameInstance(seed + 1, 1, 2)
+    game.next_serve = seeded_serves(seed)
+    game.ball.set_start(ARENA_HEIGHT, ARENA_WIDTH, game.next_serve())
+    game.game_running = True
+    return game
+
+
+def feed_inputs(rng: random.Random, pairs: list[tuple]):
+    """
+    The same moves for both copies of a lobby, some of them issued in the
+    past so that they are rewound.
+    """
+    for scalar, batch in pairs:
+        for side in ('p1_input', 'p2_input'):
+            if rng.random() < 0.5:
+                continue
+            direction = rng.choice((MOVE_UP, MOVE_DOWN))
+            issued = scalar.tick_count - rng.randint(0, REWIND_TICKS)
+            for game in (scalar, batch):
+                getattr(game, side).push(
+                    direction, scalar.tick_count, issued)
+
+
+def positions(game: GameInstance) -> tuple:
+    return (
+        game.tick_count, game.game_running, game.p1_score, game.p2_score,
+        game.ball.shape.x, game.ball.shape.y,
+        game.ball.dir_vect.x, game.ball.dir_vect.y,
+        game.p1_paddle.shape.y, game.p2_paddle.shape.y,
+        game.p1_last_ts, game.p2_last_ts
+    )
+
+
+async def play(seed: int):
+    rng = random.Random(seed)
+    pairs = [(lobby(i), lobby(i)) for i in range(LOBBIES)]
+    engine = BatchPhysics(capacity=4)
+    for _ in range(TICKS):
+        pairs = [
+            pair for pair in pairs
+            if pair[0].game_running or pair[1].game_running
+        ]
+        if not pairs:
+            break
+        feed_inputs(rng, pairs)
+        for scalar, _ in pairs:
+            await scalar.tick()
+        await engine.step([batch for _, batch in pairs])
+        for scalar, batch in pairs:
+            assert positions(batch) == positions(scalar)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_batch_engine_matches_scalar_ticks(seed):
+    asyncio.run(play(seed))
+
+
+class BrokenInput:
+    def __len__(self) -> int:
+        return 1
+
+    def drain(self):
+        raise RuntimeError('broken input')
+
+
+async def step_with_broken_lobby() -> tuple[GameInstance, list[tuple]]:
+    pairs = [(lobby(i), lobby(i)) for i in range(4)]
+    broken = pairs[1][1]
+    broken.p1_input = BrokenInput()
+    scheduler = TickScheduler(TICK, engine=BatchPhysics())
+    for _, batch in pairs:
+        scheduler.add(batch)
+    for _ in range(3):
+        for scalar, _ in pairs:
+            await scalar.tick()
+        await scheduler.step()
+    assert broken not in scheduler.lobbies
+    return broken, [pair for pair in pairs if pair[1] is not broken]
+
+
+def test_failing_lobby_is_killed_alone():
+    broken, pairs = asyncio.run(step_with_broken_lobby())
+    assert broken.is_done and not broken.game_running
+    for scalar, batch in pairs:
+        assert positions(batch) == positions(scalar)
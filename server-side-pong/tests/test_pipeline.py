@@ -0,0 +1,88 @@
+import json
+from frames import SUBPROTOCOL_BINARY, SUBPROTOCOL_DELTA, decode_frame
+from gameinstance import GameInstance, get_game_state
+from pipeline import SERIALIZATION_COUNTS, FramePipeline
+from fakes import FakeConnection
+
+
+def subscribed(pipeline: FramePipeline, subprotocol: str | None,
+               n: int) -> list[FakeConnection]:
+    connections = [FakeConnection(subprotocol) for _ in range(n)]
+    for connection in connections:
+        pipeline.subscribe(connection)
+    return connections
+
+
+def state(tick: int) -> dict:
+    lobby = GameInstance(1, 1, 2)
+    lobby.tick_count = tick
+    lobby.ball.shape.x += tick
+    return get_game_state(lobby)
+
+
+def counts() -> dict[str, int]:
+    return dict(SERIALIZATION_COUNTS)
+
+
+def encoded_since(before: dict[str, int]) -> dict[str, int]:
+    return {key: SERIALIZATION_COUNTS[key] - before[key] for key in before}
+
+
+def test_each_format_is_encoded_once_per_message():
+    pipeline = FramePipeline()
+    text = subscribed(pipeline, None, 5)
+    binary = subscribed(pipeline, SUBPROTOCOL_BINARY, 5)
+    delta = subscribed(pipeline, SUBPROTOCOL_DELTA, 5)
+    tapped = []
+    pipeline.add_tap(tapped.append)
+    before = counts()
+    frame = pipeline.publish(state(10))
+    assert encoded_since(before) == {
+        'published': 1, 'json': 1, 'binary': 1, 'delta': 0}
+    assert tapped == [frame]
+    assert all(c.protocol.sent == [frame.as_text()] for c in text)
+    # without an acknowledged baseline every delta subscriber gets the
+    # keyframe the binary subscribers share
+    for connection in binary + delta:
+        assert connection.protocol.sent == [frame.as_binary()]
+    assert decode_frame(frame.as_binary())['tick'] == 10
+
+
+def test_delta_subscribers_share_one_delta_per_baseline():
+    pipeline = FramePipeline()
+    delta = subscribed(pipeline, SUBPROTOCOL_DELTA, 6)
+    pipeline.publish(state(10))
+    pipeline.publish(state(11))
+    for connection in delta[:3]:
+        pipeline.delta.ack(connection, 10)
+    for connection in delta[3:]:
+        pipeline.delta.ack(connection, 11)
+    before = counts()
+    frame = pipeline.publish(state(12))
+    assert encoded_since(before) == {
+        'published': 1, 'json': 0, 'binary': 0, 'delta': 2}
+    assert len({c.protocol.sent[-1] for c in delta}) == 2
+    assert {c.protocol.sent[-1] for c in delta[:3]} == \
+        {frame.as_delta(pipeline.delta, 10)}
+
+
+def test_messages_without_binary_layout_go_out_as_text():
+    pipeline = FramePipeline()
+    text = subscribed(pipeline, None, 1)
+    binary = subscribed(pipeline, SUBPROTOCOL_BINARY, 1)
+    pipeline.publish({'type': 'LOBBY_WAIT'})
+    for connection in text + binary:
+        assert [json.loads(data) for data in connection.protocol.sent] == \
+            [{'type': 'LOBBY_WAIT'}]
+
+
+def test_unsubscribed_and_closed_pipelines_send_nothing():
+    pipeline = FramePipeline()
+    first, second = subscribed(pipeline, None, 2)
+    pipeline.unsubscribe(first)
+    pipeline.publish(state(1))
+    assert first.protocol.sent == []
+    assert len(second.protocol.sent) == 1
+    pipeline.close()
+    pipeline.publish(state(2))
+    assert len(second.protocol.sent) == 1
@@ -0,0 +1,62 @@
+from gameinstance import GameInstance
+from player import Player
+from registry import Registry
+from fakes import FakeConnection
+
+
+def player(user_id: int) -> Player:
+    return Player(user_id, f"p{user_id}", 0, 0, FakeConnection())
+
+
+def test_players_are_found_by_connection_and_user():
+    registry = Registry()
+    first = player(1)
+    assert registry.add_player(first) is None
+    assert registry.get_player(first.connection) is first
+    # a second connection of the same user replaces the first
+    second = player(1)
+    assert registry.add_player(second) is first
+    assert registry.players_by_user[1] is second
+    # removing the replaced connection keeps the newer one
+    registry.remove_player(first.connection)
+    assert registry.get_player(first.connection) is None
+    assert registry.players_by_user[1] is second
+    registry.remove_player(second.connection)
+    assert registry.players_by_user == {}
+    registry.remove_player(second.connection)
+
+
+def test_lobbies_are_found_by_id_and_connection():
+    registry = Registry()
+    lobby = GameInstance(7, 1, 2)
+    registry.add_lobby(lobby)
+    assert registry.get_lobby(7) is lobby
+    assert registry.get_lobby(8) is None
+    p1 = player(1)
+    registry.add_player(p1)
+    lobby.connections.append(p1.connection)
+    registry.join_lobby(lobby, p1)
+    assert registry.lobby_of(p1) is lobby
+    registry.remove_player(p1.connection)
+    assert registry.lobby_of(p1) is None
+
+
+def test_removing_a_lobby_releases_its_connections():
+    registry = Registry()
+    lobby = GameInstance(7, 1, 2)
+    registry.add_lobby(lobby)
+    p1 = player(1)
+    lobby.connections.append(p1.connection)
+    registry.join_lobby(lobby, p1)
+    watcher = FakeConnection()
+    lobby.spectators.add(watcher, 1)
+    registry.spectating[watcher] = lobby
+    # a lobby opened again for the same game is not removed by the old one
+    replacement = GameInstance(7, 1, 2)
+    registry.add_lobby(replacement)
+    registry.remove_lobby(7, lobby)
+    assert registry.get_lobby(7) is replacement
+    assert registry.lobby_by_conn == {}
+    assert registry.spectating == {}
+    registry.remove_lobby(7, replacement)
+    assert registry.lobbies == {}
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import restart
+import server
+from gameinstance import GameInstance, update
+from input_buffer import MOVE_UP
+from lib import Vector2
+from player import Player
+from session import Session
+from fakes import FakeConnection
+
+GAME_ID = 4242
+
+
+def positions(lobby: GameInstance) -> tuple:
+    return (
+        lobby.tick_count, lobby.serve_tick, lobby.p1_score, lobby.p2_score,
+        lobby.ball.shape.x, lobby.ball.shape.y,
+        lobby.ball.dir_vect.x, lobby.ball.dir_vect.y,
+        lobby.ball.movement_speed, lobby.p1_paddle.shape.y,
+        lobby.p2_paddle.shape.y, lobby.p1_input.pending(),
+        lobby.history.head, lobby.history.size, list(lobby.history.ball_x)
+    )
+
+
+async def running_lobby() -> GameInstance:
+    lobby = GameInstance(GAME_ID, 1, 2)
+    lobby.game_running = True
+    lobby.ball.dir_vect = Vector2(1, -1)
+    lobby.p1_score = 2
+    lobby.p2_score = 3
+    for _ in range(40):
+        await update(lobby)
+    lobby.p1_input.push(MOVE_UP, 1234, lobby.tick_count - 1)
+    return lobby
+
+
+async def rejoin(user_id: int) -> FakeConnection:
+    connection = FakeConnection()
+    player = Player(user_id, f"p{user_id}", 0, 0, connection)
+    await server.process_message('START_GAME', {
+        'type': 'START_GAME', 'game_id': GAME_ID,
+        'player1_id': 1, 'player2_id': 2
+    }, Session(connection, player))
+    return connection
+
+
+async def hand_over() -> tuple[tuple, GameInstance, list[FakeConnection]]:
+    lobby = await running_lobby()
+    expected = positions(lobby)
+    assert restart.write_snapshot(0, [lobby]) == 1
+    assert restart.restore_lobbies(server.LIFECYCLE, 0) == 1
+    assert not os.path.exists(restart.snapshot_path(0))
+    restored = server.REGISTRY.get_lobby(GAME_ID)
+    assert restored is not lobby
+    assert positions(restored) == expected
+    assert restored.resumed and not restored.game_running
+    connections = [await rejoin(1), await rejoin(2)]
+    # the waiting task starts the lobby once both are back
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert restored.game_running
+    await server.SCHEDULER.step()
+    return expected, restored, connections
+
+
+def test_restored_match_continues_for_rejoining_players(
+        tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        restart, 'RESTART_SNAPSHOT', str(tmp_path / 'snapshot.json'))
+    expected, restored, connections = asyncio.run(hand_over())
+    try:
+        tick = expected[0]
+        assert restored.tick_count == tick + 1
+        for player_id, connection in enumerate(connections, start=1):
+            messages = connection.messages()
+            assert messages[0] == {'type': 'ID', 'player_id': player_id}
+            assert messages[1] == {
+                'type': 'RESUME', 'score_player1': 2, 'score_player2': 3,
+                'tick': tick
+            }
+            states = [m for m in messages if m['type'] == 'STATE']
+            assert states[0]['tick'] == tick
+            assert states[0]['ball'] == {'x': expected[4], 'y': expected[5]}
+    finally:
+        restored.kill()
+    assert server.REGISTRY.get_lobby(GAME_ID) is None
+
+
+def test_stale_snapshot_is_discarded(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        restart, 'RESTART_SNAPSHOT', str(tmp_path / 'snapshot.json'))
+    monkeypatch.setattr(restart, 'RESTART_SNAPSHOT_MAX_AGE_SEC', -1)
+    lobby = asyncio.run(running_lobby())
+    restart.write_snapshot(0, [lobby])
+    assert restart.read_snapshot(0) == []
+    assert not os.path.exists(restart.snapshot_path(0))
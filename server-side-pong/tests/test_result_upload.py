@@ -0,0 +1,80 @@
+import asyncio
+import os
+import threading
+import pytest
+import result_upload
+from result_upload import ResultUploader
+from stub_backend import StubBackendHandler, serve_stub
+
+RESULT = {
+    'winner_id': 1, 'score_player1': 5, 'score_player2': 3,
+    'finished_at': '2026-01-01 12:00:00'
+}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(result_upload, 'UPLOAD_BACKOFF_SEC', 0.01)
+    monkeypatch.setattr(result_upload, 'UPLOAD_MAX_ATTEMPTS', 3)
+    server = serve_stub(0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    StubBackendHandler.failure_rate = 0.0
+
+
+async def upload(uploader: ResultUploader, results: dict[int, dict]):
+    """
+    Runs the uploader until every result submitted or found in its spool
+    was either accepted or given up on.
+    """
+    runner = asyncio.create_task(uploader.run())
+    for db_game_id, result in results.items():
+        uploader.submit(db_game_id, result)
+    await asyncio.sleep(0.05)
+    while uploader.pending or uploader.deliveries:
+        await asyncio.sleep(0.01)
+    runner.cancel()
+
+
+def spooled(spool_dir) -> list[str]:
+    return sorted(os.listdir(spool_dir)) if os.path.isdir(spool_dir) else []
+
+
+def test_results_are_delivered_and_unspooled(backend, tmp_path):
+    uploader = ResultUploader(backend, str(tmp_path))
+    results = {101: RESULT, 102: RESULT | {'winner_id': 2}}
+    asyncio.run(upload(uploader, results))
+    for db_game_id, result in results.items():
+        assert StubBackendHandler.finished[db_game_id] == result
+    assert spooled(tmp_path) == []
+
+
+def test_failed_results_stay_spooled_until_replayed(backend, tmp_path):
+    StubBackendHandler.failure_rate = 1.0
+    uploader = ResultUploader(backend, str(tmp_path))
+    put = uploader.put
+    attempts = []
+
+    def counted_put(db_game_id: int, result: dict) -> int:
+        attempts.append(db_game_id)
+        return put(db_game_id, result)
+    uploader.put = counted_put
+    asyncio.run(upload(uploader, {201: RESULT}))
+    assert attempts == [201] * result_upload.UPLOAD_MAX_ATTEMPTS
+    assert 201 not in StubBackendHandler.finished
+    assert spooled(tmp_path) == ['201.json']
+    # the next process finds the result in the spool once the backend is up
+    StubBackendHandler.failure_rate = 0.0
+    asyncio.run(upload(ResultUploader(backend, str(tmp_path)), {}))
+    assert StubBackendHandler.finished[201] == RESULT
+    assert spooled(tmp_path) == []
+
+
+def test_client_errors_are_not_retried(backend, tmp_path):
+    uploader = ResultUploader(backend + '/missing', str(tmp_path))
+    asyncio.run(upload(uploader, {301: RESULT}))
+    assert 301 not in StubBackendHandler.finished
+    assert spooled(tmp_path) == []
@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from gameinstance import (
+    REWIND_TICKS, TICK, GameInstance, in_reach, rewind_move, update
+)
+from input_buffer import MOVE_DOWN
+from lib import Vector2
+from player import Player
+from rewind import REWIND_MAX_MS
+
+# enough to move the left paddle from the top edge in front of the ball
+BLOCK_STEPS = 12
+
+
+def lobby(ball_x: float, ball_y: float, dir_x: int) -> GameInstance:
+    game = GameInstance(1, 1, 2)
+    game.game_running = True
+    game.ball.shape.x = ball_x
+    game.ball.shape.y = ball_y
+    game.ball.dir_vect = Vector2(dir_x, 0)
+    return game
+
+
+def run_ticks(game: GameInstance, ticks: int):
+    async def run():
+        for _ in range(ticks):
+            await update(game)
+    asyncio.run(run())
+
+
+def test_late_block_is_rewound():
+    # passes below the left paddle, which stays at the top edge
+    game = lobby(60, 185, -1)
+    run_ticks(game, 8)
+    assert game.ball.dir_vect.x < 0
+    issued = game.tick_count - 8
+    assert in_reach(game, True, game.history.slot(issued))
+    assert rewind_move(game, game.p1_paddle, BLOCK_STEPS, issued)
+    # blocked at the issued tick, the ball was sent back
+    assert game.ball.dir_vect.x > 0
+    assert game.ball.shape.x > 30
+    moved = game.p1_paddle.shape.y
+    assert moved > 0
+    assert game.history.p1_y[game.history.head] == moved
+    assert game.p2_paddle.shape.y == 0
+
+
+def test_move_out_of_reach_is_applied_now():
+    game = lobby(500, 185, 1)
+    run_ticks(game, 5)
+    before = (game.ball.shape.x, game.ball.shape.y, game.ball.dir_vect.x)
+    issued = game.tick_count - 5
+    first = game.history.slot(issued)
+    assert not in_reach(game, True, first)
+    assert not in_reach(game, False, first)
+    assert not rewind_move(game, game.p1_paddle, BLOCK_STEPS, issued)
+    after = (game.ball.shape.x, game.ball.shape.y, game.ball.dir_vect.x)
+    assert after == before
+    assert game.p1_paddle.shape.y == 0
+
+
+def test_reach_is_per_side():
+    game = lobby(1024 - 80, 185, 1)
+    run_ticks(game, 4)
+    first = game.history.slot(game.tick_count - 4)
+    assert in_reach(game, False, first)
+    assert not in_reach(game, True, first)
+
+
+def test_moves_older_than_the_history_are_not_rewound():
+    game = lobby(60, 185, -1)
+    run_ticks(game, REWIND_TICKS + 3)
+    issued = game.tick_count - REWIND_TICKS - 2
+    assert game.history.slot(issued) is None
+    assert not rewind_move(game, game.p1_paddle, BLOCK_STEPS, issued)
+
+
+@pytest.mark.parametrize('latency, lag_ms', [
+    (0.0, 0), (0.1, 50), (10.0, REWIND_MAX_MS)
+])
+def test_issue_tick_follows_the_keepalive_round_trip(latency, lag_ms):
+    game = GameInstance(1, 1, 2)
+    game.tick_count = 100
+    player = Player(1, 'p1', 0, 0, SimpleNamespace(latency=latency))
+    # the HEARTBEAT estimate depends on the client's clock, it is ignored
+    player.ping = 10_000
+    game.push_input(player, MOVE_DOWN, 0)
+    [(_, _, tick)] = game.p1_input.pending()
+    assert tick == 100 - round(lag_ms / TICK)
@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+import sendqueue
+from rates import SNAPSHOT_INTERVALS, SNAPSHOT_PING_MS
+from sendqueue import (
+    REDUCED_RATE, SEND_DROP_BYTES, SEND_HIGH_WATER, SEND_MAX_QUEUED,
+    SEND_QUEUES, SendQueue, close_queue, deliver, open_queue, send,
+    snapshot_due
+)
+from fakes import FakeConnection
+
+
+@pytest.fixture
+def queue():
+    queue = SendQueue(FakeConnection())
+    yield queue
+    REDUCED_RATE.discard(queue.connection)
+
+
+def test_every_rate_has_a_round_trip_limit():
+    assert len(SNAPSHOT_PING_MS) == len(SNAPSHOT_INTERVALS) - 1
+
+
+def test_round_trip_selects_each_rate(queue):
+    queue.adapt(0)
+    assert queue.rate == 0
+    for rate, limit in enumerate(SNAPSHOT_PING_MS, start=1):
+        queue.adapt(limit - 1)
+        assert queue.rate == rate - 1
+        queue.adapt(limit)
+        assert queue.rate == rate
+        assert queue.connection in REDUCED_RATE
+    queue.adapt(0)
+    assert queue.rate == 0
+    assert queue.connection not in REDUCED_RATE
+
+
+def test_congestion_keeps_the_lowered_rate_once(queue, monkeypatch):
+    monkeypatch.setattr(sendqueue, 'SNAPSHOT_PING_MS', (100, 200, 300))
+    monkeypatch.setattr(sendqueue, 'SNAPSHOT_INTERVALS', (1, 2, 3, 6))
+    queue.set_rate(3)
+    queue.congested = True
+    queue.adapt(0)
+    assert queue.rate == 3
+    queue.adapt(0)
+    assert queue.rate == 0
+
+
+@pytest.fixture
+def opened():
+    connections = []
+
+    def open_connection(buffered=0, connection=None) -> FakeConnection:
+        connection = connection or FakeConnection()
+        connection.transport.buffered = buffered
+        open_queue(connection)
+        connections.append(connection)
+        return connection
+    yield open_connection
+    for connection in connections:
+        close_queue(connection)
+
+
+def test_idle_connections_are_written_directly(opened):
+    connection = opened()
+    deliver([connection], 'hello')
+    assert connection.protocol.sent == ['hello']
+    assert SEND_QUEUES[connection].writer is None
+
+
+def test_congested_connection_keeps_only_the_newest_state(opened):
+    async def run() -> FakeConnection:
+        connection = opened(SEND_HIGH_WATER)
+        deliver([connection], 'state 1', coalesce=True)
+        deliver([connection], 'score')
+        deliver([connection], 'state 2', coalesce=True)
+        queue = SEND_QUEUES[connection]
+        assert queue.rate == 1
+        assert queue.writer is not None
+        await queue.writer
+        return connection
+    connection = asyncio.run(run())
+    # queued messages go first, the replaced STATE is never sent
+    assert connection.protocol.sent == ['score', 'state 2']
+
+
+def test_reduced_rate_skips_states(opened):
+    full, reduced = opened(), opened()
+    SEND_QUEUES[reduced].set_rate(1)
+    interval = SNAPSHOT_INTERVALS[1]
+    due = [tick for tick in range(4 * interval)
+           if reduced in snapshot_due([full, reduced], tick)]
+    assert len(due) == 4
+    assert all(b - a == interval for a, b in zip(due, due[1:]))
+    assert snapshot_due([full], 1) == [full]
+
+
+def test_connection_past_the_drop_limit_is_aborted(opened):
+    async def run() -> FakeConnection:
+        connection = opened(SEND_DROP_BYTES + 1)
+        deliver([connection], 'state', coalesce=True)
+        return connection
+    connection = asyncio.run(run())
+    queue = SEND_QUEUES[connection]
+    assert queue.dropped and connection.transport.aborted
+    assert not send(connection, 'more')
+    assert connection.protocol.sent == []
+
+
+def test_too_many_queued_messages_drop_the_connection(opened):
+    async def run() -> FakeConnection:
+        connection = opened(SEND_HIGH_WATER)
+        for i in range(SEND_MAX_QUEUED + 1):
+            deliver([connection], f"message {i}")
+        return connection
+    connection = asyncio.run(run())
+    assert SEND_QUEUES[connection].dropped
+    assert connection.transport.aborted
+
+
+class StalledConnection(FakeConnection):
+    async def send(self, data):
+        await asyncio.Event().wait()
+
+
+def test_stalled_writer_drops_the_connection(opened, monkeypatch):
+    monkeypatch.setattr(sendqueue, 'SEND_STALL_SEC', 0.01)
+
+    async def run() -> StalledConnection:
+        connection = opened(SEND_HIGH_WATER, StalledConnection())
+        deliver([connection], 'score')
+        await SEND_QUEUES[connection].writer
+        return connection
+    connection = asyncio.run(run())
+    assert SEND_QUEUES[connection].dropped
+    assert connection.transport.aborted
@@ -0,0 +1,46 @@
+import asyncio
+import base64
+import socket
+from websockets.client import ClientProtocol
+from websockets.protocol import OPEN
+from websockets.uri import parse_uri
+from shard import HandoffReceiver
+
+
+def client_frames(*messages: str) -> bytes:
+    client = ClientProtocol(parse_uri('ws://test/'), state=OPEN)
+    for message in messages:
+        client.send_text(message.encode())
+    return b''.join(client.data_to_send())
+
+
+async def adopt_split_stream() -> list[str]:
+    ours, theirs = socket.socketpair()
+    # read by the previous shard before it handed the socket over
+    prefix = client_frames('first')
+    # sent by the client meanwhile, waiting in the socket for the new owner
+    theirs.sendall(client_frames('second', 'third'))
+    received = []
+
+    async def on_adopt(connection, player):
+        assert player.user_id == 7
+        # closing an older connection of the player takes a while
+        await asyncio.sleep(0.05)
+        for _ in range(3):
+            received.append(await connection.recv())
+        # the client goes away instead of answering the close
+        theirs.close()
+
+    receiver = HandoffReceiver.__new__(HandoffReceiver)
+    receiver.server = None
+    receiver.on_adopt = on_adopt
+    await receiver.adopt(ours.detach(), {
+        'user_id': 7, 'username': 'p7', 'iat': 0, 'exp': 0,
+        'subprotocol': None,
+        'prefix': base64.b64encode(prefix).decode()
+    })
+    return received
+
+
+def test_adopted_connection_replays_the_prefix_first():
+    assert asyncio.run(adopt_split_stream()) == ['first', 'second', 'third']
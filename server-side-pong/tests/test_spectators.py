@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+import spectators
+from frames import SUBPROTOCOL_BINARY
+from gameinstance import GameInstance, get_game_state
+from spectators import (
+    SPECTATOR_DROP_BYTES, SPECTATOR_HIGH_WATER, SpectatorFanOut,
+    spectator_interval
+)
+from fakes import FakeConnection
+
+
+@pytest.fixture(autouse=True)
+def fan_out(monkeypatch) -> SpectatorFanOut:
+    fan_out = SpectatorFanOut()
+    monkeypatch.setattr(spectators, 'FAN_OUT', fan_out)
+    return fan_out
+
+
+def publish_state(lobby: GameInstance, tick: int):
+    lobby.tick_count = tick
+    lobby.pipeline.publish(get_game_state(lobby))
+
+
+async def after_tick():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+async def watch(fan_out: SpectatorFanOut) -> dict[str, FakeConnection]:
+    lobby = GameInstance(1, 1, 2)
+    watchers = {
+        'text': FakeConnection(),
+        'binary': FakeConnection(SUBPROTOCOL_BINARY),
+        'slow': FakeConnection(),
+        'dead': FakeConnection(),
+    }
+    watchers['slow'].transport.buffered = SPECTATOR_HIGH_WATER + 1
+    watchers['dead'].transport.buffered = SPECTATOR_DROP_BYTES + 1
+    for connection in watchers.values():
+        lobby.spectators.add(connection, spectator_interval(None))
+    runner = asyncio.create_task(fan_out.run())
+    # one tick, only its newest STATE is written
+    lobby.pipeline.publish({'type': 'LOBBY_WAIT'})
+    publish_state(lobby, 0)
+    lobby.pipeline.publish({'type': 'SCORE', 'tick': 0, 'scored_by': 'p1'})
+    publish_state(lobby, 1)
+    # nothing is written during the tick
+    assert watchers['text'].protocol.sent == []
+    await after_tick()
+    # below the spectator rate
+    publish_state(lobby, 2)
+    await after_tick()
+    publish_state(lobby, 1 + spectator_interval(None))
+    lobby.pipeline.publish({'type': 'ERROR', 'message': 'Lobby timed out'})
+    await after_tick()
+    lobby.pipeline.publish({
+        'type': 'GAME_END', 'tick': 5, 'winner_id': 1,
+        'score_player1': 5, 'score_player2': 0
+    })
+    lobby.kill()
+    await after_tick()
+    assert len(lobby.spectators) == 0
+    runner.cancel()
+    return watchers
+
+
+def test_fan_out_writes_game_frames_after_the_tick(fan_out):
+    watchers = asyncio.run(watch(fan_out))
+    text = watchers['text'].messages()
+    assert [m['type'] for m in text] == ['SCORE', 'STATE', 'STATE', 'GAME_END']
+    assert [m['tick'] for m in text if m['type'] == 'STATE'] == \
+        [1, 1 + spectator_interval(None)]
+    binary = watchers['binary'].protocol.sent
+    assert len(binary) == 4
+    assert all(isinstance(data, bytes) for data in binary)
+    # a backed up socket only skips STATE
+    assert watchers['slow'].types() == ['SCORE', 'GAME_END']
+    assert watchers['dead'].transport.aborted
+    assert watchers['dead'].protocol.sent == []
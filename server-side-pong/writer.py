@@ -0,0 +1,73 @@
+"""
+Blocking writes for the event loop, done on a background thread in batches.
+"""
+import atexit
+import os
+from abc import ABC, abstractmethod
+import threading
+from collections import deque
+from time import sleep
+
+
+class BackgroundWriter(ABC):
+    """
+    A bounded queue and the daemon thread that drains it every `flush_sec`
+    into `write`. The thread is started by the first record, in a forked
+    shard by the first record of that process. A record that finds the queue
+    full is counted in `dropped` and discarded.
+    """
+    name: str
+    queue_max: int
+    flush_sec: float
+    records: deque
+    dropped: int
+    lock: threading.Lock
+    thread: threading.Thread | None
+
+    def __init__(self, name: str, queue_max: int, flush_sec: float):
+        self.name = name
+        self.queue_max = queue_max
+        self.flush_sec = flush_sec
+        self.records = deque()
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        os.register_at_fork(after_in_child=self.after_fork)
+        atexit.register(self.flush)
+
+    def put(self, record) -> bool:
+        """
+        Returns False when the queue is full and the record was dropped.
+        """
+        if len(self.records) >= self.queue_max:
+            self.dropped += 1
+            return False
+        self.records.append(record)
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name=self.name, daemon=True)
+            self.thread.start()
+        return True
+
+    @abstractmethod
+    def write(self, records: list):
+        ...
+
+    def flush(self):
+        with self.lock:
+            records = []
+            while self.records:
+                records.append(self.records.popleft())
+            if records:
+                self.write(records)
+
+    def run(self):
+        while True:
+            sleep(self.flush_sec)
+            self.flush()
+
+    def after_fork(self):
+        # the parent's thread does not exist in the child and its lock may
+        # have been held while forking
+        self.lock = threading.Lock()
+        self.thread = None